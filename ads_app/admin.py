@@ -1,14 +1,21 @@
 from django.contrib import admin
-from ads_app.models import Comment, Category, Advert
+from ads_app.models import Comment, Category, Advert, Tag
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
-    pass
+    list_display = ('author', 'created', 'advert')
+    list_select_related = ('advert',)
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     pass
 
+class TagInline(admin.TabularInline):
+    model = Tag
+    extra = 1
+
 @admin.register(Advert)
 class AdvertAdmin(admin.ModelAdmin):
-	pass
\ No newline at end of file
+    list_display = ('title', 'author', 'category', 'created')
+    list_select_related = ('author', 'category')
+    inlines = [TagInline]
\ No newline at end of file
@@ -0,0 +1,447 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.utils.module_loading import import_string
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from ads_app import cache, metrics, pagecache, pagination, stats, views
+from ads_app.models import Advert
+from ads_app.redis_client import breaker, guarded
+import asyncio
+import contextvars
+import io
+import logging
+import re
+import redis
+import redis.asyncio
+import sys
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# Асинхронный путь для чтения (ASGI). Горячие данные читаются из Redis
+# асинхронным клиентом; всё, что требует базы (промах кеша, поиск, фильтр
+# по тегам), уходит в ограниченный пул потоков с обычным синхронным кодом.
+# Так один процесс держит много одновременных медленных запросов, а число
+# одновременных обращений к MongoDB ограничено размером пула.
+#
+# Асинхронно обслуживаются только гостевые GET-запросы к ленте, странице
+# объявления и статистике. Всё остальное (вход, формы, админка, запросы
+# с сессией или с ещё не записанными комментариями автора) передаётся
+# обычному WSGI-приложению Django в том же пуле.
+#
+# Асинхронные маршруты проходят те же слои settings.MIDDLEWARE, что и
+# WSGI-приложение (см. MIDDLEWARE_MODES). Обработчик Django здесь не
+# используется: в Django 2.2 он синхронный. Поэтому асинхронный путь знает
+# только слои из MIDDLEWARE_MODES; с любым другим слоем в настройках все
+# запросы обслуживает WSGI-приложение.
+
+ASYNC_THREADS = getattr(settings, 'ASYNC_THREADS', 20)
+PAGE_CACHE = 'ads_app.pagecache.PageCacheMiddleware' in settings.MIDDLEWARE
+
+executor = ThreadPoolExecutor(max_workers=ASYNC_THREADS, thread_name_prefix='asgi-sync')
+
+# Клиент и пул соединений привязаны к циклу событий.
+_clients = weakref.WeakKeyDictionary()
+
+
+def make_client():
+    pool = redis.asyncio.BlockingConnectionPool(
+        host=getattr(settings, 'REDIS_HOST', '127.0.0.1'),
+        port=getattr(settings, 'REDIS_PORT', 6379),
+        db=getattr(settings, 'REDIS_DB', 0),
+        password=getattr(settings, 'REDIS_PASSWORD', None),
+        max_connections=getattr(settings, 'REDIS_MAX_CONNECTIONS', 50),
+        timeout=getattr(settings, 'REDIS_POOL_TIMEOUT', 1),
+        socket_timeout=getattr(settings, 'REDIS_SOCKET_TIMEOUT', 0.5),
+        socket_connect_timeout=getattr(settings, 'REDIS_CONNECT_TIMEOUT', 0.5),
+    )
+    return redis.asyncio.Redis(connection_pool=pool)
+
+def client():
+    loop = asyncio.get_running_loop()
+    if loop not in _clients:
+        _clients[loop] = metrics.instrument(make_client())
+    return _clients[loop]
+
+
+def _call_sync(func, *args):
+    try:
+        with metrics.db_queries():
+            return func(*args)
+    finally:
+        close_old_connections()
+
+async def run_sync(func, *args):
+    # Контекст (замеры запроса, ads_app/metrics.py) уходит в поток вместе
+    # с вызовом.
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, partial(context.run, _call_sync, func, *args))
+
+async def read_through(fast, slow, *args):
+    # fast — асинхронное чтение из Redis, возвращает None при промахе;
+    # slow — синхронная функция кеша, которая умеет собрать значение.
+    # Пока цепь разомкнута или не сброшены ключи после сбоя, в Redis не ходим.
+    if breaker.is_open() or breaker.dirty:
+        return await run_sync(slow, *args)
+    try:
+        value = await fast(*args)
+    except redis.RedisError as error:
+        breaker.failure(error)
+        value = None
+    if value is None:
+        return await run_sync(slow, *args)
+    return value
+
+
+async def fast_adverts(ids, strict=False):
+    rows = {}
+    for pk in ids:
+        row = cache.local_peek(('advert', pk))
+        if row is not None:
+            rows[pk] = cache.Row(row)
+    remote = [pk for pk in ids if pk not in rows]
+    if remote:
+        async with client().pipeline(transaction=False) as pipe:
+            pipe.mget([cache.advert_key(pk) for pk in remote])
+            for pk in remote:
+                pipe.hget(cache.stats_key(pk), 'comments')
+            values, *counts = await pipe.execute()
+        values = [cache.loads(data) for data in values]
+        found = sum(data is not None and count is not None for data, count in zip(values, counts))
+        metrics.record_cache('l2', 'advert', hits=found, misses=len(remote) - found)
+        if found < len(remote):
+            return None
+        for pk, data, count in zip(remote, values, counts):
+            rows[pk] = cache.make_row(data)
+            rows[pk]['comment_count'] = int(count)
+    return [rows[pk] for pk in ids]
+
+async def fast_envelope(key):
+    envelope = cache.loads(await client().get(key))
+    metrics.record_cache('l2', cache.key_family(key), hits=envelope is not None, misses=envelope is None)
+    return None if envelope is None else envelope['v']
+
+async def fast_comments(pk):
+    rows = await fast_envelope(cache.comments_key(pk))
+    return None if rows is None else [cache.make_row(row) for row in rows]
+
+async def fast_categories():
+    rows = cache.local_peek(('categories',))
+    if rows is not None:
+        return rows
+    rows = await fast_envelope(cache.categories_key())
+    return None if rows is None else [cache.make_row(row) for row in rows]
+
+async def fast_page(request):
+    if 'tag' in request.GET or 'btnSearch' in request.GET:
+        return None
+    size = pagination.page_size(request.GET.get('size'))
+    token = request.GET.get('cursor')
+    cursor = pagination.Cursor.decode(token) if token else None
+    page = await fast_envelope(pagination.page_key(cursor, size))
+    if page is None:
+        return None
+    if cursor is None or cursor.direction == pagination.PREV:
+        pagecache.tag(request, 'head')
+    pagecache.tag(request, *map(pagecache.advert_tag, page['ids']))
+    return page
+
+async def fast_stats(ids):
+    async with client().pipeline(transaction=False) as pipe:
+        for pk in ids:
+            pipe.hgetall(cache.stats_key(pk))
+        values = await pipe.execute()
+    if not all(values):
+        return None
+    return {pk: {field: int(row.get(field.encode(), 0)) for field in stats.FIELDS}
+            for pk, row in zip(ids, values)}
+
+
+async def fast_page_cache(key):
+    data, epoch = await client().mget([key, pagecache.epoch_key()])
+    metrics.record_cache('l2', 'pagecache', hits=data is not None, misses=data is None)
+    return cache.loads(data), epoch
+
+async def cached_page(request):
+    # Тот же кеш страниц, что и в PageCacheMiddleware.
+    key = pagecache.page_key(request)
+    if not PAGE_CACHE or breaker.is_open() or breaker.dirty:
+        return key, None, None
+    try:
+        data, epoch = await fast_page_cache(key)
+    except redis.RedisError as error:
+        breaker.failure(error)
+        return key, None, None
+    if data is None:
+        return key, None, epoch
+    content = data['content']
+    if data['type'].startswith('text/html'):
+        # Куски с токеном CSRF ни в базу, ни в Redis не ходят.
+        content = pagecache._render_fragments(content, request)
+    response = HttpResponse(content, content_type=data['type'])
+    response['X-Page-Cache'] = 'hit'
+    return key, response, epoch
+
+async def store_page(request, key, epoch, response):
+    # Условия те же, что в PageCacheMiddleware.
+    names = getattr(request, 'page_cache_tags', None)
+    if not (PAGE_CACHE and names and response.status_code == 200 and not response.cookies):
+        return
+    if await run_sync(pagecache._store, key, epoch, response, names, getattr(request, 'advert_view', None)):
+        response['X-Page-Cache'] = 'miss'
+
+
+def render_page(template_name, context, request):
+    # Шаблоны ходят в Redis (карточки ленты, {% advert_cards %}), поэтому
+    # отрисовка идёт в пуле потоков, а не в цикле событий.
+    return HttpResponse(render_to_string(template_name, context, request))
+
+
+async def advert_list(request):
+    key, response, epoch = await cached_page(request)
+    if response is not None:
+        return response
+    page = await read_through(fast_page, views.get_page_ids, request)
+    page['adverts'] = await read_through(fast_adverts, cache.get_adverts, page['ids'])
+    if request.GET.get('format') == 'json':
+        response = JsonResponse(views.get_list_json(page))
+    else:
+        categories = await read_through(fast_categories, cache.get_categories)
+        context = views.get_list_context(request, page, categories)
+        response = await run_sync(render_page, 'advert_list.html', context, request)
+    await store_page(request, key, epoch, response)
+    return response
+
+async def advert_detail(request, pk):
+    if 'before' in request.GET:
+        return None
+    key, response, epoch = await cached_page(request)
+    if response is None:
+        try:
+            advert = (await read_through(fast_adverts, cache.get_adverts, [pk], True))[0]
+        except Advert.DoesNotExist:
+            return None
+        comments = await read_through(fast_comments, cache.get_comments, pk)
+        context = views.get_detail_context(request, advert, comments, advert.comment_count > len(comments))
+        response = await run_sync(render_page, 'advert_detail.html', context, request)
+        request.advert_view = pk
+        await store_page(request, key, epoch, response)
+    # Счётчик в памяти; в Redis он уходит в пуле потоков.
+    if stats.count_view(pk):
+        await run_sync(guarded(stats.flush_views))
+    return response
+
+async def advert_stats(request, pk):
+    values = (await read_through(fast_stats, stats.get_many, [pk])).get(pk)
+    if values is None:
+        return JsonResponse({'error': 'Объявление не найдено'}, status=404)
+    return JsonResponse({'id': pk, **values})
+
+async def advert_stats_batch(request):
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk]
+    except ValueError:
+        return JsonResponse({'error': 'Параметр ids должен содержать числа через запятую'}, status=400)
+    found = await read_through(fast_stats, stats.get_many, ids) if ids else {}
+    return JsonResponse({'stats': [{'id': pk, **values} for pk, values in found.items()]})
+
+
+# Маршруты асинхронного пути. Представление может вернуть None — тогда
+# запрос обслуживает WSGI-приложение (например, объявление не найдено).
+ROUTES = [
+    (re.compile(r'^/$'), advert_list),
+    (re.compile(r'^/id(?P<pk>\d+)$'), advert_detail),
+    (re.compile(r'^/id(?P<pk>\d+)/stats$'), advert_stats),
+    (re.compile(r'^/stats$'), advert_stats_batch),
+]
+
+# Как асинхронный путь проходит каждый слой settings.MIDDLEWARE:
+#   HOOKS   — process_request, process_view и process_response самого слоя
+#             по порядку, как в Django. Для гостя без cookie сессии они не
+#             ходят ни в базу, ни в Redis: сессия пуста и не сохраняется,
+#             пользователь — AnonymousUser;
+#   METRICS — замеры запроса (ads_app/metrics.py), в том числе в пуле потоков;
+#   VIEWS   — кеш страниц: асинхронные представления читают и пишут его
+#             сами (cached_page, store_page);
+#   STATIC  — WhiteNoise отдаёт только STATIC_URL, куда маршруты не ведут.
+# Слой не из таблицы молча пропустить нельзя: тогда асинхронный путь
+# выключается целиком (load_middleware вернёт None), с предупреждением в логе.
+HOOKS, METRICS, VIEWS, STATIC = 'hooks', 'metrics', 'views', 'static'
+MIDDLEWARE_MODES = {
+    'django.middleware.security.SecurityMiddleware': HOOKS,
+    'whitenoise.middleware.WhiteNoiseMiddleware': STATIC,
+    'ads_app.metrics.MetricsMiddleware': METRICS,
+    'django.contrib.sessions.middleware.SessionMiddleware': HOOKS,
+    'django.middleware.common.CommonMiddleware': HOOKS,
+    'django.middleware.csrf.CsrfViewMiddleware': HOOKS,
+    'django.contrib.auth.middleware.AuthenticationMiddleware': HOOKS,
+    'django.contrib.messages.middleware.MessageMiddleware': HOOKS,
+    'ads_app.pagecache.PageCacheMiddleware': VIEWS,
+    'django.middleware.clickjacking.XFrameOptionsMiddleware': HOOKS,
+}
+
+
+def load_middleware(names):
+    layers = []
+    for name in names:
+        mode = MIDDLEWARE_MODES.get(name)
+        if mode is None:
+            logger.warning('%s: не описано, как этот слой работает на асинхронном пути '
+                           '(ads_app/aio.py, MIDDLEWARE_MODES); все запросы идут в WSGI-приложение', name)
+            return None
+        if mode == STATIC and any(pattern.match(settings.STATIC_URL) for pattern, view in ROUTES):
+            raise ImproperlyConfigured(f'{name}: асинхронный маршрут совпадает с STATIC_URL')
+        layers.append((mode, import_string(name)() if mode == HOOKS else None))
+    return layers
+
+
+def scope_to_environ(scope, body=b''):
+    path = scope.get('raw_path') or scope['path'].encode()
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': path.split(b'?', 1)[0].decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').lower()
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def response_headers(response):
+    headers = [(name.encode('latin1'), value.encode('latin1')) for name, value in response.items()]
+    for cookie in response.cookies.values():
+        headers.append((b'Set-Cookie', cookie.output(header='').strip().encode('latin1')))
+    return headers
+
+
+class AsyncApplication:
+    def __init__(self, wsgi_application, middleware=None):
+        self.wsgi_application = wsgi_application
+        self.layers = load_middleware(settings.MIDDLEWARE if middleware is None else middleware)
+        self.view_hooks = [instance for mode, instance in self.layers or ()
+                           if mode == HOOKS and hasattr(instance, 'process_view')]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f'Неподдерживаемый тип соединения: {scope["type"]}')
+        body = await self.read_body(receive)
+        response = None
+        if self.is_async(scope):
+            response = await self.dispatch(scope)
+        if response is None:
+            status, headers, content = await run_sync(self.call_wsgi, scope_to_environ(scope, body))
+        else:
+            status, headers, content = response.status_code, response_headers(response), response.content
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else content})
+
+    def is_async(self, scope):
+        if self.layers is None or scope['method'] not in ('GET', 'HEAD'):
+            return False
+        cookie = dict(scope.get('headers', [])).get(b'cookie', b'').decode('latin1')
+        return all(f'{name}=' not in cookie for name in (settings.SESSION_COOKIE_NAME, pagecache.PENDING_COOKIE))
+
+    async def dispatch(self, scope):
+        for pattern, view in ROUTES:
+            match = pattern.match(scope['path'])
+            if match is None:
+                continue
+            request = WSGIRequest(scope_to_environ(scope))
+            kwargs = {name: int(value) for name, value in match.groupdict().items()}
+            return await self.handle(self.layers, request, view, kwargs)
+        return None
+
+    async def handle(self, layers, request, view, kwargs):
+        # Слои по порядку settings.MIDDLEWARE. None — запрос обслужит
+        # WSGI-приложение, со всеми слоями заново.
+        if not layers:
+            for middleware in self.view_hooks:
+                response = middleware.process_view(request, view, (), kwargs)
+                if response is not None:
+                    return response
+            return await view(request, **kwargs)
+        (mode, middleware), layers = layers[0], layers[1:]
+        if mode == METRICS:
+            request_metrics = metrics.start()
+            with metrics.measure(request_metrics):
+                response = await self.handle(layers, request, view, kwargs)
+            if response is not None and request_metrics is not None:
+                metrics.finish(request, response, request_metrics)
+            return response
+        if mode != HOOKS:
+            return await self.handle(layers, request, view, kwargs)
+        response = None
+        if hasattr(middleware, 'process_request'):
+            response = middleware.process_request(request)
+        if response is None:
+            response = await self.handle(layers, request, view, kwargs)
+            if response is None:
+                return None
+        if hasattr(middleware, 'process_response'):
+            response = middleware.process_response(request, response)
+        return response
+
+    async def read_body(self, receive):
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return body
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                return body
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Поток-подписчик L1 запускается здесь, а не из цикла событий.
+                await run_sync(cache.listener.ensure_started, cache.redis_cache)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def call_wsgi(self, environ):
+        # Ответ WSGI-приложения собирается целиком: потоковые ответы здесь
+        # не нужны, а заголовки и тело отдаются в цикл событий одним куском.
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return started['status'], started['headers'], content
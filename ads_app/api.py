@@ -0,0 +1,270 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import JsonResponse, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from ads_app.models import Comment, Advert, parse_tags
+from ads_app.forms import CommentForm, AdvertForm
+from ads_app import cache, ingest, stats
+import hashlib
+import json
+import math
+
+MAX_BULK = 100
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors
+
+
+def api_view(methods, login=False):
+    def decorator(view):
+        def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            if login and request.method != 'GET' and not request.user.is_authenticated:
+                return JsonResponse({'error': 'Требуется авторизация'}, status=401)
+            try:
+                return view(request, *args, **kwargs)
+            except ApiError as error:
+                body = {'error': str(error)}
+                if error.errors is not None:
+                    body['errors'] = error.errors
+                return JsonResponse(body, status=error.status)
+            except (Advert.DoesNotExist, Comment.DoesNotExist):
+                return JsonResponse({'error': 'Объект не найден'}, status=404)
+        wrapper.__name__ = view.__name__
+        return wrapper
+    return decorator
+
+def read_json(request):
+    try:
+        data = json.loads(request.body.decode() or '{}')
+    except ValueError:
+        raise ApiError('Некорректный JSON')
+    if not isinstance(data, dict):
+        raise ApiError('Ожидается JSON-объект')
+    return data
+
+def read_ids(request):
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk]
+    except ValueError:
+        raise ApiError('Параметр ids должен содержать числа через запятую')
+    if len(ids) > MAX_BULK:
+        raise ApiError(f'Не больше {MAX_BULK} id за запрос')
+    return ids
+
+def read_list(data, name):
+    items = data.get(name)
+    if not isinstance(items, list) or not items:
+        raise ApiError(f'Поле {name} должно быть непустым списком')
+    if len(items) > MAX_BULK:
+        raise ApiError(f'Не больше {MAX_BULK} элементов за запрос')
+    return items
+
+def etag_response(request, body):
+    content = json.dumps(body, ensure_ascii=False, sort_keys=True, cls=DjangoJSONEncoder)
+    etag = quote_etag(hashlib.md5(content.encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(body, json_dumps_params={'ensure_ascii': False})
+    response['ETag'] = etag
+    return response
+
+
+def comment_to_json(comment):
+    return cache.comment_to_row(comment)
+
+def advert_to_json(advert, comments=None, values=None):
+    body = dict(advert)
+    if comments is not None:
+        body['comments'] = [dict(comment) for comment in comments]
+    if values is not None:
+        body['stats'] = values
+    return body
+
+
+def validate_advert(data):
+    tags = data.get('tags', '')
+    if isinstance(tags, list):
+        tags = ' '.join(str(tag) for tag in tags)
+    form = AdvertForm({
+        'title': data.get('title'),
+        'content': data.get('content'),
+        'tags': tags,
+        'category': data.get('category'),
+    })
+    comments = data.get('comments') or []
+    if not isinstance(comments, list):
+        raise ApiError('Поле comments должно быть списком')
+    comment_forms = [validate_comment(comment) for comment in comments]
+    if not form.is_valid():
+        raise ApiError('Объявление не прошло проверку', errors=form.errors.get_json_data())
+    return form, comment_forms
+
+def validate_comment(data):
+    if not isinstance(data, dict):
+        raise ApiError('Комментарий должен быть JSON-объектом')
+    form = CommentForm({'author': data.get('author'), 'content': data.get('content')})
+    if not form.is_valid():
+        raise ApiError('Комментарий не прошёл проверку', errors=form.errors.get_json_data())
+    return form
+
+def save_advert(form, author):
+    advert = Advert()
+    advert.author = author
+    advert.title = form.cleaned_data['title']
+    advert.content = form.cleaned_data['content']
+    advert.category = form.cleaned_data['category']
+    advert.save()
+    advert.set_tags(parse_tags(form.cleaned_data['tags']))
+    return advert
+
+def add_comments(request, validated, accepted):
+    # Каждый комментарий — как отдельный POST /api/adverts/<id>/comments:
+    # с ограничением частоты и через буфер. Возвращает None или описание
+    # ошибки с индексом первого комментария, упёршегося в ограничение;
+    # принятые до него остаются в accepted.
+    for index, (form, advert_id) in enumerate(validated):
+        wait = ingest.throttle(request, advert_id)
+        if wait:
+            return {'error': f'Слишком много комментариев, попробуйте через {math.ceil(wait)} с', 'index': index}
+        token, comment = ingest.add(advert_id, form.cleaned_data['author'], form.cleaned_data['content'])
+        accepted.append({'token': token} if comment is None else {'id': comment.id})
+    return None
+
+
+@api_view(['GET', 'POST'], login=True)
+def adverts(request):
+    if request.method == 'GET':
+        found = cache.get_adverts(read_ids(request))
+        return JsonResponse({'adverts': [advert_to_json(advert) for advert in found]},
+                            json_dumps_params={'ensure_ascii': False})
+    form, comment_forms = validate_advert(read_json(request))
+    with transaction.atomic():
+        advert = save_advert(form, request.user)
+    # Объявление уже создано, поэтому и при ограничении частоты ответ 201:
+    # непринятые комментарии можно отправить позже.
+    accepted = []
+    error = add_comments(request, [(comment_form, advert.id) for comment_form in comment_forms], accepted)
+    return JsonResponse(dict(error or {}, id=advert.id, comments=accepted), status=201)
+
+@api_view(['POST'], login=True)
+def adverts_bulk(request):
+    items = read_list(read_json(request), 'adverts')
+    validated = []
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'error': 'Ожидается JSON-объект'})
+            continue
+        try:
+            validated.append(validate_advert(item))
+        except ApiError as error:
+            errors.append({'index': index, 'error': str(error), 'errors': error.errors})
+    if errors:
+        raise ApiError('Часть объявлений не прошла проверку', errors=errors)
+    with transaction.atomic():
+        ids = [save_advert(form, request.user).id for form, comment_forms in validated]
+    accepted = []
+    error = add_comments(request, [(comment_form, advert_id) for advert_id, (form, comment_forms)
+                                   in zip(ids, validated) for comment_form in comment_forms], accepted)
+    return JsonResponse(dict(error or {}, ids=ids, comments=accepted), status=201)
+
+@api_view(['GET'])
+def advert(request, pk):
+    body = advert_to_json(cache.get_advert(pk), cache.get_comments(pk), stats.get(pk))
+    return etag_response(request, body)
+
+@api_view(['POST'], login=True)
+def advert_tags(request, pk):
+    data = read_json(request)
+    names = data.get('tags', data.get('tag', ''))
+    if isinstance(names, list):
+        names = ' '.join(str(name) for name in names)
+    names = parse_tags(names)
+    if not names:
+        raise ApiError('Не указан тег')
+    target = Advert.objects.get(pk=pk)
+    if target.author_id != request.user.id and not request.user.is_superuser:
+        raise ApiError('Добавлять теги может только автор объявления', status=403)
+    with transaction.atomic():
+        added = [name for name in names if target.add_tag(name)]
+    return JsonResponse({'added': added, 'tags': target.tag_names}, status=201 if added else 200)
+
+@api_view(['GET', 'POST'])
+def advert_comments(request, pk):
+    if request.method == 'GET':
+        # Со встроенными комментариями сразу отдаются только последние,
+        # более ранние — страницами по ?before=<id>.
+        before = request.GET.get('before')
+        if before is None:
+            advert, comments = cache.get_detail(pk)
+            has_older = advert.comment_count > len(comments)
+        elif before.isdigit():
+            cache.get_advert(pk)
+            comments, has_older = cache.load_older_comments(pk, int(before))
+        else:
+            raise ApiError('Параметр before должен быть числом')
+        return JsonResponse({
+            'comments': [dict(comment) for comment in comments],
+            'before': comments[0]['id'] if comments and has_older else None,
+        }, json_dumps_params={'ensure_ascii': False})
+    form = validate_comment(read_json(request))
+    advert_id = cache.get_advert(pk).id
+    wait = ingest.throttle(request, advert_id)
+    if wait:
+        raise ApiError(f'Слишком много комментариев, попробуйте через {math.ceil(wait)} с', status=429)
+    # Как и форма на сайте, через буфер (ads_app/ingest.py): такой
+    # комментарий ещё не записан и id не имеет, только токен.
+    token, comment = ingest.add(advert_id, form.cleaned_data['author'], form.cleaned_data['content'])
+    if comment is None:
+        return JsonResponse({'token': token}, status=202)
+    return JsonResponse({'id': comment.id}, status=201)
+
+@api_view(['GET', 'POST'])
+def comments_bulk(request):
+    if request.method == 'GET':
+        found = Comment.objects.filter(pk__in=read_ids(request))
+        return JsonResponse({'comments': [comment_to_json(comment) for comment in found]},
+                            json_dumps_params={'ensure_ascii': False})
+    items = read_list(read_json(request), 'comments')
+    validated = []
+    errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'error': 'Ожидается JSON-объект'})
+            continue
+        advert_id = item.get('advert')
+        # bool — подкласс int, но id объявления из него не выйдет.
+        if not isinstance(advert_id, int) or isinstance(advert_id, bool):
+            errors.append({'index': index, 'error': 'Поле advert должно быть id объявления'})
+            continue
+        try:
+            validated.append((validate_comment(item), advert_id))
+        except ApiError as error:
+            errors.append({'index': index, 'error': str(error), 'errors': error.errors})
+    if errors:
+        raise ApiError('Часть комментариев не прошла проверку', errors=errors)
+    advert_ids = {advert_id for form, advert_id in validated}
+    known = {advert.id for advert in cache.get_adverts(list(advert_ids))}
+    unknown = advert_ids.difference(known)
+    if unknown:
+        raise ApiError('Объявления не найдены', status=404, errors=[str(pk) for pk in sorted(unknown)])
+    accepted = []
+    error = add_comments(request, validated, accepted)
+    if error:
+        return JsonResponse(dict(error, comments=accepted), status=429)
+    status = 201 if all('id' in item for item in accepted) else 202
+    return JsonResponse({'comments': accepted}, status=status)
+
+@api_view(['GET'])
+def advert_stats(request, pk):
+    values = stats.get(pk)
+    if values is None:
+        raise Advert.DoesNotExist
+    return etag_response(request, {'id': pk, **values})
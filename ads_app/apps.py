@@ -4,3 +4,11 @@ class AppConfig(AppConfig):
     name = 'ads_app'
     verbose_name = u'Доска объявлений'
 
+    def ready(self):
+        # Модули с фоновыми задачами: воркер run_tasks не загружает views.
+        import ads_app.signals
+        import ads_app.ingest
+        from ads_app import metrics, warmup
+        metrics.install()
+        warmup.on_startup()
+
@@ -0,0 +1,310 @@
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from ads_app.models import Advert, Category, Comment, parse_tags
+from ads_app import cache, pagecache, pagination, repository, search, stats, tags
+from ads_app.redis_client import guarded
+from pymongo import UpdateOne
+from types import SimpleNamespace
+import json
+
+# Массовый импорт и экспорт объявлений в NDJSON: одна строка — один
+# объект вида
+#   {"id": 1, "title": "...", "content": "...", "category": "Авто",
+#    "author": "admin", "tags": ["a", "b"], "created": "...", "photo": "photos/x.jpg",
+#    "comments": [{"author": "...", "content": "...", "created": "..."}]}
+# Обязательно только content. Объявление с id, которое уже есть в базе,
+# обновляется (теги заменяются, комментарии не трогаются), остальные
+# вставляются.
+#
+# Импорт пишет пачками прямо в коллекции MongoDB: категории и авторы
+# ищутся одним запросом на пачку, объявления, теги и комментарии
+# вставляются insert_many, обновления уходят одним bulk_write. Сигналы
+# моделей при этом не срабатывают, поэтому кеш, поиск, теги и статистика
+# обновляются здесь же, тоже пачкой.
+
+BATCH_SIZE = 500
+
+
+class RecordError(ValueError):
+    pass
+
+
+def _datetime(value, field):
+    if value in (None, ''):
+        return None
+    result = parse_datetime(value) if isinstance(value, str) else None
+    if result is None:
+        raise RecordError(f'{field}: неверная дата {value!r}')
+    if timezone.is_naive(result):
+        result = timezone.make_aware(result)
+    return result
+
+def _tags(value):
+    if isinstance(value, str):
+        return parse_tags(value)
+    if isinstance(value, list):
+        return parse_tags(' '.join(str(name) for name in value))
+    if value is None:
+        return []
+    raise RecordError('tags: нужен список или строка')
+
+def clean(record):
+    if not isinstance(record, dict):
+        raise RecordError('ожидается объект')
+    content = record.get('content')
+    if not isinstance(content, str) or not content.strip():
+        raise RecordError('content: обязательное поле')
+    pk = record.get('id')
+    if pk is not None and (not isinstance(pk, int) or isinstance(pk, bool) or pk <= 0):
+        raise RecordError(f'id: неверное значение {pk!r}')
+    comments = record.get('comments') or []
+    if not isinstance(comments, list):
+        raise RecordError('comments: нужен список')
+    cleaned = []
+    for comment in comments:
+        if not isinstance(comment, dict) or not comment.get('content'):
+            raise RecordError('comments: у комментария нет content')
+        cleaned.append({
+            'author': str(comment.get('author') or '')[:50],
+            'content': str(comment['content']),
+            'created': _datetime(comment.get('created'), 'comments.created'),
+        })
+    category = record.get('category')
+    if category is not None and not isinstance(category, (str, int)):
+        raise RecordError('category: нужно название или id')
+    return {
+        'id': pk,
+        'title': str(record.get('title') or '')[:255],
+        'content': content,
+        'category': category,
+        'author': record.get('author'),
+        'tags': _tags(record.get('tags')),
+        'created': _datetime(record.get('created'), 'created'),
+        'photo': str(record.get('photo') or ''),
+        'comments': cleaned,
+    }
+
+def read_batches(lines, batch_size, errors):
+    # Разбирает поток строк пачками по batch_size; ошибки — пары (номер
+    # строки, текст) — складываются в errors, такие строки пропускаются.
+    batch = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            batch.append(clean(json.loads(line)))
+        except (ValueError, RecordError) as error:
+            errors.append((number, str(error)))
+            continue
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def resolve_categories(records):
+    # Категории задаются названием или id; недостающие по названию
+    # создаются через ORM (сигналы обновят список категорий в кеше).
+    names = {record['category'] for record in records if isinstance(record['category'], str)}
+    ids = {record['category'] for record in records if isinstance(record['category'], int)}
+    found = {}
+    if names or ids:
+        for category in Category.objects.filter(Q(name__in=names) | Q(id__in=ids)).only('id', 'name'):
+            found.setdefault(category.name, category.id)
+            found[category.id] = category.id
+    for name in names.difference(found):
+        found[name] = Category.objects.create(name=name).id
+    return found
+
+def resolve_authors(records):
+    names = list({record['author'] for record in records if record['author']})
+    if not names:
+        return {}
+    cursor = repository.database()[repository.USERS].find(
+        {'username': {'$in': names}}, repository.projection(('id', 'username')))
+    return {document['username']: document['id'] for document in cursor}
+
+
+def advert_document(record, pk, category_id, author_id, now):
+    return {
+        'id': pk,
+        'title': record['title'],
+        'content': record['content'],
+        'created': record['created'] or now,
+        'updated': now,
+        'category_id': category_id,
+        'author_id': author_id,
+        'photo': record['photo'],
+    }
+
+def import_batch(records, warnings):
+    # Возвращает id вставленных и обновлённых объявлений и изменения
+    # тегов: пары (id, тег) добавленные и удалённые.
+    db = repository.database()
+    now = timezone.now()
+    categories = resolve_categories(records)
+    authors = resolve_authors(records)
+
+    given = [record['id'] for record in records if record['id'] is not None]
+    existing = {document['id'] for document in db[repository.ADVERTS].find(
+        {'id': {'$in': given}}, repository.projection(('id',)))} if given else set()
+    # Запись с тем же id дальше в пачке заменяет предыдущую.
+    unique = {}
+    for record in records:
+        unique[record['id'] if record['id'] is not None else object()] = record
+    records = list(unique.values())
+    fresh = [record for record in records if record['id'] is None]
+    missing = [pk for pk in given if pk not in existing]
+    new_ids = iter(())
+    if fresh or missing:
+        new_ids = iter(repository.reserve_ids(repository.ADVERTS, len(fresh), at_least=max(missing, default=0)))
+
+    inserted, updates, updated = [], [], []
+    old_tags = {}
+    if existing:
+        for document in db[repository.TAGS].find(
+                {'advert_id': {'$in': list(existing)}}, repository.projection(('advert_id', 'name'))):
+            old_tags.setdefault(document['advert_id'], set()).add(document['name'])
+    new_tags, removed_tags = [], []
+    comments = []
+    for record in records:
+        pk = record['id'] if record['id'] is not None else next(new_ids)
+        category_id = categories.get(record['category'])
+        if record['category'] is not None and category_id is None:
+            warnings.append(f'{pk}: нет категории {record["category"]!r}')
+        author_id = authors.get(record['author'])
+        if record['author'] and author_id is None:
+            warnings.append(f'{pk}: нет пользователя {record["author"]!r}')
+        document = advert_document(record, pk, category_id, author_id, now)
+        if pk in existing:
+            if record['created'] is None:
+                del document['created']
+            updates.append(UpdateOne({'id': pk}, {'$set': document}))
+            updated.append(pk)
+            current = old_tags.get(pk, set())
+            new_tags.extend((pk, name) for name in record['tags'] if name not in current)
+            removed_tags.extend((pk, name) for name in current.difference(record['tags']))
+        else:
+            inserted.append(document)
+            new_tags.extend((pk, name) for name in record['tags'])
+            comments.extend(dict(comment, advert_id=pk, created=comment['created'] or now, updated=now)
+                            for comment in record['comments'])
+
+    if comments:
+        for comment, pk in zip(comments, repository.reserve_ids(repository.COMMENTS, len(comments))):
+            comment['id'] = pk
+        if repository.EMBEDDED_COMMENTS:
+            by_advert = {}
+            for comment in comments:
+                by_advert.setdefault(comment['advert_id'], []).append(comment)
+            for document in inserted:
+                own = by_advert.get(document['id'], [])
+                document['recent_comments'] = [repository.comment_document(comment)
+                                               for comment in own[-repository.EMBEDDED_COMMENTS:]]
+                document['comment_count'] = len(own)
+    if inserted:
+        db[repository.ADVERTS].insert_many(inserted, ordered=False)
+    if updates:
+        db[repository.ADVERTS].bulk_write(updates, ordered=False)
+    if removed_tags:
+        db[repository.TAGS].delete_many({'$or': [{'advert_id': pk, 'name': name} for pk, name in removed_tags]})
+    if new_tags:
+        tag_ids = repository.reserve_ids(repository.TAGS, len(new_tags))
+        db[repository.TAGS].insert_many(
+            [{'id': tag_id, 'name': name, 'advert_id': pk} for tag_id, (pk, name) in zip(tag_ids, new_tags)],
+            ordered=False)
+    if comments:
+        db[repository.COMMENTS].insert_many(comments, ordered=False)
+    return [document['id'] for document in inserted], updated, new_tags, removed_tags
+
+
+def sync(created, updated, added_tags, removed_tags):
+    # То, что для одного объявления делают сигналы, — для всей пачки.
+    ids = created + updated
+    rows = cache.load_rows(ids)
+    cache.store_rows(rows)
+    cache.publish(*[('advert', pk) for pk in ids])
+    if cache.redis_cache.exists(search.built_key()):
+        search.index_adverts([SimpleNamespace(id=row['id'], title=row['title'], content=row['content'],
+                                              tag_names=row['tags'], category_id=row['category_id'])
+                              for row in rows])
+    if cache.redis_cache.exists(tags.built_key()):
+        tags.remove_many(removed_tags)
+        tags.add_many(added_tags)
+    stats.rebuild(ids)
+    if updated:
+        pagecache.purge_adverts(updated)
+
+def finish():
+    pagination.invalidate_all()
+    pagecache.purge('head', 'search', 'categories')
+
+def import_stream(lines, batch_size=BATCH_SIZE, progress=None):
+    # progress(итог) вызывается после каждой пачки.
+    totals = {'created': 0, 'updated': 0, 'errors': [], 'warnings': []}
+    try:
+        for batch in read_batches(lines, batch_size, totals['errors']):
+            created, updated, added_tags, removed_tags = import_batch(batch, totals['warnings'])
+            guarded(sync)(created, updated, added_tags, removed_tags)
+            totals['created'] += len(created)
+            totals['updated'] += len(updated)
+            if progress is not None:
+                progress(totals)
+    finally:
+        guarded(finish)()
+    return totals
+
+
+def export_comments(ids):
+    found = {}
+    if repository.ENABLED:
+        cursor = repository.database()[repository.COMMENTS].find(
+            {'advert_id': {'$in': ids}}, repository.projection(repository.COMMENT_FIELDS)).sort(
+            [('advert_id', repository.ASC), ('id', repository.ASC)])
+    else:
+        cursor = Comment.objects.filter(advert_id__in=ids).order_by('advert_id', 'id').values(
+            *repository.COMMENT_FIELDS)
+    for comment in cursor:
+        found.setdefault(comment['advert_id'], []).append({
+            'author': comment['author'],
+            'content': comment['content'],
+            'created': comment['created'],
+        })
+    return found
+
+def export_ids(last_id, batch_size):
+    if repository.ENABLED:
+        cursor = repository.database()[repository.ADVERTS].find(
+            {'id': {'$gt': last_id}}, repository.projection(('id',))).sort('id', repository.ASC).limit(batch_size)
+        return [document['id'] for document in cursor]
+    return list(Advert.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+
+def export_records(batch_size=BATCH_SIZE):
+    # Окно по id: в памяти держится одна пачка, а не вся коллекция.
+    last_id = 0
+    while True:
+        ids = export_ids(last_id, batch_size)
+        if not ids:
+            return
+        rows = {row['id']: row for row in cache.load_rows(ids)}
+        comments = export_comments(ids)
+        for pk in ids:
+            row = rows.get(pk)
+            if row is None:
+                continue
+            yield {
+                'id': pk,
+                'title': row['title'],
+                'content': row['content'],
+                'category': row['category_name'],
+                'author': row['author_name'],
+                'tags': row['tags'],
+                'created': row['created'],
+                'updated': row['updated'],
+                'photo': row['photo'],
+                'comments': comments.get(pk, []),
+            }
+        last_id = ids[-1]
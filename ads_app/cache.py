@@ -0,0 +1,568 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count
+from django.utils.dateparse import parse_datetime
+from ads_app.models import Comment, Category, Advert
+from ads_app import metrics, repository, thumbnails
+from ads_app.local_cache import local_cache, count_remote, Listener, key_to_message, FLUSH
+from ads_app.redis_client import redis_cache, breaker, fallback
+from ads_app.serialization import get_serializer
+from contextlib import contextmanager
+import hashlib
+import math
+import random
+import time
+import uuid
+
+# Все ключи приложения живут в одном пространстве имён. Версия в префиксе
+# меняется вместе с форматом строк, и после выкладки старые записи просто
+# перестают читаться, а не разбираются новым кодом.
+CACHE_VERSION = getattr(settings, 'CACHE_VERSION', 1)
+CACHE_TTL = getattr(settings, 'CACHE_TTL', 60 * 60 * 24)
+LOCK_TTL = getattr(settings, 'CACHE_LOCK_TTL', 10)
+LOCK_WAIT = getattr(settings, 'CACHE_LOCK_WAIT', 2)
+LOCK_POLL = 0.05
+XFETCH_BETA = getattr(settings, 'CACHE_XFETCH_BETA', 1.0)
+KEY_PREFIX = f'ads:v{CACHE_VERSION}:'
+# Со встроенными комментариями кешируются только последние из них, более
+# ранние отдаются страницами того же размера мимо кеша.
+COMMENTS_PAGE_SIZE = repository.EMBEDDED_COMMENTS or 20
+serializer = get_serializer(CACHE_VERSION)
+
+
+def make_key(*parts):
+    return KEY_PREFIX + ':'.join(str(part) for part in parts)
+
+def key_family(key):
+    # Семейство ключа для счётчиков: ключ без префикса и без id,
+    # например advert:comments.
+    return ':'.join(part for part in key[len(KEY_PREFIX):].split(':') if not part.isdigit())
+
+def advert_key(pk):
+    return make_key('advert', pk)
+
+def comments_key(advert_pk):
+    return make_key('advert', advert_pk, 'comments')
+
+def stats_key(pk):
+    return make_key('advert', pk, 'stats')
+
+def index_key():
+    return make_key('advert_index')
+
+def categories_key():
+    return make_key('categories')
+
+def invalidation_channel():
+    return make_key('l1', 'invalidate')
+
+
+# Первый уровень (ads_app/local_cache.py): категории и строки объявлений
+# вместе с числом комментариев. Ключи L1 — кортежи ('advert', id) и
+# ('categories',); после записи в Redis они рассылаются всем процессам.
+
+listener = Listener(invalidation_channel(), local_cache)
+
+def local_get(key):
+    listener.ensure_started(redis_cache)
+    return local_peek(key)
+
+def local_peek(key):
+    # Чтение L1 без запуска подписчика — для цикла событий (ads_app/aio.py).
+    # Пока подписчик не запущен, L1 пуст: наполняет его только get_adverts()
+    # и get_categories(), а они читают через local_get().
+    value = local_cache.get(key)
+    metrics.record_cache('l1', key[0], hits=value is not None, misses=value is None)
+    return value
+
+def publish(*keys):
+    for key in keys:
+        if key == FLUSH:
+            local_cache.clear()
+        else:
+            local_cache.delete(key)
+    message = ','.join(FLUSH if key == FLUSH else key_to_message(key) for key in keys)
+    if message:
+        redis_cache.publish(invalidation_channel(), message)
+
+
+@metrics.timed('serialize')
+def dumps(value):
+    return serializer.dumps(value)
+
+@metrics.timed('serialize')
+def loads(data):
+    # None — ключа нет или он записан в другом формате; и то и другое промах.
+    return serializer.loads(data)
+
+
+# Защита от лавины запросов. Пустой ключ собирает один процесс — тот, кто
+# взял короткую блокировку <ключ>:lock; остальные ждут до LOCK_WAIT секунд,
+# пока значение появится, и только потом идут в базу сами.
+#
+# Значения, которые читает fetch(), хранятся в обёртке с временем сборки и
+# моментом истечения. По ним работает вероятностное раннее обновление
+# (XFetch): чем ближе истечение и чем дольше сборка, тем вероятнее, что
+# очередной запрос пересоберёт ключ заранее, пока остальные читают старое
+# значение.
+
+RELEASE_SCRIPT = redis_cache.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+def lock_key(key):
+    return key + ':lock'
+
+@contextmanager
+def lock(key, ttl=LOCK_TTL):
+    token = uuid.uuid4().hex
+    acquired = redis_cache.set(lock_key(key), token, nx=True, px=int(ttl * 1000))
+    try:
+        yield bool(acquired)
+    finally:
+        if acquired:
+            RELEASE_SCRIPT(keys=[lock_key(key)], args=[token])
+
+def single_flight(key, build, read, wait=LOCK_WAIT):
+    # read() возвращает готовое значение или None; build() собирает и
+    # сохраняет его. Если держатель блокировки не успел за wait секунд,
+    # собираем сами, чтобы запрос не висел.
+    deadline = time.monotonic() + wait
+    while True:
+        with lock(key) as acquired:
+            if acquired:
+                value = read()
+                return build() if value is None else value
+        time.sleep(LOCK_POLL)
+        value = read()
+        if value is not None:
+            return value
+        if time.monotonic() >= deadline:
+            return build()
+
+def should_refresh(envelope, beta=XFETCH_BETA):
+    return time.time() - envelope['d'] * beta * math.log(1 - random.random()) >= envelope['x']
+
+def store(key, value, ttl=CACHE_TTL, delta=0, nx=False, track=None):
+    # track — множество, в которое ключ добавляется той же транзакцией,
+    # чтобы его можно было сбросить вместе с другими (страницы ленты).
+    pipe = redis_cache.pipeline(transaction=True)
+    pipe.set(key, dumps({'v': value, 'd': delta, 'x': time.time() + ttl}), ex=ttl, nx=nx)
+    if track is not None:
+        pipe.sadd(track, key)
+    pipe.execute()
+
+def store_many(items, ttl=CACHE_TTL, nx=False):
+    # store() для многих ключей одним конвейером; items — тройки (ключ,
+    # значение, track). Возвращает число записанных ключей.
+    if not items:
+        return 0
+    expires = time.time() + ttl
+    pipe = redis_cache.pipeline(transaction=False)
+    for key, value, track in items:
+        pipe.set(key, dumps({'v': value, 'd': 0, 'x': expires}), ex=ttl, nx=nx)
+        if track is not None:
+            pipe.sadd(track, key)
+    results = iter(pipe.execute())
+    written = 0
+    for key, value, track in items:
+        written += bool(next(results))
+        if track is not None:
+            next(results)
+    return written
+
+def fetch(key, build, ttl=CACHE_TTL, track=None):
+    def rebuild(nx):
+        started = time.monotonic()
+        value = build()
+        # Пустой ключ записываем только если его нет: свежая запись из
+        # сигнала, сделанная пока мы читали базу, не перетирается.
+        store(key, value, ttl, time.monotonic() - started, nx=nx, track=track)
+        return value
+
+    def read():
+        envelope = loads(redis_cache.get(key))
+        return None if envelope is None else envelope['v']
+
+    envelope = loads(redis_cache.get(key))
+    count_remote(hits=envelope is not None, misses=envelope is None)
+    metrics.record_cache('l2', key_family(key), hits=envelope is not None, misses=envelope is None)
+    if envelope is None:
+        return single_flight(key, lambda: rebuild(True), read)
+    if should_refresh(envelope):
+        with lock(key) as acquired:
+            if acquired:
+                return rebuild(False)
+    return envelope['v']
+
+
+class Row(dict):
+    # Плоская модель представления: кешируется и отдаётся шаблонам вместо
+    # экземпляров моделей, поэтому шаблон не может случайно сделать запрос
+    # к базе. Поля доступны и как ключи словаря, и как атрибуты.
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+DATETIME_FIELDS = ('created', 'updated')
+
+def make_row(values):
+    row = Row(values)
+    for field in DATETIME_FIELDS:
+        if isinstance(row.get(field), str):
+            row[field] = parse_datetime(row[field])
+    return row
+
+def plain_row(row):
+    return {key: value.isoformat() if key in DATETIME_FIELDS else value
+            for key, value in row.items()}
+
+def plain_rows(rows):
+    return [plain_row(row) for row in rows]
+
+def dump_row(row):
+    return dumps(plain_row(row))
+
+def advert_to_row(advert):
+    return make_row({
+        'id': advert.id,
+        'title': advert.title,
+        'content': advert.content,
+        'tags': advert.tag_names,
+        'created': advert.created,
+        'updated': advert.updated,
+        'category_id': advert.category_id,
+        'category_name': advert.category_name,
+        'author_id': advert.author_id,
+        'author_name': advert.author_name,
+        'photo': advert.photo.name or '',
+        'photo_url': default_storage.url(advert.photo.name) if advert.photo else '',
+        'thumbs': thumbnails.srcsets(advert.photo.name),
+    })
+
+def comment_to_row(comment):
+    return make_row({
+        'id': comment.id,
+        'author': comment.author,
+        'content': comment.content,
+        'created': comment.created,
+        'updated': comment.updated,
+        'advert_id': comment.advert_id,
+    })
+
+def category_to_row(category):
+    return make_row({'id': category.id, 'name': category.name})
+
+
+def advert_queryset():
+    return Advert.objects.select_related('category', 'author').prefetch_related('tag_set').only(
+        'id', 'title', 'content', 'created', 'updated', 'photo',
+        'category', 'category__name', 'author', 'author__username')
+
+# Чтение из базы в обход Redis: запасной путь, пока Redis недоступен,
+# и построение значений кеша. На MongoDB горячие чтения идут через
+# repository (pymongo), иначе через ORM.
+
+def load_rows(ids):
+    # Строки объявлений без числа комментариев: его кеш берёт из статистики.
+    if repository.ENABLED:
+        return [make_row(values) for values in repository.adverts(ids)]
+    return [advert_to_row(advert) for advert in advert_queryset().filter(pk__in=ids)]
+
+def load_adverts(ids, strict=False):
+    rows = {}
+    if repository.ENABLED:
+        for values in repository.adverts(ids, counts=True):
+            rows[values['id']] = make_row(values)
+    else:
+        adverts = advert_queryset().filter(pk__in=ids).annotate(comment_count=Count('comments', distinct=True))
+        for advert in adverts:
+            rows[advert.id] = advert_to_row(advert)
+            rows[advert.id]['comment_count'] = advert.comment_count
+    if strict and len(rows) < len(ids):
+        raise Advert.DoesNotExist
+    return [rows[pk] for pk in ids if pk in rows]
+
+def load_advert_ids():
+    if repository.ENABLED:
+        return repository.advert_ids()
+    return list(Advert.objects.order_by('-created', '-id').values_list('id', flat=True))
+
+def load_comments(advert_pk):
+    if repository.EMBEDDED_COMMENTS:
+        return [make_row(values) for values in repository.recent_comments(advert_pk)]
+    if repository.ENABLED:
+        return [make_row(values) for values in repository.comments(advert_pk)]
+    comments = Comment.objects.filter(advert_id=advert_pk).only(
+        'id', 'author', 'content', 'created', 'updated', 'advert_id')
+    return [comment_to_row(comment) for comment in comments]
+
+def load_comments_many(ids):
+    # load_comments() для пачки объявлений одним запросом.
+    found = {pk: [] for pk in ids}
+    if repository.EMBEDDED_COMMENTS:
+        for values in repository.adverts(ids, comments=True):
+            found[values['id']] = [make_row(comment) for comment in values['recent_comments']]
+        return found
+    if repository.ENABLED:
+        comments = repository.comments_many(ids)
+    else:
+        comments = Comment.objects.filter(advert_id__in=ids).order_by('advert_id', 'id').values(
+            'id', 'author', 'content', 'created', 'updated', 'advert_id')
+    for values in comments:
+        found[values['advert_id']].append(make_row(values))
+    return found
+
+def load_detail(pk):
+    # Объявление вместе с комментариями: со встроенными комментариями это
+    # одна агрегация.
+    if not repository.EMBEDDED_COMMENTS:
+        return load_adverts([int(pk)], strict=True)[0], load_comments(pk)
+    rows = repository.adverts([pk], comments=True)
+    if not rows:
+        raise Advert.DoesNotExist
+    comments = rows[0].pop('recent_comments')
+    return make_row(rows[0]), [make_row(values) for values in comments]
+
+def load_older_comments(advert_pk, before, limit=COMMENTS_PAGE_SIZE):
+    # Комментарии раньше before, по возрастанию id; второе значение —
+    # есть ли ещё более ранние.
+    if repository.ENABLED:
+        rows = [make_row(values) for values in repository.older_comments(advert_pk, before, limit + 1)]
+        return rows[-limit:], len(rows) > limit
+    comments = Comment.objects.filter(advert_id=advert_pk, id__lt=before).only(
+        'id', 'author', 'content', 'created', 'updated', 'advert_id').order_by('-id')[:limit + 1]
+    rows = [comment_to_row(comment) for comment in reversed(list(comments))]
+    return rows[-limit:], len(rows) > limit
+
+def load_categories():
+    return [category_to_row(category) for category in Category.objects.only('id', 'name')]
+
+
+def get_advert(pk):
+    return get_adverts([int(pk)], strict=True)[0]
+
+@fallback(load_adverts)
+def get_adverts(ids, strict=False):
+    # Число комментариев не хранится в строке объявления, а читается из
+    # счётчиков статистики в том же конвейере: новый комментарий не
+    # переписывает строку, а запрос к Redis остаётся один.
+    if not ids:
+        return []
+    local = {}
+    for pk in ids:
+        row = local_get(('advert', pk))
+        if row is not None:
+            local[pk] = Row(row)
+    remote = [pk for pk in ids if pk not in local]
+    if not remote:
+        return [local[pk] for pk in ids]
+    version = local_cache.version
+    pipe = redis_cache.pipeline(transaction=False)
+    pipe.mget([advert_key(pk) for pk in remote])
+    for pk in remote:
+        pipe.hget(stats_key(pk), 'comments')
+    rows, *counts = pipe.execute()
+    adverts = {}
+    missing = []
+    for pk, data, count in zip(remote, rows, counts):
+        values = loads(data)
+        if values is not None:
+            adverts[pk] = make_row(values)
+            adverts[pk]['comment_count'] = count
+        else:
+            missing.append(pk)
+    count_remote(hits=len(adverts), misses=len(missing))
+    metrics.record_cache('l2', 'advert', hits=len(adverts), misses=len(missing))
+    if missing:
+        adverts.update((row['id'], row) for row in _fill_adverts(missing))
+    if strict and len(adverts) < len(remote):
+        raise Advert.DoesNotExist
+    uncounted = [pk for pk, row in adverts.items() if row.get('comment_count') is None]
+    if uncounted:
+        from ads_app import stats
+        for pk, values in stats.get_many(uncounted).items():
+            adverts[pk]['comment_count'] = values['comments']
+    for pk, row in adverts.items():
+        row['comment_count'] = int(row.get('comment_count') or 0)
+        local_cache.set(('advert', pk), Row(row), version)
+    adverts.update(local)
+    return [adverts[pk] for pk in ids if pk in adverts]
+
+def _fill_adverts(ids):
+    # Одну и ту же страницу обычно запрашивают одновременно, поэтому
+    # блокировка берётся на весь набор недостающих id.
+    keys = [advert_key(pk) for pk in ids]
+
+    def build():
+        rows = load_rows(ids)
+        store_rows(rows, replace=False)
+        return rows
+
+    def read():
+        values = [loads(data) for data in redis_cache.mget(keys)]
+        return None if None in values else [make_row(value) for value in values]
+
+    digest = hashlib.md5(','.join(map(str, sorted(ids))).encode()).hexdigest()
+    return single_flight(make_key('advert', 'fill', digest), build, read)
+
+def _read_index():
+    ids = redis_cache.zrevrange(index_key(), 0, -1)
+    if not ids and not redis_cache.exists(index_key()):
+        return None
+    return [int(pk) for pk in ids]
+
+@fallback(load_advert_ids)
+def get_advert_ids():
+    ids = _read_index()
+    if ids is None:
+        return single_flight(index_key(), rebuild_index, _read_index)
+    return ids
+
+def filter_advert_ids(keys):
+    # id из пересечения множеств keys в порядке ленты: пересекаются они с
+    # индексом ленты, и время создания (оценка) берётся только из него.
+    if not redis_cache.exists(index_key()):
+        get_advert_ids()
+    tmp_key = make_key('advert_index', 'filter')
+    pipe = redis_cache.pipeline(transaction=True)
+    pipe.zinterstore(tmp_key, {index_key(): 1, **{key: 0 for key in keys}})
+    pipe.zrevrange(tmp_key, 0, -1)
+    pipe.delete(tmp_key)
+    return [int(pk) for pk in pipe.execute()[1]]
+
+@fallback(load_comments)
+def get_comments(advert_pk):
+    rows = fetch(comments_key(advert_pk), lambda: plain_rows(load_comments(advert_pk)))
+    return [make_row(row) for row in rows]
+
+@fallback(load_detail)
+def get_detail(pk):
+    return get_advert(pk), get_comments(pk)
+
+@fallback(load_categories)
+def get_categories():
+    rows = local_get(('categories',))
+    if rows is None:
+        version = local_cache.version
+        rows = [make_row(row) for row in fetch(categories_key(), lambda: plain_rows(load_categories()))]
+        local_cache.set(('categories',), rows, version)
+    return rows
+
+def get_category(pk):
+    for category in get_categories():
+        if category['id'] == int(pk):
+            return category
+    raise Category.DoesNotExist
+
+
+# Запись в кеш. Каждая операция выполняется одной транзакцией MULTI/EXEC,
+# а составные ключи собираются во временном ключе и подменяются через
+# RENAME, поэтому читатель видит либо старое, либо новое состояние целиком.
+
+def _swap(pipe, key, tmp_key):
+    pipe.rename(tmp_key, key)
+    pipe.expire(key, CACHE_TTL)
+
+def store_rows(rows, index=True, replace=True):
+    # Возвращает число записанных строк (с replace=False — новых).
+    if not rows:
+        return 0
+    indexed = index and redis_cache.exists(index_key())
+    pipe = redis_cache.pipeline(transaction=True)
+    for row in rows:
+        pipe.set(advert_key(row['id']), dump_row(row), ex=CACHE_TTL, nx=not replace)
+    # Неполный индекс хуже отсутствующего: его соберёт get_advert_ids().
+    if indexed:
+        pipe.zadd(index_key(), {row['id']: row['created'].timestamp() for row in rows})
+    return sum(bool(result) for result in pipe.execute()[:len(rows)])
+
+def store_adverts(adverts, index=True):
+    store_rows([advert_to_row(advert) for advert in adverts], index=index)
+
+def rebuild_index():
+    index = dict(Advert.objects.values_list('id', 'created'))
+    pipe = redis_cache.pipeline(transaction=True)
+    if index:
+        tmp_key = make_key('advert_index', 'tmp')
+        pipe.delete(tmp_key)
+        pipe.zadd(tmp_key, {pk: created.timestamp() for pk, created in index.items()})
+        _swap(pipe, index_key(), tmp_key)
+    else:
+        pipe.delete(index_key())
+    pipe.execute()
+    return sorted(index, key=index.get, reverse=True)
+
+def refresh_advert(pk):
+    try:
+        advert = advert_queryset().get(pk=pk)
+    except Advert.DoesNotExist:
+        drop_advert(pk)
+        return None
+    store_adverts([advert])
+    publish(('advert', pk))
+    return advert
+
+def refresh_adverts(ids):
+    store_adverts(list(advert_queryset().filter(pk__in=ids)), index=False)
+    publish(*[('advert', pk) for pk in ids])
+
+def drop_advert(pk):
+    pipe = redis_cache.pipeline(transaction=True)
+    pipe.delete(advert_key(pk), comments_key(pk))
+    pipe.zrem(index_key(), pk)
+    pipe.execute()
+    publish(('advert', pk))
+
+# Сброс без перечитывания: сигналы сбрасывают ключи сразу, чтобы
+# следующий запрос уже не увидел старое, а собирает их заново фоновая
+# задача (ads_app/tasks.py) или первый читатель.
+
+def invalidate_adverts(ids):
+    if ids:
+        redis_cache.delete(*[advert_key(pk) for pk in ids])
+        publish(*[('advert', pk) for pk in ids])
+
+def invalidate_comments(advert_pk):
+    # Строка объявления в L1 хранит число комментариев, её тоже сбрасываем.
+    redis_cache.delete(comments_key(advert_pk))
+    publish(('advert', advert_pk))
+
+def invalidate_categories():
+    redis_cache.delete(categories_key())
+    publish(('categories',))
+
+def refresh_comments(advert_pk):
+    # Строка объявления в L1 хранит число комментариев, её тоже сбрасываем.
+    rows = load_comments(advert_pk)
+    store(comments_key(advert_pk), plain_rows(rows))
+    publish(('advert', advert_pk))
+    return rows
+
+def refresh_categories():
+    rows = load_categories()
+    store(categories_key(), plain_rows(rows))
+    publish(('categories',))
+    return rows
+
+def flush_namespace(batch_size=1000):
+    # Сбрасывает все ключи приложения: кеши, индексы поиска и тегов,
+    # счётчики. Всё это собирается заново из базы при первом обращении.
+    keys = []
+    for key in redis_cache.scan_iter(match=KEY_PREFIX + '*', count=batch_size):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            redis_cache.delete(*keys)
+            keys = []
+    if keys:
+        redis_cache.delete(*keys)
+    publish(FLUSH)
+
+breaker.on_recover = flush_namespace
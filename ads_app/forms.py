@@ -91,4 +91,4 @@ class AdvertForm(forms.ModelForm):
     )
     class Meta:
         model = Advert
-        fields = ('title', 'content', 'tags', 'category', 'photo')
+        fields = ('title', 'content', 'category', 'photo')
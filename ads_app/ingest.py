@@ -0,0 +1,202 @@
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+from ads_app.models import Advert, Comment
+from ads_app import cache, pagecache, ratelimit, repository, signals, stats, tasks
+from ads_app.redis_client import redis_cache, breaker, fallback
+import json
+import logging
+import redis
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Приём комментариев через буфер в Redis. Новый комментарий дописывается в
+# список ads:comments:<id>:buffer и ставит задачу flush_comments, которая
+# через TASKS_BATCH_DELAY записывает в базу всё, что накопилось у
+# объявления: одним insert_many и одним обновлением копий в документе
+# объявления. Кеш комментариев, счётчик и страницы обновляются тоже раз на
+# пачку, теми же функциями, что и в обработчиках сигналов. Набравшие COMMENTS_FLUSH_SIZE комментариев записывает сразу
+# запрос, который переполнил буфер.
+#
+# Запись идёт под блокировкой объявления: забранные из буфера комментарии
+# лежат в списке ads:comments:<id>:flushing, пока не окажутся в базе и в
+# кеше. Если запись упала, они остаются там, и повтор задачи начнёт с них;
+# уже записанные он узнает по токену в Comment.token и пропустит.
+#
+# Автор видит свой комментарий сразу: токены его комментариев хранятся в
+# подписанной cookie, и страница объявления для него собирается мимо кеша
+# страниц с комментариями из буфера. Если Redis недоступен или
+# COMMENTS_BUFFERED выключен, комментарий сохраняется сразу через ORM.
+
+BUFFERED = getattr(settings, 'COMMENTS_BUFFERED', True)
+FLUSH_SIZE = getattr(settings, 'COMMENTS_FLUSH_SIZE', 50)
+FLUSH_BATCH = 500
+FLUSH_LOCK_TTL = 30
+RATE_LIMITS = getattr(settings, 'COMMENT_RATE_LIMITS', {'ip': (5, 60), 'advert': (60, 60)})
+PENDING_TTL = 60 * 5
+PENDING_LIMIT = 20
+
+# Перенести до limit комментариев из буфера в список записываемых. Если там
+# остались комментарии с упавшей записи, сначала повторяются они.
+TAKE_SCRIPT = redis_cache.register_script("""
+local flushing = redis.call('LRANGE', KEYS[2], 0, -1)
+if #flushing > 0 then
+    return flushing
+end
+local entries = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #entries > 0 then
+    redis.call('LTRIM', KEYS[1], #entries, -1)
+    redis.call('RPUSH', KEYS[2], unpack(entries))
+end
+return entries
+""")
+
+
+def buffer_key(advert_pk):
+    return f'ads:comments:{advert_pk}:buffer'
+
+def flushing_key(advert_pk):
+    return f'ads:comments:{advert_pk}:flushing'
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+def throttle(request, advert_pk):
+    # 0 или через сколько секунд посетитель может снова комментировать.
+    buckets = []
+    if 'ip' in RATE_LIMITS:
+        buckets.append((f'comment:ip:{client_ip(request)}', *RATE_LIMITS['ip']))
+    if 'advert' in RATE_LIMITS:
+        buckets.append((f'comment:advert:{advert_pk}', *RATE_LIMITS['advert']))
+    return ratelimit.hit(buckets)
+
+
+def save(advert_pk, author, content):
+    return None, Comment.objects.create(advert_id=advert_pk, author=author, content=content)
+
+def push(advert_pk, author, content):
+    token = uuid.uuid4().hex
+    entry = json.dumps({'token': token, 'author': author, 'content': content,
+                        'created': timezone.now().isoformat()})
+    pipe = redis_cache.pipeline(transaction=False)
+    pipe.rpush(buffer_key(advert_pk), entry)
+    pipe.llen(buffer_key(advert_pk))
+    size = pipe.execute()[1]
+    tasks.enqueue('flush_comments', advert_pk)
+    if size >= FLUSH_SIZE:
+        # Переполненный буфер записывает сам запрос; если не вышло, его
+        # запишет уже поставленная задача.
+        try:
+            flush(advert_pk)
+        except Exception:
+            logger.exception('Не удалось записать комментарии объявления %s', advert_pk)
+    return token, None
+
+def add(advert_pk, author, content):
+    # Возвращает (токен, None) для комментария в буфере или (None,
+    # комментарий), если он сразу записан в базу.
+    # Не fallback: тот после восстановления Redis повторил бы запись.
+    if not BUFFERED or breaker.is_open():
+        return save(advert_pk, author, content)
+    try:
+        return push(advert_pk, author, content)
+    except redis.RedisError as error:
+        breaker.failure(error)
+        return save(advert_pk, author, content)
+
+
+def entry_to_row(advert_pk, entry):
+    return cache.make_row({
+        'id': None,
+        'author': entry['author'],
+        'content': entry['content'],
+        'created': entry['created'],
+        'updated': entry['created'],
+        'advert_id': advert_pk,
+    })
+
+def write(advert_pk, entries):
+    # Повтор после упавшей записи пропускает комментарии, чьи токены уже в
+    # базе, и возвращает число всех комментариев пачки: счётчик и кеш
+    # обновляются только после записи, то есть и за записанные в прошлый раз.
+    tokens = [entry['token'] for entry in entries]
+    if repository.ENABLED:
+        if not repository.database()[repository.ADVERTS].count_documents({'id': advert_pk}, limit=1):
+            return 0
+        written = repository.comment_tokens(advert_pk, tokens)
+        new = [entry for entry in entries if entry['token'] not in written]
+        if new:
+            repository.insert_comments(advert_pk, [entry_to_row(advert_pk, entry) for entry in new],
+                                       [entry['token'] for entry in new])
+        if written and repository.EMBEDDED_COMMENTS:
+            # Неизвестно, успела ли прошлая запись обновить копии.
+            repository.embed_comments(advert_pk)
+    else:
+        if not Advert.objects.filter(pk=advert_pk).exists():
+            return 0
+        written = set(Comment.objects.filter(advert_id=advert_pk, token__in=tokens).values_list('token', flat=True))
+        # auto_now_add ставит время записи, а не время отправки.
+        Comment.objects.bulk_create([Comment(advert_id=advert_pk, author=entry['author'], content=entry['content'],
+                                             token=entry['token'])
+                                     for entry in entries if entry['token'] not in written])
+    return len(entries)
+
+@tasks.task('flush_comments')
+def flush(advert_pk):
+    advert_pk = int(advert_pk)
+    with cache.lock(buffer_key(advert_pk), ttl=FLUSH_LOCK_TTL) as acquired:
+        if not acquired:
+            # Буфер сейчас пишет другой процесс; остаток заберёт эта задача.
+            # Без очереди (TASKS_EAGER) его заберёт сам пишущий.
+            if not tasks.EAGER:
+                tasks.enqueue('flush_comments', advert_pk)
+            return
+        while True:
+            entries = TAKE_SCRIPT(keys=[buffer_key(advert_pk), flushing_key(advert_pk)], args=[FLUSH_BATCH])
+            if not entries:
+                return
+            written = write(advert_pk, [json.loads(entry) for entry in entries])
+            if not written:
+                logger.info('Объявление %s удалено, отброшено комментариев: %s', advert_pk, len(entries))
+            # Старый кеш комментариев сбрасывается вместе с записанными: между
+            # этими шагами читатель не потеряет ни тех, ни других.
+            pipe = redis_cache.pipeline(transaction=True)
+            pipe.delete(cache.comments_key(advert_pk), flushing_key(advert_pk))
+            pipe.execute()
+            if written:
+                # bulk_create и insert_many сигналов не посылают: то же, что
+                # делают обработчики сигналов Comment, но раз на пачку.
+                stats.incr(advert_pk, 'comments', written)
+                signals.changed_comments(advert_pk)
+
+
+# Комментарии автора, ещё не записанные в базу.
+
+def remember(request, response, advert_pk, token):
+    items = read_pending(request)
+    items.append([advert_pk, token])
+    response.set_signed_cookie(pagecache.PENDING_COOKIE, json.dumps(items[-PENDING_LIMIT:]),
+                               max_age=PENDING_TTL, httponly=True, samesite='Lax')
+
+def read_pending(request):
+    try:
+        items = json.loads(request.get_signed_cookie(pagecache.PENDING_COOKIE, max_age=PENDING_TTL))
+    except (KeyError, signing.BadSignature, ValueError):
+        return []
+    return [item for item in items if isinstance(item, list) and len(item) == 2]
+
+def _no_pending(request, advert_pk):
+    return []
+
+@fallback(_no_pending)
+def pending(request, advert_pk):
+    tokens = {token for pk, token in read_pending(request) if pk == advert_pk}
+    if not tokens:
+        return []
+    pipe = redis_cache.pipeline(transaction=True)
+    pipe.lrange(flushing_key(advert_pk), 0, -1)
+    pipe.lrange(buffer_key(advert_pk), 0, -1)
+    entries = [json.loads(entry) for entry in sum(pipe.execute(), [])]
+    return [entry_to_row(advert_pk, entry) for entry in entries if entry['token'] in tokens]
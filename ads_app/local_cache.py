@@ -0,0 +1,145 @@
+from django.conf import settings
+from collections import OrderedDict
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Первый уровень кеша — словарь в памяти процесса перед Redis. Держит
+# категории и самые востребованные строки объявлений; размер ограничен
+# (вытесняется давно не читавшееся), каждая запись живёт не дольше TTL.
+#
+# Согласованность между процессами и машинами — через канал pub/sub в
+# Redis: сигналы после записи публикуют изменившиеся ключи, а фоновый
+# поток каждого процесса удаляет их у себя. Сообщение может потеряться
+# (например, при переподключении), поэтому после переподключения кеш
+# очищается целиком, а TTL ограничивает возможное устаревание.
+
+L1_SIZE = getattr(settings, 'L1_CACHE_SIZE', 1000)
+L1_TTL = getattr(settings, 'L1_CACHE_TTL', 30)
+
+FLUSH = '*'
+
+
+class LRUCache:
+    def __init__(self, maxsize=L1_SIZE, ttl=L1_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        # Номер версии растёт при каждом сбросе. Значение, прочитанное из
+        # Redis до сброса, не кладём: оно могло устареть по дороге.
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self.data[key]
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, version=None):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.version += 1
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.version += 1
+            self.data.clear()
+
+    def info(self):
+        with self.lock:
+            return {'size': len(self.data), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+local_cache = LRUCache()
+
+# Счётчики второго уровня (Redis): попадания и промахи по ключам.
+remote_counters = {'hits': 0, 'misses': 0}
+
+def count_remote(hits=0, misses=0):
+    remote_counters['hits'] += hits
+    remote_counters['misses'] += misses
+
+def counters():
+    return {'l1': local_cache.info(), 'l2': dict(remote_counters)}
+
+
+def key_to_message(key):
+    return ':'.join(map(str, key))
+
+def message_to_key(message):
+    kind, _, pk = message.partition(':')
+    return (kind, int(pk)) if pk else (kind,)
+
+
+class Listener:
+    # Поток-подписчик запускается лениво, при первом обращении к кешу в
+    # процессе: воркеры gunicorn создаются через fork, и поток родителя
+    # в них не переживает.
+
+    def __init__(self, channel, cache):
+        self.channel = channel
+        self.cache = cache
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def ensure_started(self, client):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.cache.clear()
+            thread = threading.Thread(target=self.run, args=(client,), name='l1-invalidation', daemon=True)
+            thread.start()
+
+    def run(self, client):
+        from redis import RedisError
+        failing = False
+        while True:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self.cache.clear()
+                failing = False
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self.handle(message['data'].decode())
+            except RedisError as error:
+                if not failing:
+                    logger.warning('Канал сброса L1 недоступен: %s', error)
+                failing = True
+                self.cache.clear()
+                time.sleep(1)
+
+    def handle(self, data):
+        for message in data.split(','):
+            if message == FLUSH:
+                self.cache.clear()
+            else:
+                self.cache.delete(message_to_key(message))
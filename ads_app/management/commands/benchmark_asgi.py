@@ -0,0 +1,105 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.db.backends.signals import connection_created
+from concurrent.futures import ThreadPoolExecutor
+from ads_app import cache
+from ads_app.aio import AsyncApplication, scope_to_environ
+from ads_app.local_cache import local_cache
+from ads_app.models import Advert
+import asyncio
+import time
+
+
+def make_scope(url):
+    path, _, query = url.partition('?')
+    return {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(),
+            'headers': [(b'host', b'localhost')], 'http_version': '1.1', 'scheme': 'http',
+            'server': ('localhost', 80)}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность ASGI- и WSGI-пути на гостевых запросах '
+            'при медленной базе. WSGI моделируется пулом из --workers потоков, '
+            'по запросу на воркер, как у синхронных воркеров gunicorn.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300, help='запросов в каждом прогоне')
+        parser.add_argument('--concurrency', default='1,10,50,100', help='уровни одновременности через запятую')
+        parser.add_argument('--workers', type=int, default=4, help='воркеров WSGI')
+        parser.add_argument('--db-latency', type=float, default=0.02, help='задержка каждого запроса к базе, с')
+
+    def handle(self, *args, **options):
+        ids = list(Advert.objects.order_by('-created').values_list('id', flat=True)[:50])
+        if not ids:
+            raise CommandError('В базе нет объявлений для замера')
+        urls = ['/'] + [f'/id{pk}' for pk in ids] + [f'/id{pk}/stats' for pk in ids]
+        urls = [urls[index % len(urls)] for index in range(options['requests'])]
+        wsgi_application = get_wsgi_application()
+        asgi_application = AsyncApplication(wsgi_application)
+
+        latency = options['db_latency']
+
+        def slow(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            # Сигнал приходит при каждом переподключении того же объекта.
+            if slow not in connection.execute_wrappers:
+                connection.execute_wrappers.append(slow)
+
+        connections.close_all()
+        connection_created.connect(add_latency)
+        try:
+            self.stdout.write(f'{"путь":6}{"одновр.":>9}{"запр./с":>10}{"p50, мс":>10}{"p95, мс":>10}{"ошибок":>8}')
+            for level in map(int, options['concurrency'].split(',')):
+                for name, run in (('WSGI', self.run_wsgi), ('ASGI', self.run_asgi)):
+                    # Каждый прогон начинается с пустого кеша.
+                    cache.flush_namespace()
+                    local_cache.clear()
+                    application = wsgi_application if name == 'WSGI' else asgi_application
+                    started = time.monotonic()
+                    timings, errors = run(application, urls, level, options['workers'])
+                    elapsed = time.monotonic() - started
+                    timings.sort()
+                    p50 = timings[len(timings) // 2] * 1000
+                    p95 = timings[int(len(timings) * 0.95) - 1] * 1000
+                    self.stdout.write(f'{name:6}{level:9}{len(urls) / elapsed:10.1f}{p50:10.1f}{p95:10.1f}{errors:8}')
+        finally:
+            connection_created.disconnect(add_latency)
+
+    def run_wsgi(self, application, urls, level, workers):
+        bridge = AsyncApplication(application)
+
+        def request(url):
+            started = time.monotonic()
+            status, headers, content = bridge.call_wsgi(scope_to_environ(make_scope(url)))
+            connections.close_all()
+            return time.monotonic() - started, status
+
+        with ThreadPoolExecutor(max_workers=min(level, workers)) as pool:
+            results = list(pool.map(request, urls))
+        return [timing for timing, status in results], sum(status != 200 for timing, status in results)
+
+    def run_asgi(self, application, urls, level, workers):
+        async def request(url, semaphore):
+            async with semaphore:
+                started = time.monotonic()
+                sent = []
+
+                async def receive():
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+                async def send(message):
+                    sent.append(message)
+
+                await application(make_scope(url), receive, send)
+                return time.monotonic() - started, sent[0]['status']
+
+        async def main():
+            semaphore = asyncio.Semaphore(level)
+            return await asyncio.gather(*[request(url, semaphore) for url in urls])
+
+        results = asyncio.run(main())
+        return [timing for timing, status in results], sum(status != 200 for timing, status in results)
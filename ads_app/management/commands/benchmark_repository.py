@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from ads_app import cache, pagination, repository, stats
+from ads_app.models import Advert
+import timeit
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает чтение горячих путей через ORM (djongo) и через pymongo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=200, help='повторов при замере')
+        parser.add_argument('--page-size', type=int, default=pagination.PAGE_SIZE)
+
+    def cases(self, size):
+        advert = Advert.objects.order_by('-id').values_list('id', flat=True).first()
+        if advert is None:
+            raise CommandError('В базе нет объявлений для замера')
+        ids = list(Advert.objects.order_by('-created', '-id').values_list('id', flat=True)[:size])
+
+        def advert_list():
+            page = pagination.get_page_db(size=size)
+            return page, cache.load_adverts(page['ids'])
+
+        return {
+            'объявление': lambda: cache.load_adverts([advert], strict=True),
+            'страница': lambda: cache.load_detail(advert),
+            'лента': advert_list,
+            'комментарии': lambda: cache.load_comments(advert),
+            'статистика': lambda: stats.get_many_db(ids),
+            'все id': cache.load_advert_ids,
+        }
+
+    def measure(self, func, number):
+        with CaptureQueriesContext(connection) as context:
+            result = func()
+        elapsed = min(timeit.repeat(func, number=number, repeat=3)) / number
+        return result, elapsed, len(context)
+
+    def handle(self, *args, **options):
+        number = options['number']
+        enabled, embedded = repository.ENABLED, repository.EMBEDDED_COMMENTS
+        try:
+            repository.database().command('ping')
+        except Exception as error:
+            raise CommandError(f'MongoDB недоступна: {error}')
+        try:
+            self.stdout.write(f'{"путь":14}{"ORM, мс":>10}{"запросов":>10}{"pymongo, мс":>13}{"ускорение":>11}')
+            for name, func in self.cases(options['page_size']).items():
+                repository.ENABLED, repository.EMBEDDED_COMMENTS = False, 0
+                orm_result, orm_time, queries = self.measure(func, number)
+                repository.ENABLED, repository.EMBEDDED_COMMENTS = True, embedded
+                mongo_result, mongo_time, _ = self.measure(func, number)
+                self.stdout.write(f'{name:14}{orm_time * 1e3:10.2f}{queries:10}'
+                                  f'{mongo_time * 1e3:13.2f}{orm_time / mongo_time:10.1f}x')
+                if orm_result != mongo_result and not embedded:
+                    self.stderr.write(self.style.WARNING(f'{name}: результаты ORM и pymongo расходятся'))
+        finally:
+            repository.ENABLED, repository.EMBEDDED_COMMENTS = enabled, embedded
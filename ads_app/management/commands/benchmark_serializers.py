@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from ads_app.cache import advert_queryset, advert_to_row, plain_row
+from ads_app.serialization import CODECS, COMPRESSORS, Serializer
+import pickle
+import timeit
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает размер и скорость форматов кеша с прежним pickle QuerySet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=12, help='объявлений в одном значении')
+        parser.add_argument('--number', type=int, default=1000, help='повторов при замере')
+
+    def measure(self, encode, decode, number):
+        data = encode()
+        encode_time = min(timeit.repeat(encode, number=number, repeat=3)) / number
+        decode_time = min(timeit.repeat(lambda: decode(data), number=number, repeat=3)) / number
+        return len(data), encode_time, decode_time
+
+    def handle(self, *args, **options):
+        number = options['number']
+        queryset = advert_queryset().order_by('-created')[:options['count']]
+        adverts = list(queryset)
+        if not adverts:
+            raise CommandError('В базе нет объявлений для замера')
+        rows = [plain_row(advert_to_row(advert)) for advert in adverts]
+
+        # Так кеш работал раньше: в Redis лежал pickle вычисленного QuerySet.
+        legacy = queryset.all()
+        len(legacy)
+        results = [('pickle QuerySet', self.measure(
+            lambda: pickle.dumps(legacy), lambda data: list(pickle.loads(data)), number))]
+        results.append(('pickle rows', self.measure(
+            lambda: pickle.dumps(rows, pickle.HIGHEST_PROTOCOL), pickle.loads, number)))
+        for codec in CODECS:
+            for compression in (None, *COMPRESSORS):
+                serializer = Serializer(codec=codec, compression=compression, threshold=0)
+                name = codec if compression is None else f'{codec}+{compression}'
+                results.append((name, self.measure(lambda: serializer.dumps(rows), serializer.loads, number)))
+
+        self.stdout.write(f'Объявлений в значении: {len(rows)}')
+        self.stdout.write(f'{"формат":18}{"байт":>8}{"запись, мкс":>14}{"чтение, мкс":>14}')
+        for name, (size, encode_time, decode_time) in results:
+            self.stdout.write(f'{name:18}{size:8}{encode_time * 1e6:14.1f}{decode_time * 1e6:14.1f}')
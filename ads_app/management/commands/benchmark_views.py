@@ -0,0 +1,369 @@
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import include, path
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from ads_app import cache, ingest, metrics, urls as app_urls, views
+from ads_app.local_cache import local_cache
+from ads_app.models import Advert, Comment, Tag
+from ads_app.redis_client import guarded
+from ads_app.management.commands.seed_adverts import SEED_PREFIX, WORDS
+from ads_site import urls as site_urls
+import http.client
+import itertools
+import importlib.util
+import json
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+import types
+import urllib.parse
+import uuid
+
+# Сравнение views.py (Redis) и views-noredis.py на одних и тех же
+# запросах: через тестовый клиент Django (без сети, по одному) и через
+# настоящий HTTP-сервер в этом процессе под нагрузкой из нескольких
+# потоков. Для каждого пути — p50/p95/p99, запросов в секунду, запросов к
+# базе, команд Redis и команд MongoDB на запрос. Запросы и команды считает
+# MetricsMiddleware (ads_app/metrics.py): только в этом процессе и только
+# клиенты приложения, поэтому с --url в этих столбцах нули.
+#
+# views-noredis работает без PageCacheMiddleware, но с работающим Redis:
+# его представления в Redis не ходят, а сигналы моделей обновляют кеш, как
+# в бою. После прогона ключи приложения сбрасываются.
+#
+# Замер пишет в базу (комментарии и теги), поэтому без --force он идёт
+# только на отдельной базе, где все объявления созданы seed_adverts. Текст
+# комментариев и имена тегов содержат метку прогона; после замера
+# удаляются только строки с этой меткой, созданные во время прогона.
+
+BENCH_AUTHOR = 'benchmark'
+BENCH_TAG = 'bench'
+ENDPOINTS = ('list', 'detail', 'search', 'comment', 'tag')
+# Имена добавляемых тегов не повторяются: иначе повторное добавление
+# ничего не пишет и замер оказывается дешевле настоящего.
+tag_numbers = itertools.count()
+PAGE_CACHE_MIDDLEWARE = 'ads_app.pagecache.PageCacheMiddleware'
+METRICS_MIDDLEWARE = 'ads_app.metrics.MetricsMiddleware'
+
+
+def percentile(timings, value):
+    # Ближайший ранг: timings отсортированы.
+    if not timings:
+        return 0.0
+    return timings[max(math.ceil(value / 100 * len(timings)) - 1, 0)]
+
+
+class Counters:
+    # Запросы к базе, команды Redis и MongoDB со всех потоков процесса.
+    # Их считает MetricsMiddleware (ads_app/metrics.py), замер берёт
+    # прирост счётчиков за прогон.
+
+    names = {'queries': metrics.COUNTER_NAMES['db'], 'redis': metrics.COUNTER_NAMES['redis'],
+             'mongo': metrics.COUNTER_NAMES['mongo']}
+
+    def __init__(self):
+        self.reset()
+
+    def totals(self):
+        return {name: metrics.registry.total(counter) for name, counter in self.names.items()}
+
+    def reset(self):
+        self.started = self.totals()
+
+    @property
+    def values(self):
+        return {name: value - self.started[name] for name, value in self.totals().items()}
+
+counters = Counters()
+
+
+def load_views(name):
+    if name == 'redis':
+        return views
+    spec = importlib.util.spec_from_file_location(
+        'ads_app.views_noredis', os.path.join(os.path.dirname(views.__file__), 'views-noredis.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_urlconf(name, module):
+    # Маршруты приложения с представлениями из module; тех, что в нём
+    # нет (API, статистика), берутся из views.
+    patterns = []
+    for pattern in app_urls.urlpatterns:
+        callback = getattr(pattern.callback, 'view_class', pattern.callback)
+        view = getattr(module, callback.__name__, None)
+        if view is not None and view is not callback:
+            view = view.as_view() if isinstance(view, type) else view
+            pattern = path(str(pattern.pattern), view, name=pattern.name)
+        patterns.append(pattern)
+    urlconf = types.ModuleType(f'benchmark_urls_{name}')
+    urlconf.urlpatterns = [path('', include((patterns, app_urls.app_name), namespace='ads_app'))] + [
+        pattern for pattern in site_urls.urlpatterns if getattr(pattern, 'namespace', None) != 'ads_app']
+    urlconf.handler404 = module.error_404_view
+    return urlconf
+
+@contextmanager
+def views_settings(name):
+    # Каждый модуль начинает с пустого кеша.
+    module = load_views(name)
+    cache.flush_namespace()
+    local_cache.clear()
+    if name == 'redis':
+        yield
+        return
+    middleware = [item for item in settings.MIDDLEWARE if item != PAGE_CACHE_MIDDLEWARE]
+    try:
+        with override_settings(ROOT_URLCONF=make_urlconf(name, module), MIDDLEWARE=middleware):
+            yield
+    finally:
+        cache.flush_namespace()
+        local_cache.clear()
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+@contextmanager
+def http_server():
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=False)
+    server.set_app(WSGIHandler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:%d' % server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def http_request(base, method, url, data, token):
+    host = base.split('://', 1)[1].rstrip('/')
+    connection = http.client.HTTPConnection(host, timeout=60)
+    headers = {'Cookie': f'csrftoken={token}', 'X-CSRFToken': token} if token else {}
+    body = None
+    if data is not None:
+        body = urllib.parse.urlencode(data).encode()
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    try:
+        connection.request(method, url, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status, response.getheader('Set-Cookie') or ''
+    finally:
+        connection.close()
+
+def csrf_token(base):
+    # Один токен на прогон: проверка CSRF сравнивает cookie и заголовок.
+    status, cookie = http_request(base, 'GET', '/', None, None)
+    for part in cookie.replace(',', ';').split(';'):
+        key, _, value = part.strip().partition('=')
+        if key == 'csrftoken':
+            return value
+    return None
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает views.py (Redis) и views-noredis.py: задержки p50/p95/p99, '
+            'пропускную способность, запросы к базе и команды Redis/MongoDB на запрос')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--views', default='redis,noredis', help='модули представлений через запятую')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='пути через запятую')
+        parser.add_argument('--modes', default='client,http', help='client — тестовый клиент, http — нагрузка по сети')
+        parser.add_argument('--requests', type=int, default=200, help='запросов на путь')
+        parser.add_argument('--warmup', type=int, default=20, help='запросов перед замером')
+        parser.add_argument('--concurrency', type=int, default=8, help='потоков нагрузки в режиме http')
+        parser.add_argument('--url', help='адрес уже запущенного сервера вместо встроенного (режим http)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='сохранить результаты в JSON')
+        parser.add_argument('--compare', help='JSON прошлого прогона: показать изменения')
+        parser.add_argument('--threshold', type=float, default=10, help='допустимое ухудшение p95 и запр./с, %%')
+        parser.add_argument('--force', action='store_true',
+                            help='запустить на базе, где есть объявления не из seed_adverts')
+
+    def requests(self, endpoint, count, ids, rng):
+        run = self.run
+        for index in range(count):
+            pk = rng.choice(ids)
+            if endpoint == 'list':
+                yield 'GET', '/', None
+            elif endpoint == 'detail':
+                yield 'GET', f'/id{pk}', None
+            elif endpoint == 'search':
+                yield 'GET', f'/?btnSearch=1&cmbCategoty=0&search={urllib.parse.quote(rng.choice(WORDS))}', None
+            elif endpoint == 'comment':
+                yield 'POST', f'/comment/create/{pk}', {'author': BENCH_AUTHOR, 'content': f'замер {run} {index}'}
+            elif endpoint == 'tag':
+                yield 'POST', f'/id{pk}', {'btnAddTag': '1', 'tag': f'{BENCH_TAG}{run}x{next(tag_numbers)}'}
+
+    def run_client(self, requests):
+        client = Client()
+        timings, errors = [], 0
+        for method, url, data in requests:
+            started = time.perf_counter()
+            response = client.get(url) if method == 'GET' else client.post(url, data)
+            timings.append(time.perf_counter() - started)
+            errors += response.status_code >= 400
+        return timings, errors
+
+    def run_http(self, requests, base, concurrency):
+        token = csrf_token(base)
+
+        def request(item):
+            method, url, data = item
+            started = time.perf_counter()
+            try:
+                status, cookie = http_request(base, method, url, data, token)
+            except OSError:
+                status = 599
+            return time.perf_counter() - started, status
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(request, list(requests)))
+        return [timing for timing, status in results], sum(status >= 400 for timing, status in results)
+
+    def measure(self, run, endpoint, options, ids):
+        rng = random.Random(options['seed'])
+        if options['warmup']:
+            run(self.requests(endpoint, options['warmup'], ids, rng))
+        counters.reset()
+        started = time.perf_counter()
+        timings, errors = run(self.requests(endpoint, options['requests'], ids, rng))
+        elapsed = time.perf_counter() - started
+        timings.sort()
+        count = len(timings)
+        return {
+            'requests': count,
+            'errors': errors,
+            'p50': percentile(timings, 50) * 1000,
+            'p95': percentile(timings, 95) * 1000,
+            'p99': percentile(timings, 99) * 1000,
+            'rps': count / elapsed,
+            **{name: value / count for name, value in counters.values.items()},
+        }
+
+    def write_row(self, row):
+        self.stdout.write(f'{row["views"]:9}{row["mode"]:8}{row["endpoint"]:9}{row["p50"]:9.1f}{row["p95"]:9.1f}'
+                          f'{row["p99"]:9.1f}{row["rps"]:9.1f}{row["queries"]:8.1f}{row["redis"]:8.1f}'
+                          f'{row["mongo"]:8.1f}{row["errors"]:7}')
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoints'].split(',')
+        modes = options['modes'].split(',')
+        unknown = set(endpoints).difference(ENDPOINTS) | set(modes).difference(('client', 'http'))
+        if unknown:
+            raise CommandError(f'Неизвестные пути или режимы: {", ".join(sorted(unknown))}')
+        if not metrics.ENABLED or METRICS_MIDDLEWARE not in settings.MIDDLEWARE:
+            raise CommandError('Замер считает запросы по счётчикам ads_app.metrics: включите METRICS_ENABLED '
+                               'и MetricsMiddleware')
+        ids = list(Advert.objects.order_by('-created').values_list('id', flat=True)[:1000])
+        if not ids:
+            raise CommandError('В базе нет объявлений: заполните её командой seed_adverts')
+        if not options['force'] and Advert.objects.exclude(title__startswith=SEED_PREFIX).exists():
+            raise CommandError('В базе есть объявления не из seed_adverts, а замер пишет в неё комментарии '
+                               'и теги. Запустите его на отдельной базе или с --force')
+        self.run = uuid.uuid4().hex[:8]
+        last_comment, last_tag = self.last_pk(Comment), self.last_pk(Tag)
+        names = ['external'] if options['url'] else options['views'].split(',')
+        results = []
+        # Замер шлёт комментарии с одного адреса быстрее любых ограничений.
+        rate_limits, ingest.RATE_LIMITS = ingest.RATE_LIMITS, {}
+        self.stdout.write(f'{"модуль":9}{"режим":8}{"путь":9}{"p50, мс":>9}{"p95, мс":>9}{"p99, мс":>9}'
+                          f'{"запр./с":>9}{"база":>8}{"redis":>8}{"mongo":>8}{"ошибок":>7}')
+        try:
+            for name in names:
+                with views_settings(name if name != 'external' else 'redis'):
+                    for mode in (['http'] if options['url'] else modes):
+                        for endpoint in endpoints:
+                            row = {'views': name, 'mode': mode, 'endpoint': endpoint}
+                            if mode == 'client':
+                                row.update(self.measure(self.run_client, endpoint, options, ids))
+                            elif options['url']:
+                                row.update(self.measure(
+                                    lambda requests: self.run_http(requests, options['url'], options['concurrency']),
+                                    endpoint, options, ids))
+                            else:
+                                with http_server() as base:
+                                    row.update(self.measure(
+                                        lambda requests: self.run_http(requests, base, options['concurrency']),
+                                        endpoint, options, ids))
+                            self.write_row(row)
+                            results.append(row)
+        finally:
+            ingest.RATE_LIMITS = rate_limits
+            self.cleanup(ids, last_comment, last_tag)
+        report = {
+            'commit': self.commit(),
+            'date': timezone.now().isoformat(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'dataset': {'adverts': Advert.objects.count(), 'comments': Comment.objects.count()},
+            'options': {key: options[key] for key in
+                        ('views', 'endpoints', 'modes', 'requests', 'warmup', 'concurrency', 'url', 'seed')},
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты сохранены в {options["output"]}')
+        if options['compare']:
+            self.compare(report, options['compare'], options['threshold'])
+
+    def last_pk(self, model):
+        return model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    def cleanup(self, ids, last_comment, last_tag):
+        # Комментарии и теги, добавленные замером, удаляются через ORM:
+        # сигналы приведут в порядок кеш. Комментарии из буфера сначала
+        # записываются в базу, чтобы воркер не записал их уже после.
+        for pk in ids:
+            guarded(ingest.flush)(pk)
+        comments = list(Comment.objects.filter(
+            pk__gt=last_comment, author=BENCH_AUTHOR, content__startswith=f'замер {self.run} ',
+        ).values_list('pk', flat=True))
+        tags = list(Tag.objects.filter(
+            pk__gt=last_tag, name__startswith=f'{BENCH_TAG}{self.run}x',
+        ).values_list('pk', flat=True))
+        Comment.objects.filter(pk__in=comments).delete()
+        Tag.objects.filter(pk__in=tags).delete()
+
+    def commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, report, path, threshold):
+        with open(path, encoding='utf-8') as source:
+            previous = json.load(source)
+        before = {(row['views'], row['mode'], row['endpoint']): row for row in previous['results']}
+        self.stdout.write(f'Сравнение с {previous.get("commit") or path}:')
+        regressions = []
+        for row in report['results']:
+            old = before.get((row['views'], row['mode'], row['endpoint']))
+            if old is None:
+                continue
+            p95 = (row['p95'] - old['p95']) / old['p95'] * 100 if old['p95'] else 0
+            rps = (row['rps'] - old['rps']) / old['rps'] * 100 if old['rps'] else 0
+            line = (f'{row["views"]:9}{row["mode"]:8}{row["endpoint"]:9}p95 {p95:+7.1f}%  запр./с {rps:+7.1f}%'
+                    f'  база {row["queries"] - old["queries"]:+.1f}  redis {row["redis"] - old["redis"]:+.1f}')
+            if p95 > threshold or rps < -threshold:
+                regressions.append(line)
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f'Ухудшение больше {threshold}%: {len(regressions)}')
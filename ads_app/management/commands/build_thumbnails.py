@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from ads_app import cache, pagecache, thumbnails
+from ads_app.models import Advert
+
+
+class Command(BaseCommand):
+    help = 'Собирает уменьшенные копии фото объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='id объявлений (по умолчанию все)')
+        parser.add_argument('--force', action='store_true', help='пересобрать уже готовые копии')
+
+    def handle(self, *args, **options):
+        adverts = Advert.objects.exclude(photo='').only('id', 'photo')
+        if options['ids']:
+            adverts = adverts.filter(pk__in=options['ids'])
+        built = []
+        for advert in adverts:
+            if not options['force'] and thumbnails.srcsets(advert.photo.name):
+                continue
+            try:
+                thumbnails.build(advert.photo.name)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'{advert.id}: {advert.photo.name}: {error}')
+                continue
+            built.append(advert.id)
+        if built:
+            cache.refresh_adverts(built)
+            pagecache.purge_adverts(built)
+        self.stdout.write(self.style.SUCCESS(f'Собраны копии фото объявлений: {len(built)}'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from ads_app.models import Advert
+from ads_app.querycount import QUERY_BUDGETS, QueryBudgetExceeded, budget_urls, query_budget
+
+
+class Command(BaseCommand):
+    help = 'Проверяет, что страницы укладываются в бюджет запросов к базе'
+
+    def handle(self, *args, **options):
+        advert = Advert.objects.order_by('-id').first()
+        if advert is None:
+            raise CommandError('В базе нет объявлений для проверки')
+        urls = budget_urls(advert)
+        client = Client()
+        failures = []
+        for name, url in urls.items():
+            for attempt, limit in zip(('первый', 'повторный'), QUERY_BUDGETS[name]):
+                try:
+                    with query_budget(limit, f'{name} ({attempt}) {url}') as context:
+                        response = client.get(url)
+                except QueryBudgetExceeded as error:
+                    failures.append(str(error))
+                    continue
+                if response.status_code != 200:
+                    failures.append(f'{name}: {url} вернул {response.status_code}')
+                    break
+                self.stdout.write(f'{name:15} {attempt:10} {len(context):3} / {limit}')
+        if failures:
+            raise CommandError('\n\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('Все страницы укладываются в бюджет запросов'))
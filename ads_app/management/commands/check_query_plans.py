@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from ads_app import queryplan, repository
+
+
+class Command(BaseCommand):
+    help = 'Проверяет, что горячие запросы к MongoDB идут по индексам, а не COLLSCAN'
+
+    def handle(self, *args, **options):
+        try:
+            results = queryplan.check(repository.database())
+        except LookupError as error:
+            raise CommandError(str(error))
+        failures = []
+        for name, indexes, error in results:
+            if error:
+                failures.append(f'{name}: {error}')
+                self.stdout.write(f'{name:22} COLLSCAN')
+            else:
+                self.stdout.write(f'{name:22} {", ".join(indexes)}')
+        if failures:
+            raise CommandError('\n'.join(failures) + '\nСоздайте индексы: manage.py sync_indexes')
+        self.stdout.write(self.style.SUCCESS('Все горячие запросы используют индексы'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from ads_app import repository
+from ads_app.models import Advert
+
+
+class Command(BaseCommand):
+    help = 'Заполняет последние комментарии и их число в документах объявлений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='id объявлений (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        if not repository.EMBEDDED_COMMENTS:
+            raise CommandError('Встроенные комментарии выключены (MONGO_EMBEDDED_COMMENTS)')
+        ids = options['ids'] or Advert.objects.values_list('id', flat=True).iterator()
+        count = 0
+        for pk in ids:
+            repository.embed_comments(pk)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Обновлены комментарии объявлений: {count}'))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from ads_app import bulk
+import json
+import sys
+import time
+
+
+class Command(BaseCommand):
+    help = 'Выгружает объявления с тегами и комментариями в NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-', help='файл или - для stdout')
+        parser.add_argument('--batch-size', type=int, default=bulk.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+        started = time.monotonic()
+        output = options['output']
+        stream = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8')
+        count = 0
+        try:
+            for record in bulk.export_records(options['batch_size']):
+                stream.write(json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+                count += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        elapsed = time.monotonic() - started
+        # Итог — в stderr, чтобы не смешиваться с выгрузкой в stdout.
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено объявлений: {count}, {elapsed:.1f} с, {count / max(elapsed, 1e-9):.0f}/с'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from ads_app import bulk, repository
+import sys
+import time
+
+
+class Command(BaseCommand):
+    help = 'Импортирует объявления из NDJSON (по объекту на строку) пачками прямо в MongoDB'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='файл NDJSON или - для stdin')
+        parser.add_argument('--batch-size', type=int, default=bulk.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if not repository.ENABLED:
+            raise CommandError('Импорт пишет в MongoDB через pymongo: включите MONGO_REPOSITORY')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+        started = time.monotonic()
+
+        def progress(totals):
+            done = totals['created'] + totals['updated']
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'{done} объявлений, {done / elapsed:.0f}/с')
+
+        path = options['path']
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            totals = bulk.import_stream(stream, options['batch_size'], progress)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        for number, error in totals['errors']:
+            self.stderr.write(f'строка {number}: {error}')
+        for warning in totals['warnings']:
+            self.stderr.write(self.style.WARNING(warning))
+        elapsed = time.monotonic() - started
+        done = totals['created'] + totals['updated']
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {totals["created"]}, обновлено: {totals["updated"]}, '
+            f'пропущено строк: {len(totals["errors"])}, {elapsed:.1f} с, {done / max(elapsed, 1e-9):.0f} объявлений/с'))
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from ads_app import cache, pagination, stats
+from ads_app.local_cache import local_cache
+from ads_app.models import Advert
+import threading
+
+
+class Command(BaseCommand):
+    help = ('Сбрасывает ключи кеша и запрашивает их из нескольких потоков сразу: '
+            'запросов к базе должно быть столько же, сколько при одном потоке')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=20, help='одновременных запросов')
+
+    def run(self, threads, reset, load):
+        barrier = threading.Barrier(threads)
+        counts = []
+        errors = []
+
+        def worker():
+            try:
+                barrier.wait()
+                with CaptureQueriesContext(connection) as context:
+                    load()
+                counts.append(len(context))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        reset()
+        local_cache.clear()
+        workers = [threading.Thread(target=worker) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        if errors:
+            raise CommandError(f'Ошибка в потоке: {errors[0]!r}')
+        return sum(counts)
+
+    def handle(self, *args, **options):
+        advert = Advert.objects.order_by('-created').first()
+        if advert is None:
+            raise CommandError('В базе нет объявлений для проверки')
+        ids = pagination.get_page()['ids']
+        scenarios = {
+            'категории': (lambda: cache.redis_cache.delete(cache.categories_key()),
+                          cache.get_categories),
+            'комментарии': (lambda: cache.redis_cache.delete(cache.comments_key(advert.id)),
+                            lambda: cache.get_comments(advert.id)),
+            'страница ленты': (pagination.invalidate_all, pagination.get_page),
+            'объявления': (lambda: cache.redis_cache.delete(*map(cache.advert_key, ids)),
+                           lambda: cache.get_adverts(ids)),
+            'статистика': (lambda: [stats.drop(pk) for pk in ids],
+                           lambda: stats.get_many(ids)),
+        }
+        failed = []
+        for name, (reset, load) in scenarios.items():
+            single = self.run(1, reset, load)
+            concurrent = self.run(options['threads'], reset, load)
+            self.stdout.write(f'{name:16} 1 поток: {single:3}   {options["threads"]} потоков: {concurrent:3}')
+            if concurrent > single:
+                failed.append(name)
+        if failed:
+            raise CommandError('Холодный ключ собирался больше одного раза: ' + ', '.join(failed))
+        self.stdout.write(self.style.SUCCESS('Каждый холодный ключ собран один раз'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from ads_app import search
+import time
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс объявлений в Redis'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано объявлений: {count} за {time.monotonic() - started:.2f} с'))
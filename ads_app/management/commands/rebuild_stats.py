@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from ads_app import stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики тегов и комментариев объявлений в Redis'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='id объявлений (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        result = stats.rebuild(options['ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'Пересчитана статистика объявлений: {len(result)}'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from ads_app import tasks
+import signal
+import time
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди в Redis (кеш, поиск, копии фото, комментарии)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='выполнить готовые задачи и выйти')
+        parser.add_argument('--interval', type=float, default=0.2, help='пауза при пустой очереди, с')
+        parser.add_argument('--batch-size', type=int, default=tasks.BATCH_SIZE)
+        parser.add_argument('--stats', action='store_true', help='показать размер очереди и выйти')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for name, value in tasks.stats().items():
+                self.stdout.write(f'{name:12}{value:8}')
+            return
+        self.stopping = False
+
+        def stop(signum, frame):
+            # Текущая пачка дорабатывается, новая не берётся.
+            self.stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        done = 0
+        while not self.stopping:
+            close_old_connections()
+            jobs = tasks.claim(options['batch_size'])
+            if jobs:
+                done += tasks.process(jobs)
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Выполнено задач: {done}'))
@@ -0,0 +1,130 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from ads_app import bulk, cache, repository
+from ads_app.models import Advert, Category, Comment, Tag
+from datetime import timedelta
+import json
+import random
+import time
+
+# Синтетические объявления для benchmark_views. Заголовок начинается с
+# SEED_PREFIX: по нему --clear находит и удаляет прошлый набор.
+
+SEED_PREFIX = '[bench] '
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+WORDS = ('продам куплю обменяю новый почти новая отличный срочно недорого торг доставка гарантия '
+         'автомобиль велосипед диван телефон ноутбук квартира комната гараж шкаф стол кресло '
+         'коляска куртка пальто сапоги книги игрушки холодильник телевизор камера часы').split()
+CATEGORIES = ('Транспорт', 'Недвижимость', 'Электроника', 'Мебель', 'Одежда', 'Детям', 'Хобби')
+
+
+def dataset_size(value):
+    try:
+        return SIZES.get(value.lower()) or int(value)
+    except ValueError:
+        raise CommandError(f'Размер набора: {", ".join(SIZES)} или число, а не {value!r}')
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими объявлениями с тегами и комментариями для замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('size', help='число объявлений: 1k, 100k, 1m или число')
+        parser.add_argument('--comments', type=int, default=5, help='комментариев на объявление (в среднем)')
+        parser.add_argument('--tags', type=int, default=3, help='тегов на объявление')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0, help='зерно генератора: тот же набор при повторе')
+        parser.add_argument('--clear', action='store_true', help='сначала удалить прошлый синтетический набор')
+
+    def records(self, count, options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        for index in range(count):
+            words = rng.sample(WORDS, 3)
+            yield {
+                'title': f'{SEED_PREFIX}{" ".join(words).capitalize()} №{index + 1}',
+                'content': ' '.join(rng.choice(WORDS) for i in range(rng.randint(20, 60))),
+                'category': rng.choice(CATEGORIES),
+                'author': self.author,
+                'tags': rng.sample(WORDS, min(options['tags'], len(WORDS))),
+                'created': now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)),
+                'comments': [{'author': f'гость{rng.randint(1, 999)}',
+                              'content': ' '.join(rng.choice(WORDS) for i in range(rng.randint(3, 15)))}
+                             for i in range(rng.randint(0, options['comments'] * 2))],
+            }
+
+    def handle(self, *args, **options):
+        count = dataset_size(options['size'])
+        user = get_user_model().objects.filter(is_superuser=True).order_by('id').first()
+        self.author = user.username if user else None
+        if options['clear']:
+            self.stdout.write(f'Удалено синтетических объявлений: {self.clear()}')
+        started = time.monotonic()
+        if repository.ENABLED:
+            lines = (json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False)
+                     for record in self.records(count, options))
+            totals = bulk.import_stream(lines, options['batch_size'])
+            created = totals['created']
+        else:
+            created = self.seed_orm(count, options)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано объявлений: {created}, {elapsed:.1f} с, {created / max(elapsed, 1e-9):.0f}/с'))
+
+    def seed_orm(self, count, options):
+        # Без MongoDB (или с выключенным repository) — через bulk_create с
+        # явными id, в обход сигналов; кеш после этого сбрасывается целиком.
+        # auto_now_add не даёт задать created, поэтому у всех объявлений
+        # набора оно одно.
+        categories = {name: Category.objects.get_or_create(name=name)[0].id for name in CATEGORIES}
+        author = get_user_model().objects.filter(username=self.author).first()
+        advert_id = (Advert.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        comment_id = (Comment.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        batch = []
+
+        def flush():
+            nonlocal comment_id
+            adverts, tags, comments = [], [], []
+            for pk, record in batch:
+                adverts.append(Advert(id=pk, title=record['title'], content=record['content'],
+                                      category_id=categories[record['category']], author=author))
+                tags.extend(Tag(advert_id=pk, name=name) for name in record['tags'])
+                for comment in record['comments']:
+                    comments.append(Comment(id=comment_id, advert_id=pk, **comment))
+                    comment_id += 1
+            with transaction.atomic():
+                Advert.objects.bulk_create(adverts)
+                Tag.objects.bulk_create(tags)
+                Comment.objects.bulk_create(comments)
+            batch.clear()
+
+        for record in self.records(count, options):
+            batch.append((advert_id, record))
+            advert_id += 1
+            if len(batch) >= options['batch_size']:
+                flush()
+        if batch:
+            flush()
+        cache.flush_namespace()
+        return count
+
+    def clear(self):
+        ids = list(Advert.objects.filter(title__startswith=SEED_PREFIX).values_list('id', flat=True))
+        if repository.ENABLED:
+            db = repository.database()
+            for start in range(0, len(ids), 1000):
+                chunk = ids[start:start + 1000]
+                db[repository.COMMENTS].delete_many({'advert_id': {'$in': chunk}})
+                db[repository.TAGS].delete_many({'advert_id': {'$in': chunk}})
+                db[repository.ADVERTS].delete_many({'id': {'$in': chunk}})
+        else:
+            for start in range(0, len(ids), 1000):
+                chunk = ids[start:start + 1000]
+                Comment.objects.filter(advert_id__in=chunk)._raw_delete(Comment.objects.db)
+                Tag.objects.filter(advert_id__in=chunk)._raw_delete(Tag.objects.db)
+                Advert.objects.filter(id__in=chunk)._raw_delete(Advert.objects.db)
+        cache.flush_namespace()
+        return len(ids)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from ads_app import repository
+
+
+class Command(BaseCommand):
+    help = 'Создаёт в MongoDB индексы, которые нужны приложению'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune', action='store_true', help='удалить устаревшие индексы приложения')
+        parser.add_argument('--dry-run', action='store_true', help='только показать, что будет сделано')
+
+    def handle(self, *args, **options):
+        actions = repository.sync_indexes(prune=options['prune'], dry_run=options['dry_run'])
+        for collection, name, action in actions:
+            self.stdout.write(f'{collection:20} {name:24} {action}')
+        changed = sum(1 for collection, name, action in actions if action != 'есть')
+        self.stdout.write(self.style.SUCCESS(f'Изменено индексов: {changed}'))
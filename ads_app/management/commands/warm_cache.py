@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from ads_app import warmup
+
+
+class Command(BaseCommand):
+    help = 'Заполняет кеш Redis: категории, первые страницы ленты, самые просматриваемые объявления'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=warmup.PAGES, help='сколько первых страниц ленты')
+        parser.add_argument('--top', type=int, default=warmup.TOP, help='сколько самых просматриваемых объявлений')
+        parser.add_argument('--batch-size', type=int, default=warmup.BATCH_SIZE)
+        parser.add_argument('--concurrency', type=int, default=warmup.CONCURRENCY,
+                            help='сколько пачек читать из базы одновременно')
+
+    def handle(self, *args, **options):
+        report = warmup.warm(options['pages'], options['top'], options['batch_size'], options['concurrency'])
+        self.stdout.write(f'Категории: {report["categories"]}, страницы ленты: {report["pages"]}, '
+                          f'объявления, счётчики и комментарии: {report["adverts"]}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Записано ключей: {report["keys"]} за {report["elapsed"]:.2f} с'))
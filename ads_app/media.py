@@ -0,0 +1,118 @@
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from ads_app import thumbnails
+import mimetypes
+import os
+import re
+
+# Отдача загруженных файлов. Если перед приложением стоит nginx или
+# Apache, тело отдаёт он: ответ содержит только заголовок X-Accel-Redirect
+# или X-Sendfile (MEDIA_OFFLOAD). Иначе файл отдаётся здесь же, с ETag,
+# Last-Modified, ответом 304 и запросами Range; целиком он уходит через
+# wsgi.file_wrapper (sendfile), а не копируется в Python.
+#
+# Уменьшенные копии и фото с именем по хешу содержимого не меняются,
+# поэтому кешируются навсегда; остальное (иконки, старые фото) — на
+# MEDIA_MAX_AGE.
+
+MEDIA_OFFLOAD = getattr(settings, 'MEDIA_OFFLOAD', None)
+MEDIA_ACCEL_PREFIX = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+MEDIA_MAX_AGE = getattr(settings, 'MEDIA_MAX_AGE', 60 * 60 * 24)
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+CHUNK_SIZE = 64 * 1024
+
+HASHED_RE = re.compile(r'^photos/[0-9a-f]{20}(_\w+)?\.\w+$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def is_immutable(path):
+    return path.startswith(thumbnails.THUMBNAIL_DIR + '/') or HASHED_RE.match(path) is not None
+
+def parse_range(header, size):
+    # Поддерживается один диапазон; несколько диапазонов (multipart)
+    # браузеры для картинок не запрашивают, на них отдаётся файл целиком.
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), int(last) if last else size - 1
+    elif last:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        return None
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+def read_range(handle, start, length):
+    with handle:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve(request, path):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(fullpath)
+    except OSError:
+        raise Http404
+    if not os.path.isfile(fullpath):
+        raise Http404
+    etag = quote_etag(f'{int(stat.st_mtime):x}-{stat.st_size:x}')
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        response = respond(request, path, fullpath, stat.st_size)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if is_immutable(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=MEDIA_MAX_AGE)
+    return response
+
+def respond(request, path, fullpath, size):
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    if MEDIA_OFFLOAD == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX + path
+        return response
+    if MEDIA_OFFLOAD == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = fullpath
+        return response
+    header = request.META.get('HTTP_RANGE', '')
+    try:
+        byte_range = parse_range(header, size) if header else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(read_range(open(fullpath, 'rb'), start, end - start + 1),
+                                content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        size = end - start + 1
+    response['Content-Length'] = str(size)
+    response['Accept-Ranges'] = 'bytes'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,370 @@
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends import django as backend
+from django.urls import Resolver404, resolve
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+from pymongo import monitoring
+import contextvars
+import logging
+import random
+import re
+import redis.asyncio
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Замеры на каждый запрос: запросы к базе (через djongo это и перевод SQL,
+# и сама MongoDB), команды MongoDB (pymongo, в том числе из djongo),
+# команды Redis, попадания и промахи кеша по семействам ключей, время
+# (де)сериализации значений кеша и отрисовки шаблонов. Итог запроса уходит
+# в заголовок Server-Timing и в счётчики процесса, которые отдаёт /metrics
+# в формате Prometheus. У каждого воркера gunicorn счётчики свои.
+#
+# Текст запросов сохраняется только у доли запросов (METRICS_SAMPLE_RATE):
+# если такой запрос оказался медленнее METRICS_SLOW_REQUEST, весь список
+# пишется в лог.
+#
+# Замеры текущего запроса лежат в contextvars: в ASGI-приложении
+# (ads_app/aio.py) запрос идёт то в цикле событий, то в потоках пула, и
+# aio.run_sync передаёт контекст в поток вместе с вызовом.
+
+ENABLED = getattr(settings, 'METRICS_ENABLED', True)
+SERVER_TIMING = getattr(settings, 'METRICS_SERVER_TIMING', True)
+SAMPLE_RATE = getattr(settings, 'METRICS_SAMPLE_RATE', 0.05)
+SLOW_REQUEST = getattr(settings, 'METRICS_SLOW_REQUEST', 0.5)
+ALLOWED_IPS = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+
+COUNTER_NAMES = {'db': 'ads_db_queries_total', 'mongo': 'ads_mongo_commands_total',
+                 'redis': 'ads_redis_commands_total'}
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestMetrics:
+
+    def __init__(self, sampled):
+        self.started = time.perf_counter()
+        self.sampled = sampled
+        self.timings = {'db': 0.0, 'mongo': 0.0, 'redis': 0.0, 'serialize': 0.0, 'template': 0.0}
+        self.counts = {'db': 0, 'mongo': 0, 'redis': 0}
+        # (уровень, семейство) -> [попадания, промахи]
+        self.cache = {}
+        self.queries = []
+        self.template_depth = 0
+
+    def add(self, kind, elapsed, count=1):
+        self.timings[kind] += elapsed
+        if kind in self.counts:
+            self.counts[kind] += count
+
+_current = contextvars.ContextVar('metrics', default=None)
+
+def current():
+    return _current.get()
+
+
+def record_cache(level, family, hits=0, misses=0):
+    metrics = current()
+    if metrics is not None:
+        counts = metrics.cache.setdefault((level, family), [0, 0])
+        counts[0] += hits
+        counts[1] += misses
+
+def timed(kind):
+    # Время вызова попадает в замеры текущего запроса, если он есть.
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = current()
+            if metrics is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.add(kind, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def db_wrapper(execute, sql, params, many, context):
+    metrics = current()
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if metrics is not None:
+            elapsed = time.perf_counter() - started
+            metrics.add('db', elapsed)
+            if metrics.sampled:
+                metrics.queries.append(('sql', elapsed, sql))
+
+
+@contextmanager
+def db_queries():
+    # Обёртки запросов к базе ставятся на соединения текущего потока.
+    if current() is None:
+        yield
+        return
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(db_wrapper))
+        yield
+
+
+class MongoListener(monitoring.CommandListener):
+    # pymongo сообщает о командах в том же потоке, что их выполняет.
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics = current()
+        if metrics is not None:
+            elapsed = event.duration_micros / 1e6
+            metrics.add('mongo', elapsed)
+            if metrics.sampled:
+                metrics.queries.append(('mongo', elapsed, f'{event.command_name} {event.database_name}'))
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+def measured(func, pipeline=None):
+    # Команда (или пачка команд pipeline) клиента Redis.
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        metrics = current()
+        if metrics is None:
+            return func(*args, **kwargs)
+        count = len(pipeline.command_stack) if pipeline is not None else 1
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.add('redis', time.perf_counter() - started, count)
+    return wrapper
+
+def measured_async(func, pipeline=None):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        metrics = current()
+        if metrics is None:
+            return await func(*args, **kwargs)
+        count = len(pipeline.command_stack) if pipeline is not None else 1
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            metrics.add('redis', time.perf_counter() - started, count)
+    return wrapper
+
+def instrument(client):
+    # У redis-py нет хуков, поэтому методы оборачиваются у экземпляра, а
+    # не у класса: замеряются только клиенты приложения (redis_cache и
+    # клиенты ads_app/aio.py), чужие клиенты Redis в процессе не меняются.
+    if not ENABLED or getattr(client, 'measured', False):
+        return client
+    wrap = measured_async if isinstance(client, redis.asyncio.Redis) else measured
+    pipeline = client.pipeline
+
+    @wraps(pipeline)
+    def measured_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        pipe.execute = wrap(pipe.execute, pipe)
+        return pipe
+
+    client.execute_command = wrap(client.execute_command)
+    client.pipeline = measured_pipeline
+    client.measured = True
+    return client
+
+
+class Template(backend.Template):
+    # Время отрисовки шаблона. Вложенные шаблоны, отрисованные отдельно
+    # (карточки, фрагменты), уже входят во внешний.
+
+    def render(self, context=None, request=None):
+        metrics = current()
+        if metrics is None or metrics.template_depth:
+            return super().render(context, request)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_depth -= 1
+            metrics.add('template', time.perf_counter() - started)
+
+
+class DjangoTemplates(backend.DjangoTemplates):
+    # Шаблонизатор Django с замером отрисовки: settings.TEMPLATES['BACKEND'].
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+def install():
+    # Вызывается из AppConfig.ready(): слушатель pymongo должен быть
+    # зарегистрирован до создания клиентов.
+    if not ENABLED or getattr(install, 'done', False):
+        return
+    install.done = True
+    monitoring.register(MongoListener())
+    from ads_app.redis_client import redis_cache
+    instrument(redis_cache)
+
+
+# Счётчики процесса в формате Prometheus.
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in pairs) + '}'
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            buckets, total = self.histograms.get(key, ([0] * len(BUCKETS), [0, 0.0]))
+            for index, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    buckets[index] += 1
+            total[0] += 1
+            total[1] += value
+            self.histograms[key] = (buckets, total)
+
+    def total(self, name):
+        # Сумма счётчика по всем меткам.
+        with self.lock:
+            return sum(value for (key, _), value in self.counters.items() if key == name)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (key, pairs), value in sorted(self.counters.items()):
+                    if key == name:
+                        lines.append(f'{name}{format_labels(pairs)} {value}')
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (key, pairs), (buckets, total) in sorted(self.histograms.items()):
+                    if key != name:
+                        continue
+                    for bound, count in zip(BUCKETS, buckets):
+                        lines.append(f'{name}_bucket{format_labels(pairs + (("le", bound),))} {count}')
+                    lines.append(f'{name}_bucket{format_labels(pairs + (("le", "+Inf"),))} {total[0]}')
+                    lines.append(f'{name}_sum{format_labels(pairs)} {total[1]:.6f}')
+                    lines.append(f'{name}_count{format_labels(pairs)} {total[0]}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+
+def view_name(request):
+    # Ответ из кеша страниц отдаётся до разбора адреса.
+    match = request.resolver_match
+    if match is None:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return 'other'
+    return match.url_name or 'other'
+
+# Имя метрики в Server-Timing — token из RFC 7230: двоеточие в семействах
+# ключей вроде advert:comments недопустимо.
+NOT_TOKEN = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+
+def server_timing(metrics, total):
+    parts = [f'total;dur={total * 1000:.1f}']
+    for kind, elapsed in metrics.timings.items():
+        if elapsed or metrics.counts.get(kind):
+            count = metrics.counts.get(kind)
+            desc = f';desc="{count}"' if count is not None else ''
+            parts.append(f'{kind};dur={elapsed * 1000:.1f}{desc}')
+    for (level, family), (hits, misses) in sorted(metrics.cache.items()):
+        name = NOT_TOKEN.sub('-', f'{level}-{family}')
+        parts.append(f'{name};desc="hit {hits} miss {misses}"')
+    return ', '.join(parts)
+
+def publish(request, response, metrics, total):
+    labels = {'view': view_name(request)}
+    registry.inc('ads_requests_total', dict(labels, method=request.method, status=response.status_code))
+    registry.observe('ads_request_duration_seconds', labels, total)
+    for kind, count in metrics.counts.items():
+        registry.inc(COUNTER_NAMES[kind], labels, count)
+    for kind, elapsed in metrics.timings.items():
+        registry.observe(f'ads_{kind}_duration_seconds', labels, elapsed)
+    for (level, family), (hits, misses) in metrics.cache.items():
+        registry.inc('ads_cache_requests_total', {'level': level, 'family': family, 'result': 'hit'}, hits)
+        registry.inc('ads_cache_requests_total', {'level': level, 'family': family, 'result': 'miss'}, misses)
+
+def start():
+    # Замеры нового запроса; None, если они выключены.
+    if not ENABLED:
+        return None
+    return RequestMetrics(sampled=random.random() < SAMPLE_RATE)
+
+@contextmanager
+def measure(metrics):
+    token = _current.set(metrics)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+def finish(request, response, metrics):
+    total = time.perf_counter() - metrics.started
+    publish(request, response, metrics, total)
+    if SERVER_TIMING:
+        response['Server-Timing'] = server_timing(metrics, total)
+    if metrics.sampled and total >= SLOW_REQUEST:
+        log_slow(request, metrics, total)
+    return response
+
+def log_slow(request, metrics, total):
+    lines = '\n'.join(f'{index}. [{kind} {elapsed * 1000:.1f} мс] {text}'
+                      for index, (kind, elapsed, text) in enumerate(metrics.queries, 1))
+    logger.warning('Медленный запрос %s %s: %.0f мс, запросов к базе %s, команд MongoDB %s, Redis %s\n%s',
+                   request.method, request.get_full_path(), total * 1000, metrics.counts['db'],
+                   metrics.counts['mongo'], metrics.counts['redis'], lines)
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install()
+
+    def __call__(self, request):
+        metrics = start()
+        if metrics is None:
+            return self.get_response(request)
+        with measure(metrics), db_queries():
+            response = self.get_response(request)
+        return finish(request, response, metrics)
+
+
+def export(request):
+    if request.META.get('REMOTE_ADDR') not in ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
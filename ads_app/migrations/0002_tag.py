@@ -0,0 +1,59 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def split_tags(apps, schema_editor):
+    Advert = apps.get_model('ads_app', 'Advert')
+    Tag = apps.get_model('ads_app', 'Tag')
+    tags = []
+    for advert in Advert.objects.all():
+        names = []
+        for name in (advert.tags or '').split():
+            name = name.lstrip('#').lower()[:50]
+            if name and name not in names:
+                names.append(name)
+        tags.extend(Tag(advert=advert, name=name) for name in names)
+    Tag.objects.bulk_create(tags, batch_size=500)
+
+
+def join_tags(apps, schema_editor):
+    Advert = apps.get_model('ads_app', 'Advert')
+    Tag = apps.get_model('ads_app', 'Tag')
+    for advert in Advert.objects.all():
+        names = Tag.objects.filter(advert=advert).order_by('id').values_list('name', flat=True)
+        advert.tags = ' '.join(names)[:255]
+        advert.save(update_fields=['tags'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=50, verbose_name='Тег')),
+                ('advert', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_set', to='ads_app.Advert', verbose_name='Объявление')),
+            ],
+            options={
+                'verbose_name': 'Тег',
+                'verbose_name_plural': 'Теги',
+                'ordering': ('id',),
+                'unique_together': {('advert', 'name')},
+            },
+        ),
+        migrations.RunPython(split_tags, join_tags),
+        migrations.AlterField(
+            model_name='advert',
+            name='tags',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='Теги'),
+        ),
+        migrations.RemoveField(
+            model_name='advert',
+            name='tags',
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads_app', '0002_tag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='token',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32, verbose_name='Токен приёма'),
+        ),
+    ]
@@ -1,7 +1,20 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from datetime import datetime
 
+TAG_MAX_LENGTH = 50
+
+def normalize_tag(name):
+    return ''.join((name or '').split()).lstrip('#').lower()[:TAG_MAX_LENGTH]
+
+def parse_tags(text):
+    names = []
+    for name in (text or '').split():
+        name = normalize_tag(name)
+        if name and name not in names:
+            names.append(name)
+    return names
+
 class Comment(models.Model):
     author = models.CharField(
         verbose_name = u"Автор комментария",
@@ -25,6 +38,16 @@ class Comment(models.Model):
         verbose_name = u'Объявление',
         related_name = 'comments'
         )
+    # Токен комментария из буфера приёма (ads_app/ingest.py): повторная
+    # запись пачки пропускает уже записанные.
+    token = models.CharField(
+        verbose_name = u'Токен приёма',
+        max_length=32,
+        blank=True,
+        default='',
+        db_index=True,
+        editable=False
+        )
 
     class Meta:
         verbose_name = u'Комментарий'
@@ -59,10 +82,6 @@ class Advert(models.Model):
         verbose_name = u'Содержание объявления',
         help_text = u'Обязательное поле'
         )
-    tags = models.CharField(
-        verbose_name = u'Теги',
-        max_length=255
-        )
     created = models.DateTimeField(
         verbose_name = u'Дата публикации',
         auto_now_add=True
@@ -103,3 +122,65 @@ class Advert(models.Model):
         time = datetime.strftime(self.created, '%d-%m-%Y %H:%M:%S')
         return f'{self.title} : {time}'
 
+    @property
+    def author_name(self):
+        return self.author.username if self.author_id else None
+
+    @property
+    def category_name(self):
+        return self.category.name if self.category_id else None
+
+    @property
+    def photo_url(self):
+        return self.photo.url if self.photo else ''
+
+    @property
+    def tag_names(self):
+        if not hasattr(self, '_tag_names'):
+            self._tag_names = [tag.name for tag in self.tag_set.all()]
+        return self._tag_names
+
+    def add_tag(self, name):
+        name = normalize_tag(name)
+        if not name:
+            return False
+        tag, created = Tag.objects.get_or_create(advert=self, name=name)
+        if created:
+            self.__dict__.pop('_tag_names', None)
+        return created
+
+    def set_tags(self, names):
+        names = parse_tags(' '.join(names))
+        with transaction.atomic():
+            current = set(self.tag_set.values_list('name', flat=True))
+            removed = current.difference(names)
+            if removed:
+                for tag in self.tag_set.filter(name__in=removed):
+                    tag.delete()
+            for name in names:
+                if name not in current:
+                    Tag.objects.create(advert=self, name=name)
+        self._tag_names = names
+
+
+class Tag(models.Model):
+    name = models.CharField(
+        verbose_name = u'Тег',
+        max_length=TAG_MAX_LENGTH,
+        db_index=True
+        )
+    advert = models.ForeignKey(
+        'Advert',
+        on_delete=models.CASCADE,
+        verbose_name = u'Объявление',
+        related_name = 'tag_set'
+        )
+
+    class Meta:
+        verbose_name = u'Тег'
+        verbose_name_plural = u'Теги'
+        unique_together = ('advert', 'name')
+        ordering = ('id',)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,182 @@
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from ads_app.cache import redis_cache, make_key, dumps, loads, dump_row, CACHE_TTL
+from ads_app import metrics, stats
+from ads_app.redis_client import fallback
+from redis import WatchError
+import base64
+import hashlib
+import json
+import re
+
+# Кеш страниц для гостей. Страница попадает в кеш, только если
+# представление пометило её тегами (pagecache.tag): id показанных
+# объявлений, 'head' — начало общей ленты, 'search' — выдача поиска и
+# фильтра по тегам, 'categories' — список категорий в форме поиска.
+# Сигналы сбрасывают страницы по тегам сразу после изменения данных.
+#
+# Куски страницы с токеном CSRF (форма входа, форма комментария)
+# не кешируются: в сохранённой странице вместо них остаётся метка, и при
+# отдаче из кеша они рендерятся заново для текущего запроса.
+#
+# Гость, у которого есть ещё не записанные в базу комментарии (cookie
+# PENDING_COOKIE, см. ads_app/ingest.py), получает страницы мимо кеша,
+# чтобы видеть их.
+
+PAGE_CACHE_TTL = getattr(settings, 'PAGE_CACHE_TTL', 60 * 5)
+PENDING_COOKIE = 'pending_comments'
+
+NOCACHE_RE = re.compile(r'<!--nocache:([\w=-]+)-->.*?<!--/nocache-->', re.S)
+
+
+def page_key(request):
+    digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return make_key('pagecache', 'page', digest)
+
+def tag_key(name):
+    return make_key('pagecache', 'tag', name)
+
+def epoch_key():
+    return make_key('pagecache', 'epoch')
+
+def advert_tag(pk):
+    return f'advert:{pk}'
+
+
+def tag(request, *names):
+    if not hasattr(request, 'page_cache_tags'):
+        request.page_cache_tags = set()
+    request.page_cache_tags.update(str(name) for name in names)
+
+def purge(*names):
+    # Эпоха нужна для гонки «страница рендерится — данные меняются»:
+    # страница, начатая до сброса, в кеш уже не запишется.
+    tag_keys = [tag_key(name) for name in names]
+    if not tag_keys:
+        return
+    pipe = redis_cache.pipeline(transaction=False)
+    for key in tag_keys:
+        pipe.smembers(key)
+    keys = set().union(*pipe.execute())
+    pipe = redis_cache.pipeline(transaction=True)
+    pipe.incr(epoch_key())
+    if keys:
+        pipe.delete(*keys)
+    pipe.delete(*tag_keys)
+    pipe.execute()
+
+def purge_adverts(ids, *names):
+    purge(*[advert_tag(pk) for pk in ids], *names)
+
+
+def fragment(template_name, context, html):
+    marker = base64.urlsafe_b64encode(json.dumps({'t': template_name, 'c': context}).encode()).decode()
+    return f'<!--nocache:{marker}-->{html}<!--/nocache-->'
+
+def _strip_fragments(content):
+    return NOCACHE_RE.sub(lambda match: f'<!--nocache:{match.group(1)}--><!--/nocache-->', content)
+
+def _render_fragments(content, request):
+    def render(match):
+        data = json.loads(base64.urlsafe_b64decode(match.group(1)))
+        return fragment(data['t'], data['c'], render_to_string(data['t'], data['c'], request=request))
+    return NOCACHE_RE.sub(render, content)
+
+
+def _is_cacheable(request):
+    # Загруженные файлы не кешируются, и Redis для них не спрашиваем.
+    return (request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+            and not request.path.startswith(settings.MEDIA_URL) and PENDING_COOKIE not in request.COOKIES)
+
+def _miss(key):
+    return None, None
+
+@fallback(_miss)
+def _lookup(key):
+    data, epoch = redis_cache.mget([key, epoch_key()])
+    return loads(data), epoch
+
+def _skip_store(key, epoch, response, names, view=None):
+    return False
+
+@fallback(_skip_store)
+def _store(key, epoch, response, names, view=None):
+    # view — id объявления, просмотр которого считается при каждой отдаче
+    # страницы из кеша.
+    content = response.content.decode(response.charset)
+    if response.get('Content-Type', '').startswith('text/html'):
+        content = _strip_fragments(content)
+    data = dumps({'content': content, 'type': response['Content-Type'], 'view': view})
+    with redis_cache.pipeline(transaction=True) as pipe:
+        try:
+            pipe.watch(epoch_key())
+            if pipe.get(epoch_key()) != epoch:
+                return False
+            pipe.multi()
+            pipe.set(key, data, ex=PAGE_CACHE_TTL)
+            for name in names:
+                pipe.sadd(tag_key(name), key)
+                pipe.expire(tag_key(name), PAGE_CACHE_TTL)
+            pipe.execute()
+        except WatchError:
+            return False
+    return True
+
+class PageCacheMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not _is_cacheable(request):
+            return self.get_response(request)
+        key = page_key(request)
+        data, epoch = _lookup(key)
+        metrics.record_cache('l2', 'pagecache', hits=data is not None, misses=data is None)
+        if data is not None:
+            content = data['content']
+            if data['type'].startswith('text/html'):
+                content = _render_fragments(content, request)
+            response = HttpResponse(content, content_type=data['type'])
+            response['X-Page-Cache'] = 'hit'
+            if data.get('view'):
+                stats.record_view(data['view'])
+            return response
+        response = self.get_response(request)
+        names = getattr(request, 'page_cache_tags', None)
+        if (names and response.status_code == 200 and not response.streaming and not response.cookies
+                and _store(key, epoch, response, names, getattr(request, 'advert_view', None))):
+            response['X-Page-Cache'] = 'miss'
+        return response
+
+
+# Карточки ленты кешируются по отдельности и для всех пользователей:
+# разметка карточки не зависит от того, кто смотрит. Ключ строится из
+# содержимого строки, поэтому изменённое объявление просто получает новый
+# ключ, а старая карточка истекает по TTL.
+
+def card_key(advert):
+    digest = hashlib.md5(dump_row(advert)).hexdigest()
+    return make_key('card', advert.id, digest)
+
+def render_cards_db(adverts):
+    return ''.join(render_to_string('advert_card.html', {'advert': advert}) for advert in adverts)
+
+@fallback(render_cards_db)
+def render_cards(adverts):
+    if not adverts:
+        return ''
+    keys = [card_key(advert) for advert in adverts]
+    cards = redis_cache.mget(keys)
+    missing = {}
+    for index, (advert, card) in enumerate(zip(adverts, cards)):
+        if card is None:
+            cards[index] = missing[keys[index]] = render_to_string('advert_card.html', {'advert': advert})
+        else:
+            cards[index] = card.decode()
+    if missing:
+        pipe = redis_cache.pipeline(transaction=False)
+        for key, card in missing.items():
+            pipe.set(key, card, ex=CACHE_TTL)
+        pipe.execute()
+    return ''.join(cards)
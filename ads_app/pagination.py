@@ -0,0 +1,149 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from ads_app.models import Advert
+from ads_app.cache import redis_cache, make_key, fetch
+from ads_app.redis_client import fallback
+from ads_app import repository
+from datetime import datetime
+import base64
+
+# Постраничный вывод по ключу (created, id): страница — это объявления,
+# которые идут строго после (или до) курсора в порядке убывания. Курсор
+# передаётся клиенту как непрозрачный токен.
+#
+# Каждая страница кешируется отдельно как список id (сами строки берутся
+# из кеша объявлений). Новое объявление попадает только на первую
+# страницу, поэтому при создании сбрасываются первая страница и страницы,
+# построенные назад от курсора; при удалении — все страницы.
+
+PAGE_SIZE = getattr(settings, 'ADVERTS_PAGE_SIZE', 12)
+MAX_PAGE_SIZE = 100
+
+NEXT = 'n'
+PREV = 'p'
+
+
+class Cursor:
+    def __init__(self, direction, created, pk):
+        self.direction = direction
+        self.created = created
+        self.pk = pk
+
+    def encode(self):
+        raw = f'{self.direction}:{int(self.created.timestamp() * 1000000)}:{self.pk}'
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @classmethod
+    def decode(cls, token):
+        try:
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+            direction, micros, pk = raw.split(':')
+            created = datetime.fromtimestamp(int(micros) / 1000000, tz=timezone.utc)
+            if direction not in (NEXT, PREV):
+                raise ValueError(direction)
+            return cls(direction, created, int(pk))
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    def key_part(self):
+        return f'{self.direction}:{int(self.created.timestamp() * 1000000)}:{self.pk}'
+
+
+def page_size(value):
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+
+def page_key(cursor, size):
+    return make_key('page', cursor.key_part() if cursor else 'first', size)
+
+def pages_key(kind):
+    return make_key('pages', kind)
+
+
+def _select(cursor, size):
+    if repository.ENABLED:
+        if cursor is None:
+            return repository.page(size)
+        if cursor.direction == NEXT:
+            return repository.page(size, before=(cursor.created, cursor.pk))
+        return repository.page(size, after=(cursor.created, cursor.pk))
+    adverts = Advert.objects.values_list('id', 'created')
+    if cursor is None:
+        rows = list(adverts.order_by('-created', '-id')[:size])
+    elif cursor.direction == NEXT:
+        rows = list(adverts.filter(
+            Q(created__lt=cursor.created) | Q(created=cursor.created, id__lt=cursor.pk)
+        ).order_by('-created', '-id')[:size])
+    else:
+        rows = list(adverts.filter(
+            Q(created__gt=cursor.created) | Q(created=cursor.created, id__gt=cursor.pk)
+        ).order_by('created', 'id')[:size])
+    return rows
+
+def _query_page(cursor, size):
+    rows = _select(cursor, size + 1)
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if cursor is not None and cursor.direction == PREV:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, cursor is not None
+    return {
+        'ids': [pk for pk, created in rows],
+        'next': Cursor(NEXT, rows[-1][1], rows[-1][0]).encode() if rows and has_next else None,
+        'prev': Cursor(PREV, rows[0][1], rows[0][0]).encode() if rows and has_prev else None,
+    }
+
+def get_page_db(token=None, size=PAGE_SIZE):
+    return _query_page(Cursor.decode(token) if token else None, size)
+
+@fallback(get_page_db)
+def get_page(token=None, size=PAGE_SIZE):
+    cursor = Cursor.decode(token) if token else None
+    if cursor is None:
+        kind = 'first'
+    elif cursor.direction == PREV:
+        kind = 'prev'
+    else:
+        kind = 'next'
+    return fetch(page_key(cursor, size), lambda: _query_page(cursor, size), track=pages_key(kind))
+
+def paginate_ids(ids, token=None, size=PAGE_SIZE):
+    # Для готовых упорядоченных списков (результаты поиска, фильтр по тегам)
+    # курсором служит id крайнего объявления страницы.
+    cursor = Cursor.decode(token) if token else None
+    position = {pk: index for index, pk in enumerate(ids)}
+    if cursor is None or cursor.pk not in position:
+        start = 0
+    elif cursor.direction == NEXT:
+        start = position[cursor.pk] + 1
+    else:
+        start = max(position[cursor.pk] - size, 0)
+    page_ids = ids[start:start + size]
+    epoch = datetime.fromtimestamp(0, tz=timezone.utc)
+    return {
+        'ids': page_ids,
+        'next': Cursor(NEXT, epoch, page_ids[-1]).encode() if start + size < len(ids) else None,
+        'prev': Cursor(PREV, epoch, page_ids[0]).encode() if start > 0 and page_ids else None,
+    }
+
+
+def _drop(kinds):
+    keys = set()
+    for kind in kinds:
+        keys.update(redis_cache.smembers(pages_key(kind)))
+    pipe = redis_cache.pipeline(transaction=True)
+    if keys:
+        pipe.delete(*keys)
+    pipe.delete(*[pages_key(kind) for kind in kinds])
+    pipe.execute()
+
+def invalidate_head():
+    _drop(('first', 'prev'))
+
+def invalidate_all():
+    _drop(('first', 'prev', 'next'))
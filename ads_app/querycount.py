@@ -0,0 +1,46 @@
+from contextlib import contextmanager
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from ads_app.models import Tag
+from urllib.parse import quote
+
+# Бюджет запросов к базе для страниц сайта. Первая цифра — холодный кеш
+# (ключи ещё не собраны), вторая — повторный запрос той же страницы.
+# Бюджет не зависит от числа объявлений и комментариев на странице.
+QUERY_BUDGETS = {
+    'advert-list': (8, 0),
+    'advert-search': (8, 0),
+    'advert-tag': (8, 0),
+    'advert-detail': (7, 0),
+    'advert-stats': (3, 0),
+    'api-advert': (7, 0),
+}
+
+
+def budget_urls(advert):
+    # Адреса страниц из QUERY_BUDGETS для данного объявления.
+    tag = Tag.objects.filter(advert=advert).values_list('name', flat=True).first() or 'tag'
+    word = advert.title.split()[0] if advert.title else ''
+    return {
+        'advert-list': reverse('ads_app:advert-list'),
+        'advert-search': reverse('ads_app:advert-list') + '?btnSearch=&search=' + quote(word),
+        'advert-tag': reverse('ads_app:advert-list') + '?tag=' + quote(tag),
+        'advert-detail': reverse('ads_app:advert-detail', args=[advert.id]),
+        'advert-stats': reverse('ads_app:advert-stats', args=[advert.id]),
+        'api-advert': reverse('ads_app:api-advert', args=[advert.id]),
+    }
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def query_budget(limit, label='запрос'):
+    with CaptureQueriesContext(connection) as context:
+        yield context
+    if len(context) > limit:
+        queries = '\n'.join(f'{index}. {query["sql"]}' for index, query in enumerate(context.captured_queries, 1))
+        raise QueryBudgetExceeded(
+            f'{label}: {len(context)} запросов к базе при бюджете {limit}\n{queries}')
@@ -0,0 +1,102 @@
+from ads_app import repository
+
+# Планы горячих запросов к MongoDB: ни один не должен сканировать
+# коллекцию целиком (COLLSCAN). На настоящем mongod план берётся из
+# explain(). У заглушек вроде mongomock планировщика нет, и тогда запрос
+# сверяется с индексами коллекции по правилу mongod: индекс подходит,
+# если по его первому полю есть условие или если он отдаёт нужную
+# сортировку. В $or так должна обслуживаться каждая ветка.
+
+
+class CollectionScan(AssertionError):
+    pass
+
+
+def hot_queries(advert):
+    # (название, коллекция, фильтр, сортировка) для запросов repository и
+    # тех, что djongo строит из ORM. advert — документ любого объявления.
+    pk, created = advert['id'], advert['created']
+    category, author = advert.get('category_id'), advert.get('author_id')
+    return [
+        ('объявления по id', repository.ADVERTS, {'id': {'$in': [pk]}}, None),
+        ('все id', repository.ADVERTS, {}, [('created', repository.DESC), ('id', repository.DESC)]),
+        ('первая страница', repository.ADVERTS, *repository.page_query()),
+        ('следующая страница', repository.ADVERTS, *repository.page_query(before=(created, pk))),
+        ('предыдущая страница', repository.ADVERTS, *repository.page_query(after=(created, pk))),
+        ('объявления категории', repository.ADVERTS, {'category_id': category},
+         [('created', repository.DESC), ('id', repository.DESC)]),
+        ('объявления автора', repository.ADVERTS, {'author_id': author},
+         [('created', repository.DESC), ('id', repository.DESC)]),
+        ('комментарии', repository.COMMENTS, {'advert_id': pk}, [('id', repository.ASC)]),
+        ('ранние комментарии', repository.COMMENTS, *repository.older_comments_query(pk, pk)),
+        ('число комментариев', repository.COMMENTS, {'advert_id': {'$in': [pk]}}, None),
+        ('комментарий по id', repository.COMMENTS, {'id': pk}, None),
+        ('теги объявлений', repository.TAGS, {'advert_id': {'$in': [pk]}}, None),
+        ('объявления с тегом', repository.TAGS, {'name': {'$in': ['tag']}}, None),
+        ('категория', repository.CATEGORIES, {'id': category}, None),
+        ('автор', repository.USERS, {'id': author}, None),
+    ]
+
+
+def stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage'], plan.get('indexName')
+        for value in plan.values():
+            yield from stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from stages(value)
+
+def explain(collection, query, sort):
+    # Возвращает имена использованных индексов; COLLSCAN — исключение.
+    cursor = collection.find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    if not hasattr(cursor, 'explain'):
+        return match_indexes(collection, query, sort)
+    plan = cursor.explain()['queryPlanner']['winningPlan']
+    found = list(stages(plan))
+    if any(stage == 'COLLSCAN' for stage, index in found):
+        raise CollectionScan(f'{collection.name}: COLLSCAN для {query}')
+    return sorted({index for stage, index in found if index})
+
+
+def serves_sort(keys, sort):
+    if not sort or len(keys) < len(sort):
+        return False
+    fields = [field for field, direction in keys[:len(sort)]]
+    if fields != [field for field, direction in sort]:
+        return False
+    same = [direction for field, direction in keys[:len(sort)]] == [direction for field, direction in sort]
+    reverse = [-direction for field, direction in keys[:len(sort)]] == [direction for field, direction in sort]
+    return same or reverse
+
+def usable(indexes, query, sort):
+    return [name for name, keys in indexes.items()
+            if keys[0][0] in query or serves_sort(keys, sort)]
+
+def match_indexes(collection, query, sort):
+    indexes = {name: repository.index_keys(info) for name, info in collection.index_information().items()}
+    branches = query.get('$or', [{}])
+    common = {field: value for field, value in query.items() if field != '$or'}
+    found = set()
+    for branch in branches:
+        names = usable(indexes, dict(common, **branch), sort)
+        if not names:
+            raise CollectionScan(f'{collection.name}: нет индекса для {dict(common, **branch)}, сортировка {sort}')
+        found.update(names)
+    return sorted(found)
+
+
+def check(db):
+    advert = db[repository.ADVERTS].find_one({}, {'id': 1, 'created': 1, 'category_id': 1, 'author_id': 1})
+    if advert is None:
+        raise LookupError('В базе нет объявлений для проверки')
+    results = []
+    for name, collection, query, sort in hot_queries(advert):
+        try:
+            results.append((name, explain(db[collection], query, sort), None))
+        except CollectionScan as error:
+            results.append((name, [], str(error)))
+    return results
@@ -0,0 +1,55 @@
+from ads_app.redis_client import redis_cache, fallback
+import time
+
+# Ограничение частоты запросов корзинами токенов в Redis. Корзина вмещает
+# capacity токенов и наполняется заново за period секунд; каждый запрос
+# забирает токен. Корзина — хеш ads:ratelimit:<имя> с остатком и временем
+# последнего обращения, ключ живёт, пока корзина не наполнится.
+#
+# Несколько корзин (например, адрес посетителя и объявление) проверяются
+# одним скриптом: токены списываются, только если хватает во всех. Если
+# Redis недоступен, запросы пропускаются без ограничения.
+
+KEY_PREFIX = 'ads:ratelimit:'
+
+HIT_SCRIPT = redis_cache.register_script("""
+local now, cost = tonumber(ARGV[1]), tonumber(ARGV[2])
+local wait = 0
+local buckets = {}
+for i, key in ipairs(KEYS) do
+    local capacity, rate = tonumber(ARGV[i * 2 + 1]), tonumber(ARGV[i * 2 + 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local elapsed = math.max(0, now - (tonumber(state[2]) or now))
+    tokens = math.min(capacity, tokens + elapsed * rate)
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+    buckets[i] = {tokens, capacity / rate}
+end
+if wait == 0 then
+    for i, key in ipairs(KEYS) do
+        redis.call('HSET', key, 'tokens', buckets[i][1] - cost, 'ts', now)
+        redis.call('EXPIRE', key, math.ceil(buckets[i][2]) + 1)
+    end
+end
+return tostring(wait)
+""")
+
+
+def bucket_key(name):
+    return KEY_PREFIX + name
+
+def _allow(buckets, cost=1):
+    return 0
+
+@fallback(_allow)
+def hit(buckets, cost=1):
+    # buckets — список (имя, capacity, period). Возвращает 0, если запрос
+    # пропущен, иначе через сколько секунд его можно повторить.
+    if not buckets:
+        return 0
+    args = [time.time(), cost]
+    for name, capacity, period in buckets:
+        args.extend((capacity, capacity / period))
+    return float(HIT_SCRIPT(keys=[bucket_key(name) for name, capacity, period in buckets], args=args))
@@ -0,0 +1,116 @@
+from django.conf import settings
+from functools import wraps
+import logging
+import redis
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Один пул соединений на процесс: redis-py сам пересоздаёт его после
+# fork, поэтому воркеры не делят сокеты. Пул ограничен, а клиент ждёт
+# свободное соединение не дольше REDIS_POOL_TIMEOUT.
+
+pool = redis.BlockingConnectionPool(
+    host=getattr(settings, 'REDIS_HOST', '127.0.0.1'),
+    port=getattr(settings, 'REDIS_PORT', 6379),
+    db=getattr(settings, 'REDIS_DB', 0),
+    password=getattr(settings, 'REDIS_PASSWORD', None),
+    max_connections=getattr(settings, 'REDIS_MAX_CONNECTIONS', 50),
+    timeout=getattr(settings, 'REDIS_POOL_TIMEOUT', 1),
+    socket_timeout=getattr(settings, 'REDIS_SOCKET_TIMEOUT', 0.5),
+    socket_connect_timeout=getattr(settings, 'REDIS_CONNECT_TIMEOUT', 0.5),
+)
+redis_cache = redis.Redis(connection_pool=pool)
+
+
+class CircuitBreaker:
+    # После threshold ошибок подряд Redis не трогаем cooldown секунд:
+    # чтение идёт из базы, запись в кеш пропускается. По истечении паузы
+    # следующий вызов пробует Redis снова; одна ошибка снова размыкает цепь.
+    #
+    # Пропущенная запись значит, что в Redis могли остаться устаревшие
+    # ключи, поэтому при восстановлении вызывается on_recover (сброс
+    # пространства ключей приложения).
+
+    def __init__(self, threshold=3, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.dirty = False
+        self.on_recover = None
+        self.lock = threading.Lock()
+
+    def is_open(self):
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.cooldown
+
+    def success(self):
+        # Возвращает True, если ключи были сброшены: прочитанное до сброса
+        # значение может быть устаревшим.
+        if not self.failures and not self.dirty:
+            return False
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            dirty, self.dirty = self.dirty, False
+        if dirty and self.on_recover is not None:
+            logger.warning('Redis снова доступен, сбрасываем ключи кеша')
+            guarded(self.on_recover)()
+            return True
+        return False
+
+    def failure(self, error, lost_write=False):
+        with self.lock:
+            self.failures += 1
+            self.dirty = self.dirty or lost_write
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    logger.warning('Redis недоступен (%s), кеш отключён на %s с', error, self.cooldown)
+                self.opened_at = time.monotonic()
+
+    def skip_write(self):
+        with self.lock:
+            self.dirty = True
+
+
+breaker = CircuitBreaker(
+    threshold=getattr(settings, 'REDIS_FAILURE_THRESHOLD', 3),
+    cooldown=getattr(settings, 'REDIS_COOLDOWN', 30),
+)
+
+
+def fallback(db_func):
+    # Чтение через кеш с запасным путём через базу. db_func принимает те
+    # же аргументы, что и декорируемая функция.
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if breaker.is_open():
+                return db_func(*args, **kwargs)
+            try:
+                result = func(*args, **kwargs)
+            except redis.RedisError as error:
+                breaker.failure(error)
+                return db_func(*args, **kwargs)
+            if breaker.success():
+                return wrapper(*args, **kwargs)
+            return result
+        return wrapper
+    return decorator
+
+def guarded(func):
+    # Запись в кеш: при недоступном Redis пропускается, а не роняет запрос.
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if breaker.is_open():
+            breaker.skip_write()
+            return None
+        try:
+            result = func(*args, **kwargs)
+        except redis.RedisError as error:
+            breaker.failure(error, lost_write=True)
+            return None
+        breaker.success()
+        return result
+    return wrapper
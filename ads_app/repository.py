@@ -0,0 +1,346 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from ads_app.models import Comment, Category, Advert, Tag
+from ads_app import thumbnails
+import os
+import pymongo
+import threading
+
+# Чтение горячих путей напрямую через pymongo. djongo переводит каждый
+# запрос ORM в SQL и обратно в операции MongoDB, что дорого по CPU и даёт
+# неудачную форму запросов. Здесь читаются те же коллекции, что у
+# моделей, поэтому админка, формы и вся запись остаются на ORM.
+#
+# Функции возвращают словари с теми же полями, что cache.advert_to_row()
+# и cache.comment_to_row().
+
+ENABLED = getattr(settings, 'MONGO_REPOSITORY', False)
+
+# Встроенные комментарии: документ объявления хранит копии последних
+# EMBEDDED_COMMENTS комментариев (recent_comments) и их общее число
+# (comment_count), поэтому страница объявления читается одним запросом.
+# Сами комментарии остаются в своей коллекции, более ранние читаются
+# оттуда постранично. 0 — режим выключен.
+EMBEDDED_COMMENTS = getattr(settings, 'MONGO_EMBEDDED_COMMENTS', 0) if ENABLED else 0
+
+ADVERTS = Advert._meta.db_table
+COMMENTS = Comment._meta.db_table
+CATEGORIES = Category._meta.db_table
+TAGS = Tag._meta.db_table
+USERS = get_user_model()._meta.db_table
+
+# Индексы, которые нужны приложению, — и запросам этого модуля, и тем,
+# что строит djongo из ORM. Создаёт их команда sync_indexes. Префикс имени
+# отличает их от индексов, которые djongo заводит сам по миграциям: при
+# чистке удаляются только свои устаревшие индексы.
+INDEX_PREFIX = 'ads_'
+ASC = pymongo.ASCENDING
+DESC = pymongo.DESCENDING
+INDEXES = {
+    ADVERTS: {
+        'ads_id': [('id', ASC)],
+        'ads_created': [('created', DESC), ('id', DESC)],
+        'ads_category_created': [('category_id', ASC), ('created', DESC), ('id', DESC)],
+        'ads_author_created': [('author_id', ASC), ('created', DESC), ('id', DESC)],
+    },
+    COMMENTS: {
+        'ads_id': [('id', ASC)],
+        'ads_advert': [('advert_id', ASC), ('id', ASC)],
+    },
+    TAGS: {
+        'ads_advert': [('advert_id', ASC), ('id', ASC)],
+        'ads_name': [('name', ASC), ('advert_id', ASC)],
+    },
+    CATEGORIES: {
+        'ads_id': [('id', ASC)],
+    },
+    USERS: {
+        'ads_id': [('id', ASC)],
+    },
+}
+
+ADVERT_FIELDS = ('id', 'title', 'content', 'created', 'updated', 'photo', 'category_id', 'author_id')
+COMMENT_FIELDS = ('id', 'author', 'content', 'created', 'updated', 'advert_id')
+
+
+def projection(fields):
+    return dict({field: 1 for field in fields}, _id=0)
+
+
+# Клиент pymongo нельзя переносить через fork, поэтому он создаётся
+# лениво, по одному на процесс.
+
+_database = None
+_pid = None
+_connect_lock = threading.Lock()
+
+def connect():
+    config = settings.DATABASES['default']
+    options = {
+        'host': config.get('HOST') or 'localhost',
+        'port': int(config.get('PORT') or 27017),
+        'tz_aware': settings.USE_TZ,
+        'maxPoolSize': getattr(settings, 'MONGO_MAX_POOL_SIZE', 100),
+        'serverSelectionTimeoutMS': getattr(settings, 'MONGO_TIMEOUT', 5) * 1000,
+    }
+    if config.get('USER'):
+        options.update(
+            username=config['USER'],
+            password=config.get('PASSWORD'),
+            authSource=config.get('AUTH_SOURCE', 'admin'),
+            authMechanism=config.get('AUTH_MECHANISM', 'SCRAM-SHA-1'),
+        )
+    return pymongo.MongoClient(**options)[config['NAME']]
+
+def database():
+    global _database, _pid
+    if _database is None or _pid != os.getpid():
+        with _connect_lock:
+            if _database is None or _pid != os.getpid():
+                _database, _pid = connect(), os.getpid()
+    return _database
+
+
+def index_keys(info):
+    return [(field, direction if isinstance(direction, str) else int(direction)) for field, direction in info['key']]
+
+def sync_indexes(prune=False, dry_run=False):
+    # Создаёт недостающие индексы из INDEXES. Индекс с теми же полями под
+    # другим именем (например, заведённый djongo) считается уже созданным.
+    # С prune удаляет свои индексы, которых больше нет в списке. Возвращает
+    # список действий (коллекция, индекс, действие).
+    db = database()
+    actions = []
+    for collection, indexes in INDEXES.items():
+        existing = {name: index_keys(info) for name, info in db[collection].index_information().items()}
+        for name, keys in indexes.items():
+            same = [other for other, other_keys in existing.items() if other_keys == keys]
+            if same:
+                actions.append((collection, same[0], 'есть'))
+                continue
+            if name in existing:
+                actions.append((collection, name, 'пересоздан'))
+                if not dry_run:
+                    db[collection].drop_index(name)
+            else:
+                actions.append((collection, name, 'создан'))
+            if not dry_run:
+                db[collection].create_index(keys, name=name, background=True)
+        if prune:
+            for name in existing:
+                if name.startswith(INDEX_PREFIX) and name not in indexes:
+                    actions.append((collection, name, 'удалён'))
+                    if not dry_run:
+                        db[collection].drop_index(name)
+    return actions
+
+
+# djongo выдаёт id сам: счётчик коллекции лежит в __schema__ и
+# увеличивается на каждую вставку через ORM. Массовая вставка в обход ORM
+# забирает из него сразу диапазон.
+
+SCHEMA = '__schema__'
+
+def reserve_ids(collection, count, at_least=0):
+    # Возвращает count новых id; at_least — уже занятый явно id, счётчик
+    # не должен его повторить.
+    schema = database()[SCHEMA]
+    if at_least:
+        schema.update_one({'name': collection}, {'$max': {'auto.seq': int(at_least)}})
+    document = schema.find_one_and_update(
+        {'name': collection}, {'$inc': {'auto.seq': count}},
+        projection=projection(('auto.seq',)), return_document=pymongo.ReturnDocument.AFTER)
+    if document is None:
+        raise LookupError(f'Нет счётчика id для {collection} в {SCHEMA}')
+    last = document['auto']['seq']
+    return range(last - count + 1, last + 1)
+
+
+def photo_url(name):
+    return default_storage.url(name) if name else ''
+
+def adverts(ids, counts=False, comments=False):
+    # Одна агрегация вместо select_related + prefetch_related: категория,
+    # автор и теги подтягиваются через $lookup по индексированным полям.
+    # Со встроенными комментариями число комментариев (и, если нужно, сами
+    # последние комментарии) приходит в том же документе.
+    ids = [int(pk) for pk in ids]
+    if not ids:
+        return []
+    fields = ADVERT_FIELDS
+    if EMBEDDED_COMMENTS and (counts or comments):
+        fields += ('comment_count', 'recent_comments') if comments else ('comment_count',)
+    pipeline = [
+        {'$match': {'id': {'$in': ids}}},
+        {'$project': projection(fields)},
+        {'$lookup': {'from': CATEGORIES, 'localField': 'category_id', 'foreignField': 'id', 'as': 'category'}},
+        {'$lookup': {'from': USERS, 'localField': 'author_id', 'foreignField': 'id', 'as': 'author'}},
+        {'$lookup': {'from': TAGS, 'localField': 'id', 'foreignField': 'advert_id', 'as': 'tags'}},
+        {'$project': dict(projection(fields), **{
+            'category.name': 1, 'author.username': 1, 'tags.id': 1, 'tags.name': 1})},
+    ]
+    rows = []
+    for document in database()[ADVERTS].aggregate(pipeline):
+        category = document.pop('category')
+        author = document.pop('author')
+        tags = sorted(document.pop('tags'), key=lambda tag: tag['id'])
+        photo = document.get('photo') or ''
+        rows.append(dict(
+            document,
+            tags=[tag['name'] for tag in tags],
+            category_id=document.get('category_id'),
+            category_name=category[0]['name'] if category else None,
+            author_id=document.get('author_id'),
+            author_name=author[0]['username'] if author else None,
+            photo=photo,
+            photo_url=photo_url(photo),
+            thumbs=thumbnails.srcsets(photo),
+        ))
+    if comments:
+        for row in rows:
+            if 'comment_count' not in row:
+                row['recent_comments'], row['comment_count'] = embed_comments(row['id'])
+    if counts:
+        found = comment_counts([row['id'] for row in rows if 'comment_count' not in row])
+        for row in rows:
+            row.setdefault('comment_count', found.get(row['id'], 0))
+    return rows
+
+def advert_ids():
+    # Покрывающий запрос: и фильтр, и сортировка, и ответ берутся из
+    # индекса (created, id).
+    cursor = database()[ADVERTS].find({}, projection(('id',))).sort(
+        [('created', DESC), ('id', DESC)])
+    return [document['id'] for document in cursor]
+
+def page_query(before=None, after=None):
+    # Страница ленты по ключу (created, id): before — объявления старше
+    # курсора в порядке убывания, after — новее курсора в порядке
+    # возрастания. Возвращает фильтр и сортировку.
+    if before is not None:
+        created, pk = before
+        query = {'$or': [{'created': {'$lt': created}}, {'created': created, 'id': {'$lt': pk}}]}
+    elif after is not None:
+        created, pk = after
+        query = {'$or': [{'created': {'$gt': created}}, {'created': created, 'id': {'$gt': pk}}]}
+    else:
+        query = {}
+    order = ASC if after is not None else DESC
+    return query, [('created', order), ('id', order)]
+
+def page(size, before=None, after=None):
+    # Возвращает пары (id, created).
+    query, sort = page_query(before, after)
+    cursor = database()[ADVERTS].find(query, projection(('id', 'created'))).sort(sort).limit(size)
+    return [(document['id'], document['created']) for document in cursor]
+
+def comments(advert_pk):
+    cursor = database()[COMMENTS].find({'advert_id': int(advert_pk)}, projection(COMMENT_FIELDS)).sort(
+        'id', ASC)
+    return list(cursor)
+
+def comments_many(ids):
+    cursor = database()[COMMENTS].find(
+        {'advert_id': {'$in': [int(pk) for pk in ids]}}, projection(COMMENT_FIELDS)).sort(
+        [('advert_id', ASC), ('id', ASC)])
+    return list(cursor)
+
+def recent_comments(advert_pk):
+    document = database()[ADVERTS].find_one(
+        {'id': int(advert_pk)}, projection(('recent_comments', 'comment_count')))
+    if document is None:
+        return []
+    if 'comment_count' not in document:
+        return embed_comments(advert_pk)[0]
+    return document['recent_comments']
+
+def older_comments_query(advert_pk, before):
+    return {'advert_id': int(advert_pk), 'id': {'$lt': int(before)}}, [('id', DESC)]
+
+def older_comments(advert_pk, before, limit):
+    query, sort = older_comments_query(advert_pk, before)
+    cursor = database()[COMMENTS].find(query, projection(COMMENT_FIELDS)).sort(sort).limit(limit)
+    return list(reversed(list(cursor)))
+
+
+# Изменение встроенных комментариев. Каждая операция — одно атомарное
+# обновление документа объявления. Документы, где копий ещё нет (созданы
+# до включения режима), не трогаются частично, а собираются целиком.
+
+def comment_document(values):
+    return {field: values[field] for field in COMMENT_FIELDS}
+
+def embed_comments(advert_pk):
+    advert_pk = int(advert_pk)
+    recent = list(database()[COMMENTS].find({'advert_id': advert_pk}, projection(COMMENT_FIELDS)).sort(
+        'id', DESC).limit(EMBEDDED_COMMENTS))
+    recent.reverse()
+    count = database()[COMMENTS].count_documents({'advert_id': advert_pk})
+    database()[ADVERTS].update_one(
+        {'id': advert_pk}, {'$set': {'recent_comments': recent, 'comment_count': count}})
+    return recent, count
+
+def push_comment(values):
+    push_comments(values['advert_id'], [values])
+
+def push_comments(advert_pk, rows):
+    result = database()[ADVERTS].update_one(
+        {'id': advert_pk, 'comment_count': {'$exists': True}},
+        {'$push': {'recent_comments': {'$each': [comment_document(values) for values in rows],
+                                       '$slice': -EMBEDDED_COMMENTS}},
+         '$inc': {'comment_count': len(rows)}})
+    if not result.matched_count:
+        embed_comments(advert_pk)
+
+def comment_tokens(advert_pk, tokens):
+    found = database()[COMMENTS].find({'advert_id': int(advert_pk), 'token': {'$in': list(tokens)}},
+                                      projection(('token',)))
+    return {document['token'] for document in found}
+
+def insert_comments(advert_pk, rows, tokens):
+    # Пачка новых комментариев одного объявления: id берутся из счётчика
+    # djongo одним запросом, запись — одним insert_many. rows дополняются id.
+    for values, pk in zip(rows, reserve_ids(COMMENTS, len(rows))):
+        values['id'] = pk
+    database()[COMMENTS].insert_many([dict(comment_document(values), token=token)
+                                      for values, token in zip(rows, tokens)], ordered=False)
+    if EMBEDDED_COMMENTS:
+        push_comments(advert_pk, rows)
+
+def update_comment(values):
+    # Копия есть, только если комментарий среди последних.
+    database()[ADVERTS].update_one(
+        {'id': values['advert_id'], 'recent_comments.id': values['id']},
+        {'$set': {'recent_comments.$': comment_document(values)}})
+
+def pull_comment(advert_pk, pk):
+    document = database()[ADVERTS].find_one_and_update(
+        {'id': int(advert_pk), 'comment_count': {'$exists': True}},
+        {'$pull': {'recent_comments': {'id': int(pk)}}, '$inc': {'comment_count': -1}},
+        projection=projection(('recent_comments', 'comment_count')),
+        return_document=pymongo.ReturnDocument.AFTER)
+    # Ушёл один из последних: на его место нужен более ранний комментарий.
+    if document and len(document['recent_comments']) < min(document['comment_count'], EMBEDDED_COMMENTS):
+        embed_comments(advert_pk)
+
+def _count(collection, ids):
+    pipeline = [
+        {'$match': {'advert_id': {'$in': ids}}},
+        {'$group': {'_id': '$advert_id', 'count': {'$sum': 1}}},
+    ]
+    return {row['_id']: row['count'] for row in database()[collection].aggregate(pipeline)}
+
+def comment_counts(ids):
+    return _count(COMMENTS, [int(pk) for pk in ids]) if ids else {}
+
+def counts(ids=None):
+    # То же, что stats.collect(): число тегов и комментариев для
+    # существующих объявлений.
+    query = {} if ids is None else {'id': {'$in': [int(pk) for pk in ids]}}
+    ids = [document['id'] for document in database()[ADVERTS].find(query, projection(('id',)))]
+    if not ids:
+        return {}
+    tags = _count(TAGS, ids)
+    comment_totals = _count(COMMENTS, ids)
+    return {pk: {'tags': tags.get(pk, 0), 'comments': comment_totals.get(pk, 0)} for pk in ids}
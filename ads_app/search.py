@@ -0,0 +1,294 @@
+from django.db.models import Q
+from ads_app.models import Advert
+from ads_app.cache import redis_cache, make_key, dumps, loads, filter_advert_ids, get_advert_ids, lock
+from ads_app.redis_client import fallback
+from collections import Counter
+import hashlib
+import re
+
+# Инвертированный индекс объявлений в Redis:
+#   search:term:<основа>   ZSET  id объявления -> вес основы в объявлении
+#   search:terms           ZSET  все основы (score 0) для поиска по префиксу
+#   search:category:<id>   SET   объявления категории
+#   search:doc:<id>        JSON  основы и категория, нужные для переиндексации
+#   search:results         SET   ключи закешированных ответов
+# Запрос — пересечение множеств своих основ (AND), ответ ранжирован по
+# сумме весов и кешируется до первого изменения индекса, но не дольше
+# RESULT_TTL секунд.
+# Запрос без слов, только с категорией, — пересечение её множества с
+# индексом ленты, в порядке ленты.
+
+TITLE_WEIGHT = 3
+TAGS_WEIGHT = 2
+CONTENT_WEIGHT = 1
+RESULT_TTL = 60
+PREFIX_LIMIT = 50
+REBUILD_LOCK_TTL = 300
+
+WORD_RE = re.compile(r'\w+\*?')
+
+VOWELS = 'аеиоуыэюя'
+PERFECTIVE_GERUND = (('вшись', 'вши', 'в'), ('ывшись', 'ившись', 'ывши', 'ивши', 'ыв', 'ив'))
+ADJECTIVE = ('ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий',
+             'ый', 'ой', 'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+REFLEXIVE = ('ся', 'сь')
+VERB = (('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны',
+         'ть', 'й', 'л', 'н'),
+        ('ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует',
+         'уют', 'ены', 'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят',
+         'ит', 'ыт', 'ую', 'ю'))
+NOUN = ('иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии',
+        'ей', 'ой', 'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е',
+        'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я')
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+
+def _strip(word, endings):
+    for ending in sorted(endings, key=len, reverse=True):
+        if word.endswith(ending):
+            return word[:-len(ending)], True
+    return word, False
+
+def _strip_after_a(word, groups):
+    # Окончания первой группы отрезаются, только если перед ними «а» или «я».
+    first, second = groups
+    for ending in sorted(first + second, key=len, reverse=True):
+        if word.endswith(ending):
+            if ending in second or word[:-len(ending)][-1:] in ('а', 'я'):
+                return word[:-len(ending)], True
+    return word, False
+
+def _regions(word):
+    rv = next((i + 1 for i, char in enumerate(word) if char in VOWELS), len(word))
+    r1 = next((i + 1 for i in range(1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS), len(word))
+    r2 = next((i + 1 for i in range(r1 + 1, len(word)) if word[i] not in VOWELS and word[i - 1] in VOWELS), len(word))
+    return rv, max(r2 - rv, 0)
+
+def stem(word):
+    # Облегчённый вариант алгоритма Snowball для русского языка. Слова на
+    # латинице и числа остаются как есть.
+    if not re.search('[а-я]', word):
+        return word
+    rv, r2 = _regions(word)
+    head, tail = word[:rv], word[rv:]
+    tail, found = _strip_after_a(tail, PERFECTIVE_GERUND)
+    if not found:
+        tail, _ = _strip(tail, REFLEXIVE)
+        tail, found = _strip(tail, ADJECTIVE)
+        if found:
+            tail, _ = _strip_after_a(tail, PARTICIPLE)
+        else:
+            tail, found = _strip_after_a(tail, VERB)
+            if not found:
+                tail, _ = _strip(tail, NOUN)
+    if tail.endswith('и'):
+        tail = tail[:-1]
+    if len(tail) > r2 and tail[r2:].endswith(DERIVATIONAL):
+        tail, _ = _strip(tail, DERIVATIONAL)
+    tail, found = _strip(tail, SUPERLATIVE)
+    if tail.endswith('нн'):
+        tail = tail[:-1]
+    elif not found and tail.endswith('ь'):
+        tail = tail[:-1]
+    return head + tail
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+def tokenize(text):
+    return [stem(word) for word in WORD_RE.findall(normalize(text).replace('*', ' '))]
+
+
+def term_key(term):
+    return make_key('search', 'term', term)
+
+def terms_key():
+    return make_key('search', 'terms')
+
+def category_key(pk):
+    return make_key('search', 'category', pk)
+
+def doc_key(pk):
+    return make_key('search', 'doc', pk)
+
+def built_key():
+    return make_key('search', 'built')
+
+def results_key():
+    return make_key('search', 'results')
+
+
+def advert_terms(advert):
+    weights = Counter()
+    for text, weight in ((advert.title, TITLE_WEIGHT),
+                         (' '.join(advert.tag_names), TAGS_WEIGHT),
+                         (advert.content, CONTENT_WEIGHT)):
+        for term in tokenize(text):
+            weights[term] += weight
+    return weights
+
+def _drop_results(pipe):
+    results = redis_cache.smembers(results_key())
+    if results:
+        pipe.delete(*results)
+    pipe.delete(results_key())
+
+def _unindex(pipe, pk, doc):
+    for term in doc['terms']:
+        pipe.zrem(term_key(term), pk)
+    if doc['category'] is not None:
+        pipe.srem(category_key(doc['category']), pk)
+    pipe.delete(doc_key(pk))
+
+def _prune_terms(terms):
+    # Основы, которые больше не встречаются ни в одном объявлении, убираем
+    # из словаря, чтобы префиксные запросы не разрастались.
+    terms = list(terms)
+    if not terms:
+        return
+    pipe = redis_cache.pipeline(transaction=False)
+    for term in terms:
+        pipe.zcard(term_key(term))
+    empty = [term for term, size in zip(terms, pipe.execute()) if not size]
+    if empty:
+        redis_cache.zrem(terms_key(), *empty)
+
+def index_adverts(adverts):
+    adverts = list(adverts)
+    if not adverts:
+        return
+    old_docs = redis_cache.mget([doc_key(advert.id) for advert in adverts])
+    stale_terms = set()
+    pipe = redis_cache.pipeline(transaction=True)
+    for advert, old_doc in zip(adverts, old_docs):
+        weights = advert_terms(advert)
+        old_doc = loads(old_doc)
+        if old_doc is not None:
+            stale_terms.update(set(old_doc['terms']) - set(weights))
+            _unindex(pipe, advert.id, old_doc)
+        for term, weight in weights.items():
+            pipe.zadd(term_key(term), {advert.id: weight})
+        if weights:
+            pipe.zadd(terms_key(), {term: 0 for term in weights})
+        if advert.category_id is not None:
+            pipe.sadd(category_key(advert.category_id), advert.id)
+        pipe.set(doc_key(advert.id), dumps({'terms': list(weights), 'category': advert.category_id}))
+    _drop_results(pipe)
+    pipe.execute()
+    _prune_terms(stale_terms)
+
+def index_advert(advert):
+    index_adverts([advert])
+
+def remove_advert(pk):
+    old_doc = loads(redis_cache.get(doc_key(pk)))
+    if old_doc is None:
+        return
+    pipe = redis_cache.pipeline(transaction=True)
+    _unindex(pipe, pk, old_doc)
+    _drop_results(pipe)
+    pipe.execute()
+    _prune_terms(old_doc['terms'])
+
+def rebuild_index(batch_size=500):
+    pipe = redis_cache.pipeline(transaction=False)
+    for key in redis_cache.scan_iter(match=make_key('search', '*')):
+        pipe.delete(key)
+    pipe.execute()
+    count = 0
+    adverts = Advert.objects.only('id', 'title', 'content', 'category_id').order_by('id')
+    last_id = 0
+    while True:
+        batch = list(adverts.filter(id__gt=last_id).prefetch_related('tag_set')[:batch_size])
+        if not batch:
+            break
+        index_adverts(batch)
+        count += len(batch)
+        last_id = batch[-1].id
+    redis_cache.set(built_key(), 1)
+    return count
+
+def ensure_index():
+    # Индекс собирает один процесс; остальные, пока он не готов, ищут по
+    # базе (search_db), а не запускают ещё одну полную сборку.
+    if redis_cache.exists(built_key()):
+        return True
+    with lock(built_key(), ttl=REBUILD_LOCK_TTL) as acquired:
+        if acquired and not redis_cache.exists(built_key()):
+            rebuild_index()
+        return acquired
+
+
+def _expand_prefix(prefix):
+    prefix = prefix.encode()
+    return [term.decode() for term in redis_cache.zrangebylex(
+        terms_key(), b'[' + prefix, b'[' + prefix + b'\xff', start=0, num=PREFIX_LIMIT)]
+
+def parse_query(query):
+    # Каждое слово запроса обязательно (AND). Слово со звёздочкой на конце
+    # ищется как префикс среди основ: «авто*» найдёт «автомобиль».
+    groups = []
+    for word in WORD_RE.findall(normalize(query)):
+        if word.endswith('*'):
+            groups.append(('prefix', stem(word[:-1])))
+        else:
+            groups.append(('term', stem(word)))
+    return groups
+
+def parse_category(category):
+    return int(category) if category and str(category) != '0' else None
+
+def search_db(query, category=None):
+    # Пока Redis недоступен: каждая основа ищется подстрокой в заголовке,
+    # тексте и тегах. Медленнее и без ранжирования, но результат тот же.
+    adverts = Advert.objects.all()
+    category = parse_category(category)
+    if category is not None:
+        adverts = adverts.filter(category_id=category)
+    for kind, value in parse_query(query):
+        condition = Q()
+        for variant in {value, value.capitalize(), value.upper()}:
+            condition |= (Q(title__icontains=variant) | Q(content__icontains=variant)
+                          | Q(tag_set__name__icontains=variant))
+        adverts = adverts.filter(condition)
+    return list(adverts.distinct().order_by('-created', '-id').values_list('id', flat=True))
+
+@fallback(search_db)
+def search(query, category=None):
+    if not ensure_index():
+        return search_db(query, category)
+    groups = parse_query(query)
+    category = parse_category(category)
+    if not groups:
+        if category is None:
+            return get_advert_ids()
+        return filter_advert_ids([category_key(category)])
+    digest = hashlib.sha1(f'{groups}:{category}'.encode()).hexdigest()
+    result_key = make_key('search', 'result', digest)
+    if not redis_cache.exists(result_key):
+        keys = []
+        temp_keys = []
+        for kind, value in groups:
+            if kind == 'term':
+                keys.append(term_key(value))
+                continue
+            terms = _expand_prefix(value)
+            if not terms:
+                return []
+            union_key = make_key('search', 'prefix', digest, len(temp_keys))
+            redis_cache.zunionstore(union_key, [term_key(term) for term in terms], aggregate='MAX')
+            keys.append(union_key)
+            temp_keys.append(union_key)
+        weights = {key: 1 for key in keys}
+        if category is not None:
+            weights[category_key(category)] = 0
+        pipe = redis_cache.pipeline(transaction=True)
+        pipe.zinterstore(result_key, weights)
+        pipe.expire(result_key, RESULT_TTL)
+        pipe.sadd(results_key(), result_key)
+        if temp_keys:
+            pipe.delete(*temp_keys)
+        pipe.execute()
+    return [int(pk) for pk in redis_cache.zrevrange(result_key, 0, -1)]
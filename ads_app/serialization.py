@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+import json
+import struct
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Значения в Redis — только простые данные (словари, списки, строки,
+# числа), без объектов моделей. Перед телом идёт заголовок из трёх байт:
+# кодек, версия схемы и флаги сжатия. Значение с чужой версией схемы или
+# неизвестным кодеком читается как промах кеша, а не разбирается новым
+# кодом; поэтому кодек можно поменять без сброса Redis.
+
+HEADER = struct.Struct('>cBB')
+
+ZLIB = 1
+LZ4 = 2
+
+
+class JsonCodec:
+    tag = b'j'
+
+    def encode(self, value):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode()
+
+    def decode(self, body):
+        return json.loads(body)
+
+class MsgpackCodec:
+    tag = b'm'
+
+    def encode(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, body):
+        return msgpack.unpackb(body, raw=False)
+
+
+CODECS = {'json': JsonCodec}
+if msgpack is not None:
+    CODECS['msgpack'] = MsgpackCodec
+
+COMPRESSORS = {'zlib': (ZLIB, lambda body: zlib.compress(body, 6))}
+DECOMPRESSORS = {ZLIB: zlib.decompress}
+if lz4 is not None:
+    COMPRESSORS['lz4'] = (LZ4, lz4.frame.compress)
+    DECOMPRESSORS[LZ4] = lz4.frame.decompress
+
+
+class Serializer:
+    def __init__(self, codec='json', version=1, compression='zlib', threshold=1024):
+        if codec not in CODECS:
+            raise ImproperlyConfigured(f'Кодек кеша {codec} недоступен')
+        if compression is not None and compression not in COMPRESSORS:
+            raise ImproperlyConfigured(f'Сжатие {compression} недоступно')
+        self.codec = CODECS[codec]()
+        self.version = version % 256
+        self.compression = COMPRESSORS[compression] if compression else None
+        self.threshold = threshold
+        self.decoders = {cls.tag: cls() for cls in CODECS.values()}
+
+    def dumps(self, value):
+        body = self.codec.encode(value)
+        flags = 0
+        if self.compression is not None and len(body) > self.threshold:
+            flag, compress = self.compression
+            compressed = compress(body)
+            if len(compressed) < len(body):
+                body, flags = compressed, flag
+        return HEADER.pack(self.codec.tag, self.version, flags) + body
+
+    def loads(self, data):
+        if data is None or len(data) < HEADER.size:
+            return None
+        tag, version, flags = HEADER.unpack_from(data)
+        decoder = self.decoders.get(tag)
+        if decoder is None or version != self.version or flags not in (0, *DECOMPRESSORS):
+            return None
+        body = data[HEADER.size:]
+        if flags:
+            body = DECOMPRESSORS[flags](body)
+        return decoder.decode(body)
+
+
+def get_serializer(version):
+    return Serializer(
+        codec=getattr(settings, 'CACHE_SERIALIZER', 'msgpack' if msgpack is not None else 'json'),
+        version=version,
+        compression=getattr(settings, 'CACHE_COMPRESSION', 'zlib'),
+        threshold=getattr(settings, 'CACHE_COMPRESS_THRESHOLD', 1024),
+    )
@@ -0,0 +1,169 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from ads_app.models import Comment, Category, Advert, Tag
+from ads_app import cache, pagecache, pagination, repository, search, stats, tags, tasks
+from ads_app.redis_client import guarded
+from pymongo.errors import PyMongoError
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Кеш обновляется только отсюда: представления сохраняют модели, а сигналы
+# после фиксации транзакции сбрасывают ровно те ключи, которые затронуты,
+# и ставят в очередь (ads_app/tasks.py) их сборку заново. Дешёвые операции
+# (счётчики, индекс тегов, сброс страниц) выполняются сразу, а чтение из
+# базы и переиндексация — в воркере, поэтому ответ на запись не ждёт их.
+# Если Redis в этот момент недоступен, запись пропускается (guarded), а
+# после восстановления ключи приложения сбрасываются целиком.
+
+def after_commit(func):
+    transaction.on_commit(guarded(func))
+
+def on_commit_once(key, func):
+    # Внутри транзакции одно и то же объявление может поменяться несколько
+    # раз (например, при сохранении списка тегов); перечитываем его один раз.
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        for sids, pending in connection.run_on_commit:
+            if getattr(pending, 'key', None) == key:
+                return
+    func = guarded(func)
+    func.key = key
+    transaction.on_commit(func)
+
+@tasks.task('sync_adverts', batch=True)
+def sync_adverts(calls):
+    ids = sorted({pk for pk, in calls})
+    adverts = list(cache.advert_queryset().filter(pk__in=ids))
+    cache.store_adverts(adverts)
+    cache.publish(*[('advert', pk) for pk in ids])
+    search.index_adverts(adverts)
+    for pk in set(ids).difference(advert.id for advert in adverts):
+        cache.drop_advert(pk)
+        search.remove_advert(pk)
+        stats.drop(pk)
+    # Страницы, собранные до переиндексации, могли взять старый поиск.
+    pagecache.purge_adverts(ids)
+
+@tasks.task('sync_comments', batch=True)
+def sync_comments(calls):
+    ids = sorted({pk for pk, in calls})
+    for advert_id in ids:
+        cache.refresh_comments(advert_id)
+    pagecache.purge_adverts(ids)
+
+@tasks.task('sync_categories')
+def sync_categories():
+    cache.refresh_categories()
+    pagecache.purge('categories')
+
+def sync_advert(pk):
+    cache.invalidate_adverts([pk])
+    pagecache.purge_adverts([pk])
+    tasks.enqueue('sync_adverts', pk)
+
+def drop_advert(pk):
+    # Удалённое объявление убираем из индекса ленты сразу.
+    cache.drop_advert(pk)
+    pagecache.purge_adverts([pk])
+    tasks.enqueue('sync_adverts', pk)
+
+def changed_comments(advert_id):
+    cache.invalidate_comments(advert_id)
+    pagecache.purge_adverts([advert_id])
+    tasks.enqueue('sync_comments', advert_id)
+
+@receiver(post_save, sender=Advert)
+@receiver(post_delete, sender=Advert)
+def advert_changed(sender, instance, **kwargs):
+    pk = instance.pk
+    if kwargs.get('created'):
+        after_commit(pagination.invalidate_head)
+        after_commit(lambda: pagecache.purge('head', 'search'))
+    elif kwargs['signal'] is post_delete:
+        after_commit(pagination.invalidate_all)
+        on_commit_once(('drop', pk), lambda: drop_advert(pk))
+        return
+    on_commit_once(('advert', pk), lambda: sync_advert(pk))
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    if created:
+        def count():
+            tags.add(instance.advert_id, instance.name)
+            stats.incr(instance.advert_id, 'tags')
+            pagecache.purge('search')
+        after_commit(count)
+    on_commit_once(('advert', instance.advert_id), lambda: sync_advert(instance.advert_id))
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    def count():
+        tags.remove(instance.advert_id, instance.name)
+        stats.incr(instance.advert_id, 'tags', -1)
+        pagecache.purge('search')
+    after_commit(count)
+    on_commit_once(('advert', instance.advert_id), lambda: sync_advert(instance.advert_id))
+
+@tasks.task('embed_comments')
+def embed_comments(advert_id):
+    repository.embed_comments(advert_id)
+
+def embedded(advert_id, func):
+    # Ошибка MongoDB после фиксации не роняет ответ: копии целиком
+    # пересоберёт задача embed_comments, которую повторяет очередь.
+    def wrapper():
+        try:
+            func()
+        except PyMongoError:
+            logger.exception('Не удалось обновить копии комментариев объявления %s', advert_id)
+            tasks.enqueue('embed_comments', advert_id)
+    return wrapper
+
+def embed_comment(instance, signal, created):
+    # Копии в документе объявления обновляются до перечитывания кеша,
+    # который берёт комментарии уже из них.
+    advert_id, pk = instance.advert_id, instance.pk
+    if signal is post_delete:
+        after_commit(embedded(advert_id, lambda: repository.pull_comment(advert_id, pk)))
+        return
+    values = cache.comment_to_row(instance)
+    if created:
+        after_commit(embedded(advert_id, lambda: repository.push_comment(values)))
+    else:
+        after_commit(embedded(advert_id, lambda: repository.update_comment(values)))
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    advert_id = instance.advert_id
+    if repository.EMBEDDED_COMMENTS:
+        embed_comment(instance, kwargs['signal'], kwargs.get('created'))
+    if kwargs.get('created'):
+        after_commit(lambda: stats.incr(advert_id, 'comments'))
+    elif kwargs['signal'] is post_delete:
+        after_commit(lambda: stats.incr(advert_id, 'comments', -1))
+    on_commit_once(('comments', advert_id), lambda: changed_comments(advert_id))
+
+@receiver(pre_delete, sender=Category)
+def category_deleting(sender, instance, **kwargs):
+    # После удаления категории у объявлений уже будет category=NULL,
+    # поэтому список затронутых объявлений запоминаем заранее.
+    instance._advert_ids = list(instance.adverts.values_list('id', flat=True))
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    advert_ids = getattr(instance, '_advert_ids', None)
+    if advert_ids is None:
+        advert_ids = list(instance.adverts.values_list('id', flat=True))
+
+    def refresh():
+        cache.invalidate_categories()
+        cache.invalidate_adverts(advert_ids)
+        pagecache.purge_adverts(advert_ids, 'categories')
+        tasks.enqueue('sync_categories')
+        for pk in advert_ids:
+            tasks.enqueue('sync_adverts', pk)
+    after_commit(refresh)
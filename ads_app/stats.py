@@ -0,0 +1,146 @@
+from django.conf import settings
+from django.db.models import Count
+from ads_app.models import Comment, Advert, Tag
+from ads_app.cache import redis_cache, make_key, stats_key, single_flight, CACHE_TTL
+from ads_app.redis_client import fallback, guarded
+from ads_app import repository
+from collections import Counter
+import hashlib
+import threading
+import time
+
+# Статистика объявления хранится в хеше advert:<id>:stats с полями tags и
+# comments. Счётчики меняются на единицу при создании и удалении тегов и
+# комментариев, а из базы хеш собирается только при первом обращении или
+# командой rebuild_stats.
+
+FIELDS = ('tags', 'comments')
+
+# Увеличиваем счётчик, только если хеш уже собран: иначе в нём оказалось
+# бы одно поле с неполным значением.
+INCR_SCRIPT = redis_cache.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+end
+return nil
+""")
+
+
+def incr(pk, field, delta=1):
+    INCR_SCRIPT(keys=[stats_key(pk)], args=[field, delta])
+
+def drop(pk):
+    pipe = redis_cache.pipeline(transaction=False)
+    pipe.delete(stats_key(pk))
+    pipe.zrem(VIEWS_KEY, pk)
+    pipe.execute()
+
+def _count(model, ids):
+    rows = model.objects.filter(advert_id__in=ids).values('advert_id').annotate(count=Count('id'))
+    return {row['advert_id']: row['count'] for row in rows.order_by()}
+
+def collect(ids=None):
+    if repository.ENABLED:
+        return repository.counts(ids)
+    if ids is None:
+        ids = list(Advert.objects.values_list('id', flat=True))
+    else:
+        ids = list(Advert.objects.filter(pk__in=ids).values_list('id', flat=True))
+    if not ids:
+        return {}
+    tags = _count(Tag, ids)
+    comments = _count(Comment, ids)
+    return {pk: {'tags': tags.get(pk, 0), 'comments': comments.get(pk, 0)} for pk in ids}
+
+def rebuild(ids=None):
+    stats = collect(ids)
+    if not stats:
+        return stats
+    pipe = redis_cache.pipeline(transaction=True)
+    for pk, values in stats.items():
+        pipe.delete(stats_key(pk))
+        pipe.hset(stats_key(pk), mapping=values)
+        pipe.expire(stats_key(pk), CACHE_TTL)
+    pipe.execute()
+    return stats
+
+def get_many_db(ids):
+    ids = [int(pk) for pk in ids]
+    stats = collect(ids) if ids else {}
+    return {pk: stats[pk] for pk in ids if pk in stats}
+
+@fallback(get_many_db)
+def get_many(ids):
+    ids = [int(pk) for pk in ids]
+    if not ids:
+        return {}
+    stats, missing = _read(ids)
+    if missing:
+        def read():
+            found, still_missing = _read(missing)
+            return None if still_missing else found
+        digest = hashlib.md5(','.join(map(str, sorted(missing))).encode()).hexdigest()
+        stats.update(single_flight(make_key('stats', 'fill', digest), lambda: rebuild(missing), read))
+    return {pk: stats[pk] for pk in ids if pk in stats}
+
+def _read(ids):
+    pipe = redis_cache.pipeline(transaction=False)
+    for pk in ids:
+        pipe.hgetall(stats_key(pk))
+    stats = {}
+    missing = []
+    for pk, values in zip(ids, pipe.execute()):
+        if values:
+            stats[pk] = {field: int(values.get(field.encode(), 0)) for field in FIELDS}
+        else:
+            missing.append(pk)
+    return stats, missing
+
+def fill(ids):
+    # Собирает недостающие хеши; возвращает, сколько собрано.
+    missing = _read(ids)[1] if ids else []
+    return len(rebuild(missing)) if missing else 0
+
+def get(pk):
+    return get_many([pk]).get(int(pk))
+
+
+# Просмотры объявлений — по ним warm_cache выбирает, что прогреть. Каждый
+# процесс считает их в памяти и раз в VIEWS_FLUSH_INTERVAL секунд
+# отправляет одним конвейером ZINCRBY в ads:views, поэтому просмотр не
+# добавляет запросов к Redis. Ключ вне пространства кеша и не пропадает
+# при его сбросе; хранятся VIEWS_KEEP самых просматриваемых.
+
+VIEWS_KEY = 'ads:views'
+VIEWS_FLUSH_INTERVAL = getattr(settings, 'VIEWS_FLUSH_INTERVAL', 10)
+VIEWS_KEEP = 10000
+
+_views = Counter()
+_views_lock = threading.Lock()
+_views_flushed = time.monotonic()
+
+def count_view(pk):
+    # Возвращает True, если пора вызвать flush_views().
+    with _views_lock:
+        _views[int(pk)] += 1
+    return time.monotonic() - _views_flushed >= VIEWS_FLUSH_INTERVAL
+
+def flush_views():
+    global _views, _views_flushed
+    with _views_lock:
+        views, _views = _views, Counter()
+        _views_flushed = time.monotonic()
+    if not views:
+        return
+    pipe = redis_cache.pipeline(transaction=False)
+    for pk, count in views.items():
+        pipe.zincrby(VIEWS_KEY, count, pk)
+    pipe.zremrangebyrank(VIEWS_KEY, 0, -VIEWS_KEEP - 1)
+    pipe.execute()
+
+def record_view(pk):
+    if count_view(pk):
+        guarded(flush_views)()
+
+def most_viewed(limit):
+    return [int(pk) for pk in redis_cache.zrevrange(VIEWS_KEY, 0, limit - 1)]
@@ -0,0 +1,129 @@
+from django.db.models import Count
+from ads_app.models import Advert, Tag, normalize_tag
+from ads_app.cache import redis_cache, make_key, filter_advert_ids, lock
+from ads_app.redis_client import fallback
+
+# Обратный индекс тегов в Redis:
+#   tag:<имя>   SET   id объявлений с этим тегом
+#   tags        ZSET  имя тега -> количество объявлений
+# Фильтр по нескольким тегам — пересечение множеств с индексом ленты
+# (ZINTERSTORE), поэтому результат сразу упорядочен, как лента.
+
+REBUILD_LOCK_TTL = 300
+
+
+def tag_key(name):
+    return make_key('tag', name)
+
+def tags_key():
+    return make_key('tags')
+
+def built_key():
+    return make_key('tags', 'built')
+
+
+def add(advert_id, name):
+    if redis_cache.sadd(tag_key(name), advert_id):
+        redis_cache.zincrby(tags_key(), 1, name)
+
+def remove(advert_id, name):
+    if redis_cache.srem(tag_key(name), advert_id):
+        pipe = redis_cache.pipeline(transaction=True)
+        pipe.zincrby(tags_key(), -1, name)
+        pipe.zremrangebyscore(tags_key(), '-inf', 0)
+        pipe.execute()
+
+def add_many(pairs):
+    # То же, что add() для пачки пар (id объявления, тег): два конвейера
+    # вместо двух запросов на каждую пару.
+    pairs = list(pairs)
+    if not pairs:
+        return
+    pipe = redis_cache.pipeline(transaction=False)
+    for advert_id, name in pairs:
+        pipe.sadd(tag_key(name), advert_id)
+    added = pipe.execute()
+    pipe = redis_cache.pipeline(transaction=True)
+    for (advert_id, name), count in zip(pairs, added):
+        if count:
+            pipe.zincrby(tags_key(), 1, name)
+    pipe.execute()
+
+def remove_many(pairs):
+    pairs = list(pairs)
+    if not pairs:
+        return
+    pipe = redis_cache.pipeline(transaction=False)
+    for advert_id, name in pairs:
+        pipe.srem(tag_key(name), advert_id)
+    removed = pipe.execute()
+    pipe = redis_cache.pipeline(transaction=True)
+    for (advert_id, name), count in zip(pairs, removed):
+        if count:
+            pipe.zincrby(tags_key(), -1, name)
+    pipe.zremrangebyscore(tags_key(), '-inf', 0)
+    pipe.execute()
+
+def rebuild_index():
+    members = {}
+    for advert_id, name in Tag.objects.values_list('advert_id', 'name').iterator():
+        members.setdefault(name, []).append(advert_id)
+    old_keys = list(redis_cache.scan_iter(match=tag_key('*')))
+    pipe = redis_cache.pipeline(transaction=True)
+    if old_keys:
+        pipe.delete(*old_keys)
+    pipe.delete(tags_key())
+    for name, advert_ids in members.items():
+        pipe.sadd(tag_key(name), *advert_ids)
+    if members:
+        pipe.zadd(tags_key(), {name: len(advert_ids) for name, advert_ids in members.items()})
+    pipe.set(built_key(), 1)
+    pipe.execute()
+    return len(members)
+
+def ensure_index():
+    # Как и в search.ensure_index(): пока другой процесс собирает индекс,
+    # отвечаем из базы.
+    if redis_cache.exists(built_key()):
+        return True
+    with lock(built_key(), ttl=REBUILD_LOCK_TTL) as acquired:
+        if acquired and not redis_cache.exists(built_key()):
+            rebuild_index()
+        return acquired
+
+
+def list_tags_db(limit=None):
+    counts = Tag.objects.values('name').annotate(count=Count('id')).order_by('-count', 'name')
+    if limit is not None:
+        counts = counts[:limit]
+    return [(row['name'], row['count']) for row in counts]
+
+def find_adverts_db(names):
+    names = [name for name in map(normalize_tag, names) if name]
+    if not names:
+        return []
+    found = {}
+    for advert_id, name in Tag.objects.filter(name__in=names).values_list('advert_id', 'name'):
+        found.setdefault(advert_id, set()).add(name)
+    members = [pk for pk, matched in found.items() if len(matched) == len(set(names))]
+    if not members:
+        return []
+    return list(Advert.objects.filter(pk__in=members).order_by('-created', '-id').values_list('id', flat=True))
+
+
+@fallback(list_tags_db)
+def list_tags(limit=None):
+    if not ensure_index():
+        return list_tags_db(limit)
+    end = -1 if limit is None else limit - 1
+    return [(name.decode(), int(count))
+            for name, count in redis_cache.zrevrange(tags_key(), 0, end, withscores=True)]
+
+@fallback(find_adverts_db)
+def find_adverts(names):
+    names = [name for name in map(normalize_tag, names) if name]
+    if not names:
+        return []
+    if not ensure_index():
+        return find_adverts_db(names)
+    return filter_advert_ids([tag_key(name) for name in names])
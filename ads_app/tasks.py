@@ -0,0 +1,153 @@
+from django.conf import settings
+from ads_app.redis_client import redis_cache, fallback, guarded
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Очередь фоновых задач в Redis для последствий записи: перечитать
+# объявление в кеш, обновить индекс поиска, собрать копии фото. Запрос
+# ставит задачу и сразу отвечает; выполняет её команда run_tasks.
+#
+#   ads:tasks:pending     ZSET  задача -> время, с которого её можно брать
+#   ads:tasks:processing  ZSET  задача -> срок аренды у воркера
+#   ads:tasks:attempts    HASH  задача -> число неудачных попыток
+#   ads:tasks:failed      LIST  задачи, исчерпавшие попытки, с текстом ошибки
+#
+# Задача — JSON [имя, аргументы], поэтому одинаковые ожидающие задачи
+# схлопываются в одну (ZADD NX). Новая задача ждёт TASKS_BATCH_DELAY: за
+# это время всплеск записей собирается, и воркер выполняет задачи одного
+# имени пачкой. Упавшая задача повторяется с растущей паузой, а задача
+# воркера, который умер, возвращается в очередь по истечении аренды.
+#
+# Ключи не входят в пространство кеша (cache.KEY_PREFIX) и не пропадают
+# при его сбросе. Если Redis недоступен или TASKS_EAGER, задача
+# выполняется сразу, в том же процессе.
+
+EAGER = getattr(settings, 'TASKS_EAGER', False)
+BATCH_DELAY = getattr(settings, 'TASKS_BATCH_DELAY', 0.5)
+BATCH_SIZE = getattr(settings, 'TASKS_BATCH_SIZE', 100)
+MAX_ATTEMPTS = getattr(settings, 'TASKS_MAX_ATTEMPTS', 5)
+LEASE = getattr(settings, 'TASKS_LEASE', 60)
+RETRY_DELAY = 2
+FAILED_LIMIT = 1000
+
+PENDING = 'ads:tasks:pending'
+PROCESSING = 'ads:tasks:processing'
+ATTEMPTS = 'ads:tasks:attempts'
+FAILED = 'ads:tasks:failed'
+
+# Забрать готовые задачи и заодно вернуть в очередь просроченные аренды.
+CLAIM_SCRIPT = redis_cache.register_script("""
+local now, lease, limit = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+for _, job in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], job)
+    redis.call('ZADD', KEYS[1], 'NX', now, job)
+end
+local jobs = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, limit)
+for _, job in ipairs(jobs) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('ZADD', KEYS[2], now + lease, job)
+end
+return jobs
+""")
+
+registry = {}
+
+
+def task(name, batch=False):
+    # batch=True: функция получает список аргументов всех задач пачки.
+    def decorator(func):
+        registry[name] = (func, batch)
+        return func
+    return decorator
+
+
+def dump_job(name, args):
+    return json.dumps([name, list(args)], separators=(',', ':'), sort_keys=True)
+
+def run_now(name, *args):
+    func, batch = registry[name]
+    if batch:
+        guarded(func)([args])
+    else:
+        guarded(func)(*args)
+
+@fallback(run_now)
+def _enqueue(name, *args):
+    redis_cache.zadd(PENDING, {dump_job(name, args): time.time() + BATCH_DELAY}, nx=True)
+
+def enqueue(name, *args):
+    if name not in registry:
+        raise KeyError(f'Неизвестная задача {name}')
+    if EAGER:
+        return run_now(name, *args)
+    return _enqueue(name, *args)
+
+
+def claim(limit=BATCH_SIZE):
+    return [job.decode() for job in CLAIM_SCRIPT(keys=[PENDING, PROCESSING], args=[time.time(), LEASE, limit])]
+
+def ack(jobs):
+    pipe = redis_cache.pipeline(transaction=True)
+    pipe.zrem(PROCESSING, *jobs)
+    pipe.hdel(ATTEMPTS, *jobs)
+    pipe.execute()
+
+def retry(jobs, error):
+    for job in jobs:
+        attempts = redis_cache.hincrby(ATTEMPTS, job, 1)
+        pipe = redis_cache.pipeline(transaction=True)
+        pipe.zrem(PROCESSING, job)
+        if attempts < MAX_ATTEMPTS:
+            pipe.zadd(PENDING, {job: time.time() + RETRY_DELAY ** attempts}, nx=True)
+        else:
+            logger.error('Задача %s не выполнена за %s попыток: %s', job, attempts, error)
+            pipe.hdel(ATTEMPTS, job)
+            pipe.lpush(FAILED, json.dumps({'job': job, 'error': error, 'time': time.time()}))
+            pipe.ltrim(FAILED, 0, FAILED_LIMIT - 1)
+        pipe.execute()
+
+def process(jobs):
+    # Выполняет забранные задачи, группируя их по имени. Возвращает число
+    # выполненных.
+    groups = {}
+    for job in jobs:
+        try:
+            name, args = json.loads(job)
+            groups.setdefault(name, []).append((job, tuple(args)))
+        except ValueError:
+            logger.error('Неразборчивая задача %r', job)
+            ack([job])
+    done = 0
+    for name, items in groups.items():
+        if name not in registry:
+            logger.error('Неизвестная задача %s, %s шт. отброшено', name, len(items))
+            ack([job for job, args in items])
+            continue
+        func, batch = registry[name]
+        if batch:
+            done += _run(name, [job for job, args in items], func, [args for job, args in items])
+        else:
+            for job, args in items:
+                done += _run(name, [job], func, *args)
+    return done
+
+def _run(name, jobs, func, *args):
+    try:
+        func(*args)
+    except Exception as error:
+        logger.exception('Задача %s упала', name)
+        retry(jobs, repr(error))
+        return 0
+    ack(jobs)
+    return len(jobs)
+
+def stats():
+    pipe = redis_cache.pipeline(transaction=False)
+    pipe.zcard(PENDING)
+    pipe.zcard(PROCESSING)
+    pipe.llen(FAILED)
+    pending, processing, failed = pipe.execute()
+    return {'pending': pending, 'processing': processing, 'failed': failed}
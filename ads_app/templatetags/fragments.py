@@ -0,0 +1,24 @@
+from django import template
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from ads_app import pagecache
+from ads_app.cache import Row
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def nocache(context, template_name, **kwargs):
+    # Аргументы фрагмента сохраняются в метке, поэтому передавать можно
+    # только простые значения (id, строки), а не объекты.
+    html = render_to_string(template_name, kwargs, request=context.get('request'))
+    return mark_safe(pagecache.fragment(template_name, kwargs, html))
+
+@register.simple_tag
+def advert_cards(adverts):
+    # Ключ карточки строится из строки кеша (cache.Row). Модели и запросы
+    # (views-noredis.py) рендерятся без кеша карточек.
+    adverts = list(adverts)
+    if not all(isinstance(advert, Row) for advert in adverts):
+        return mark_safe(pagecache.render_cards_db(adverts))
+    return mark_safe(pagecache.render_cards(adverts))
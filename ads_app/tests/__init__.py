@@ -0,0 +1,15 @@
+import fakeredis
+import fakeredis.aioredis
+from ads_app import aio, redis_client
+
+# Redis в тестах — fakeredis в памяти процесса. Пул и асинхронные клиенты
+# ads_app/aio.py подменяются до первого обращения к Redis (в том числе до
+# миграций тестовой базы); сервер у них общий.
+
+server = fakeredis.FakeServer()
+
+redis_client.pool.connection_class = fakeredis.FakeConnection
+redis_client.pool.connection_kwargs['server'] = server
+redis_client.pool.reset()
+
+aio.make_client = lambda: fakeredis.aioredis.FakeRedis(server=server)
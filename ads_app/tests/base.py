@@ -0,0 +1,88 @@
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from unittest import mock, skipIf
+from ads_app import repository, stats
+from ads_app.local_cache import local_cache
+from ads_app.models import Advert, Category, Comment
+from ads_app.redis_client import redis_cache, breaker
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+def reset_redis():
+    redis_cache.flushall()
+    local_cache.clear()
+    breaker.failures = 0
+    breaker.opened_at = None
+    breaker.dirty = False
+    with stats._views_lock:
+        stats._views.clear()
+
+
+class RedisMixin:
+    # Каждый тест начинается с пустого Redis, пустого L1 и замкнутой цепи.
+
+    def setUp(self):
+        super().setUp()
+        reset_redis()
+
+    def tearDown(self):
+        # Ошибка Redis в тесте ушла бы в запасной путь незамеченной.
+        self.assertFalse(breaker.failures, 'Redis отвечал ошибками')
+        super().tearDown()
+
+    def make_advert(self, title='Велосипед', content='Почти новый', tags=(), comments=0, category=None, author=None):
+        advert = Advert.objects.create(title=title, content=content, category=category, author=author)
+        if tags:
+            advert.set_tags(tags)
+        for index in range(comments):
+            Comment.objects.create(advert=advert, author=f'Гость {index}', content=f'Комментарий {index}')
+        return advert
+
+    def make_category(self, name='Транспорт'):
+        return Category.objects.create(name=name)
+
+    def make_user(self, username='user', password='password'):
+        return User.objects.create_user(username=username, password=password)
+
+
+class CacheTestCase(RedisMixin, TestCase):
+    # Обработчики transaction.on_commit здесь не вызываются: сигналы
+    # моделей кеш не трогают, и он собирается только чтением.
+    pass
+
+
+class SignalTestCase(RedisMixin, TransactionTestCase):
+    # Настоящие транзакции: после записи срабатывают обработчики сигналов.
+    pass
+
+
+class MongoMixin:
+    # repository поверх mongomock: коллекции те же, что у моделей, база
+    # своя у каждого теста.
+
+    def setUp(self):
+        super().setUp()
+        self.db = mongomock.MongoClient(tz_aware=True)['test']
+        patcher = mock.patch.object(repository, 'database', lambda: self.db)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def insert_advert(self, pk, created, **values):
+        document = dict({'id': pk, 'title': f'Объявление {pk}', 'content': 'Текст', 'created': created,
+                         'updated': created, 'photo': '', 'category_id': None, 'author_id': None}, **values)
+        self.db[repository.ADVERTS].insert_one(document)
+        return document
+
+    def insert_comments(self, advert_pk, ids, created):
+        self.db[repository.COMMENTS].insert_many([
+            {'id': pk, 'author': 'Гость', 'content': f'Комментарий {pk}', 'created': created,
+             'updated': created, 'advert_id': advert_pk} for pk in ids])
+
+
+@skipIf(mongomock is None, 'mongomock не установлен')
+class MongoTestCase(MongoMixin, SimpleTestCase):
+    pass
@@ -0,0 +1,163 @@
+from unittest import mock
+from ads_app import aio, cache, pagecache
+from ads_app.tests.base import SignalTestCase, reset_redis
+from django.core.wsgi import get_wsgi_application
+import asyncio
+import threading
+
+
+def call(application, path, query='', method='GET', headers=()):
+    # Один запрос к ASGI-приложению; возвращает статус, заголовки и тело.
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+             'headers': [(name.encode(), value.encode()) for name, value in headers],
+             'client': ('127.0.0.1', 5000), 'server': ('testserver', 80)}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    start, body = messages
+    headers = {name.decode().lower(): value.decode() for name, value in start['headers']}
+    return start['status'], headers, body['body'].decode()
+
+
+class AsyncApplicationTestCase(SignalTestCase):
+    # Пул потоков ходит в базу своими соединениями, поэтому данные должны
+    # быть зафиксированы: SignalTestCase, а не TestCase.
+
+    def setUp(self):
+        super().setUp()
+        self.application = aio.AsyncApplication(get_wsgi_application())
+        self.advert = self.make_advert(title='Велосипед', tags=['bike'], comments=2)
+
+    def get(self, path, query='', **kwargs):
+        return call(self.application, path, query, **kwargs)
+
+
+class AsyncRoutesTests(AsyncApplicationTestCase):
+
+    def test_list_and_detail(self):
+        status, headers, body = self.get('/')
+        self.assertEqual(status, 200)
+        self.assertIn('Велосипед', body)
+        status, headers, body = self.get(f'/id{self.advert.pk}')
+        self.assertEqual(status, 200)
+        self.assertIn('Комментарий 1', body)
+
+    def test_page_cache_shared_with_wsgi(self):
+        self.assertEqual(self.get('/')[1].get('x-page-cache'), 'miss')
+        self.assertEqual(self.get('/')[1].get('x-page-cache'), 'hit')
+        self.assertEqual(self.client.get('/')['X-Page-Cache'], 'hit')
+
+    def test_tag_filter_in_pool(self):
+        status, headers, body = self.get('/', 'tag=bike')
+        self.assertEqual(status, 200)
+        self.assertIn('Велосипед', body)
+        self.assertNotIn('Велосипед', self.get('/', 'tag=car')[2])
+
+    def test_stats(self):
+        status, headers, body = self.get(f'/id{self.advert.pk}/stats')
+        self.assertEqual((status, body), (200, f'{{"id": {self.advert.pk}, "tags": 1, "comments": 2}}'))
+        status, headers, body = self.get('/stats', f'ids={self.advert.pk},x')
+        self.assertEqual(status, 400)
+
+    def test_other_requests_go_to_wsgi(self):
+        for path, query in ((f'/id{self.advert.pk}', 'before=1'), ('/tags', ''), ('/id999999', '')):
+            with self.subTest(path=path, query=query), mock.patch.object(
+                    self.application, 'call_wsgi', wraps=self.application.call_wsgi) as call_wsgi:
+                self.get(path, query)
+                call_wsgi.assert_called_once()
+        with mock.patch.object(self.application, 'dispatch') as dispatch:
+            self.get('/', headers=[('cookie', 'sessionid=abc')])
+            self.get('/', headers=[('cookie', f'{pagecache.PENDING_COOKIE}=abc')])
+            dispatch.assert_not_called()
+
+
+class EventLoopTests(AsyncApplicationTestCase):
+    # В цикле событий нет синхронного ввода-вывода: отрисовка (карточки
+    # ленты читают Redis) и запуск подписчика L1 идут в пуле потоков.
+
+    def test_cards_rendered_in_pool(self):
+        seen = []
+        render_cards = pagecache.render_cards
+
+        def record(adverts):
+            seen.append(threading.current_thread().name)
+            return render_cards(adverts)
+        with mock.patch.object(pagecache, 'render_cards', record):
+            self.get('/')
+        self.assertTrue(seen)
+        self.assertTrue(all(name.startswith('asgi-sync') for name in seen), seen)
+
+    def test_l1_listener_not_started_on_loop(self):
+        cache.get_adverts([self.advert.pk])
+        seen = []
+        with mock.patch.object(cache.listener, 'ensure_started', lambda client: seen.append(
+                threading.current_thread().name)):
+            self.get('/', 'size=5')
+            self.get(f'/id{self.advert.pk}', 'x=1')
+        self.assertNotIn(threading.main_thread().name, seen)
+
+    def test_local_peek_does_not_start_listener(self):
+        with mock.patch.object(cache.listener, 'ensure_started') as ensure_started:
+            self.assertIsNone(cache.local_peek(('advert', self.advert.pk)))
+        ensure_started.assert_not_called()
+
+
+class AsyncMiddlewareTests(AsyncApplicationTestCase):
+
+    def test_headers_match_wsgi(self):
+        # Заголовки слоёв те же, что у WSGI-приложения. Vary: Cookie у JSON
+        # статистики ставит только PageCacheMiddleware, проверяя пользователя.
+        for path in ('/', f'/id{self.advert.pk}', f'/id{self.advert.pk}/stats'):
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                expected = {name.lower() for name in response._headers}
+                if response.cookies:
+                    expected.add('set-cookie')
+                reset_redis()
+                headers = set(self.get(path)[1])
+                if path.endswith('/stats'):
+                    expected.discard('vary')
+                self.assertEqual(headers, expected)
+
+    def test_request_hook_short_circuits(self):
+        with self.settings(PREPEND_WWW=True):
+            application = aio.AsyncApplication(get_wsgi_application())
+            status, headers, body = call(application, '/')
+        self.assertEqual(status, 301)
+        self.assertEqual(headers['location'], 'http://www.testserver/')
+        # Внутренние слои (X-Frame-Options) до ответа не дошли, как и в Django.
+        self.assertNotIn('x-frame-options', headers)
+
+    def test_layers_follow_settings(self):
+        middleware = [name for name in aio.MIDDLEWARE_MODES
+                      if not name.endswith(('MetricsMiddleware', 'XFrameOptionsMiddleware'))]
+        application = aio.AsyncApplication(get_wsgi_application(), middleware)
+        headers = call(application, '/')[1]
+        self.assertNotIn('server-timing', headers)
+        self.assertNotIn('x-frame-options', headers)
+
+    def test_unknown_middleware_falls_back_to_wsgi(self):
+        with self.assertLogs('ads_app.aio', 'WARNING'):
+            application = aio.AsyncApplication(get_wsgi_application(), ['ads_app.tests.Unknown'])
+        with mock.patch.object(application, 'dispatch') as dispatch:
+            status, headers, body = call(application, '/')
+        dispatch.assert_not_called()
+        self.assertEqual(status, 200)
+        self.assertIn('Велосипед', body)
+
+    def test_user_is_anonymous(self):
+        seen = []
+        get_list_context = aio.views.get_list_context
+
+        def record(request, *args):
+            seen.append(request.user.is_authenticated)
+            return get_list_context(request, *args)
+        with mock.patch.object(aio.views, 'get_list_context', record):
+            self.get('/')
+        self.assertEqual(seen, [False])
@@ -0,0 +1,166 @@
+from unittest import mock
+from django.urls import reverse
+from ads_app import api, cache, ingest, ratelimit
+from ads_app.models import Advert, Comment
+from ads_app.redis_client import redis_cache
+from ads_app.tests.base import SignalTestCase
+import json
+
+
+@mock.patch.object(ingest, 'RATE_LIMITS', {})
+class ApiTests(SignalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user()
+        self.category = self.make_category()
+        self.advert = self.make_advert(tags=['bike'], comments=2, author=self.user)
+
+    def post(self, name, data, *args):
+        return self.client.post(reverse(f'ads_app:{name}', args=args), json.dumps(data),
+                                content_type='application/json')
+
+    def login(self):
+        self.client.force_login(self.user)
+
+    def test_advert_detail(self):
+        body = self.client.get(reverse('ads_app:api-advert', args=[self.advert.pk])).json()
+        self.assertEqual(body['title'], 'Велосипед')
+        self.assertEqual(body['tags'], ['bike'])
+        self.assertEqual([comment['content'] for comment in body['comments']], ['Комментарий 0', 'Комментарий 1'])
+        self.assertEqual(body['stats'], {'tags': 1, 'comments': 2})
+        self.assertEqual(self.client.get(reverse('ads_app:api-advert', args=[999999])).status_code, 404)
+
+    def test_etag(self):
+        url = reverse('ads_app:api-advert', args=[self.advert.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Comment.objects.create(advert=self.advert, author='Гость', content='Ещё')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_adverts_by_ids(self):
+        other = self.make_advert(title='Самокат')
+        response = self.client.get(reverse('ads_app:api-adverts'), {'ids': f'{other.pk},999999,{self.advert.pk}'})
+        self.assertEqual([advert['id'] for advert in response.json()['adverts']], [other.pk, self.advert.pk])
+        self.assertEqual(self.client.get(reverse('ads_app:api-adverts'), {'ids': '1,x'}).status_code, 400)
+        ids = ','.join(map(str, range(1, api.MAX_BULK + 2)))
+        self.assertEqual(self.client.get(reverse('ads_app:api-adverts'), {'ids': ids}).status_code, 400)
+
+    def test_create_requires_login(self):
+        data = {'title': 'Самокат', 'content': 'Новый', 'category': self.category.pk}
+        self.assertEqual(self.post('api-adverts', data).status_code, 401)
+        self.login()
+        response = self.post('api-adverts', dict(data, tags=['kick', 'Scooter'], comments=[{'author': 'Я', 'content': 'Первый'}]))
+        self.assertEqual(response.status_code, 201)
+        advert = cache.get_advert(response.json()['id'])
+        self.assertEqual(sorted(advert.tags), ['kick', 'scooter'])
+        self.assertEqual(advert.comment_count, 1)
+        self.assertEqual(advert.author_id, self.user.pk)
+        self.assertEqual(advert.category_name, 'Транспорт')
+
+    def test_invalid_advert(self):
+        self.login()
+        response = self.post('api-adverts', {'content': 'Без названия'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('title', response.json()['errors'])
+        self.assertEqual(self.client.post(reverse('ads_app:api-adverts'), 'не json',
+                                          content_type='application/json').status_code, 400)
+        self.assertEqual(self.post('api-adverts', [1]).status_code, 400)
+
+    def test_bulk_create_is_atomic(self):
+        self.login()
+        items = [{'title': 'Первое', 'content': 'Текст', 'category': self.category.pk},
+                 {'content': 'Без названия', 'category': self.category.pk}, 'строка']
+        response = self.post('api-adverts-bulk', {'adverts': items})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2])
+        self.assertEqual(Advert.objects.count(), 1)
+        response = self.post('api-adverts-bulk', {'adverts': items[:1] * 3})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(cache.get_adverts(response.json()['ids'])), 3)
+        self.assertEqual(self.post('api-adverts-bulk', {'adverts': []}).status_code, 400)
+        self.assertEqual(self.post('api-adverts-bulk', {'adverts': items[:1] * (api.MAX_BULK + 1)}).status_code, 400)
+
+    def test_tags_only_by_author(self):
+        stranger = self.make_user('stranger')
+        self.client.force_login(stranger)
+        self.assertEqual(self.post('api-advert-tags', {'tags': ['red']}, self.advert.pk).status_code, 403)
+        self.login()
+        response = self.post('api-advert-tags', {'tags': ['red', 'bike']}, self.advert.pk)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['added'], ['red'])
+        self.assertEqual(sorted(cache.get_advert(self.advert.pk).tags), ['bike', 'red'])
+        self.assertEqual(self.post('api-advert-tags', {'tag': 'bike'}, self.advert.pk).status_code, 200)
+        self.assertEqual(self.post('api-advert-tags', {'tags': []}, self.advert.pk).status_code, 400)
+
+    def test_comments_paging(self):
+        url = reverse('ads_app:api-advert-comments', args=[self.advert.pk])
+        body = self.client.get(url).json()
+        self.assertEqual(len(body['comments']), 2)
+        self.assertIsNone(body['before'])
+        last = body['comments'][-1]['id']
+        body = self.client.get(url, {'before': last}).json()
+        self.assertEqual([comment['content'] for comment in body['comments']], ['Комментарий 0'])
+        self.assertEqual(self.client.get(url, {'before': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url.replace(str(self.advert.pk), '999999')).status_code, 404)
+
+    def test_comment_validation(self):
+        response = self.post('api-advert-comments', {'author': 'Гость'}, self.advert.pk)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('content', response.json()['errors'])
+        self.assertEqual(self.post('api-advert-comments', {'author': 'Гость', 'content': 'Текст'}, 999999).status_code, 404)
+
+    def test_comments_bulk(self):
+        other = self.make_advert(title='Самокат')
+        items = [{'advert': self.advert.pk, 'author': 'А', 'content': 'Раз'},
+                 {'advert': other.pk, 'author': 'Б', 'content': 'Два'}]
+        response = self.post('api-comments', {'comments': items + [{'advert': 999999, 'author': 'В', 'content': 'Три'}]})
+        self.assertEqual((response.status_code, response.json()['errors']), (404, ['999999']))
+        self.assertEqual(Comment.objects.count(), 2)
+        response = self.post('api-comments', {'comments': items})
+        # Через буфер: у принятых комментариев токены, а не id.
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(all('token' in item for item in response.json()['comments']))
+        self.assertEqual(cache.get_advert(other.pk).comment_count, 1)
+        ids = Comment.objects.filter(content__in=['Раз', 'Два']).values_list('id', flat=True)
+        found = self.client.get(reverse('ads_app:api-comments'), {'ids': ','.join(map(str, ids))}).json()
+        self.assertEqual(sorted(comment['content'] for comment in found['comments']), ['Два', 'Раз'])
+
+    def test_comments_bulk_throttled(self):
+        items = [{'advert': self.advert.pk, 'author': 'Гость', 'content': f'Текст {n}'} for n in range(3)]
+        with mock.patch.object(ingest, 'RATE_LIMITS', {'ip': (2, 60)}):
+            response = self.post('api-comments', {'comments': items})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual((response.json()['index'], len(response.json()['comments'])), (2, 2))
+        self.assertEqual(Comment.objects.filter(author='Гость').count(), 2)
+        # Комментарии нового объявления ограничиваются так же, но само
+        # объявление уже создано.
+        redis_cache.delete(ratelimit.bucket_key(f'comment:ip:{ingest.client_ip(response.wsgi_request)}'))
+        self.login()
+        data = {'title': 'Самокат', 'content': 'Новый', 'category': self.category.pk, 'comments': items}
+        with mock.patch.object(ingest, 'RATE_LIMITS', {'ip': (2, 60)}):
+            response = self.post('api-adverts', data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['index'], len(response.json()['comments'])), (2, 2))
+        self.assertEqual(cache.get_advert(response.json()['id']).comment_count, 2)
+
+    def test_comments_bulk_validation(self):
+        items = [{'advert': self.advert.pk, 'author': 'А', 'content': 'Раз'},
+                 {'advert': [self.advert.pk], 'author': 'Б', 'content': 'Два'},
+                 {'advert': {'id': 1}, 'author': 'В', 'content': 'Три'},
+                 {'advert': True, 'author': 'Г', 'content': 'Четыре'},
+                 {'advert': self.advert.pk, 'author': 'Д'}, 'строка']
+        response = self.post('api-comments', {'comments': items})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2, 3, 4, 5])
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_stats(self):
+        url = reverse('ads_app:api-advert-stats', args=[self.advert.pk])
+        self.assertEqual(self.client.get(url).json(), {'id': self.advert.pk, 'tags': 1, 'comments': 2})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=self.client.get(url)['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(reverse('ads_app:api-advert-stats', args=[999999])).status_code, 404)
+
+    def test_method_not_allowed(self):
+        self.assertEqual(self.client.delete(reverse('ads_app:api-advert', args=[self.advert.pk])).status_code, 405)
+        self.assertEqual(self.client.get(reverse('ads_app:api-adverts-bulk')).status_code, 405)
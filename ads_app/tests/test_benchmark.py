@@ -0,0 +1,87 @@
+from io import StringIO
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+from ads_app.management.commands import benchmark_views
+from ads_app.models import Comment, Tag
+from ads_app.redis_client import breaker
+from ads_app.tests.base import CacheTestCase
+import json
+import os
+import tempfile
+
+
+class PercentileTests(SimpleTestCase):
+
+    def test_nearest_rank(self):
+        timings = list(range(1, 101))
+        self.assertEqual(benchmark_views.percentile(timings, 50), 50)
+        self.assertEqual(benchmark_views.percentile(timings, 95), 95)
+        self.assertEqual(benchmark_views.percentile(timings, 100), 100)
+        self.assertEqual(benchmark_views.percentile([7], 99), 7)
+        self.assertEqual(benchmark_views.percentile([], 50), 0.0)
+
+
+class BenchmarkViewsTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.advert = self.make_advert(tags=['bike'], comments=2)
+        handle, self.output = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.addCleanup(os.remove, self.output)
+
+    def bench(self, **options):
+        out = StringIO()
+        options.setdefault('force', True)
+        call_command('benchmark_views', modes='client', requests=3, warmup=1, output=self.output,
+                     stdout=out, **options)
+        with open(self.output, encoding='utf-8') as file:
+            return json.load(file), out.getvalue()
+
+    def test_both_views_measured(self):
+        report, out = self.bench()
+        rows = {(row['views'], row['endpoint']): row for row in report['results']}
+        self.assertEqual(len(rows), 2 * len(benchmark_views.ENDPOINTS))
+        self.assertTrue(all(row['errors'] == 0 and row['requests'] == 3 for row in rows.values()))
+        # Без кеша страница объявления идёт в базу, а Redis не трогает.
+        self.assertEqual(rows['noredis', 'detail']['redis'], 0)
+        self.assertGreater(rows['noredis', 'detail']['queries'], rows['redis', 'detail']['queries'])
+        self.assertIn('Результаты сохранены', out)
+
+    def test_cleanup(self):
+        # Строки, созданные не этим прогоном, остаются, даже похожие.
+        Comment.objects.create(advert=self.advert, author=benchmark_views.BENCH_AUTHOR, content='Настоящий')
+        self.advert.add_tag(f'{benchmark_views.BENCH_TAG}mark')
+        self.bench(endpoints='comment,tag')
+        self.assertEqual(list(Comment.objects.filter(author=benchmark_views.BENCH_AUTHOR).values_list(
+            'content', flat=True)), ['Настоящий'])
+        self.assertEqual(list(Tag.objects.filter(name__startswith=benchmark_views.BENCH_TAG).values_list(
+            'name', flat=True)), [f'{benchmark_views.BENCH_TAG}mark'])
+        self.assertFalse(breaker.is_open())
+
+    def test_noredis_runs_with_redis_up(self):
+        # Без кеша страниц, но без имитации сбоя: сигналы пишут в Redis.
+        with benchmark_views.views_settings('noredis'):
+            self.assertFalse(breaker.is_open())
+            self.assertNotIn(benchmark_views.PAGE_CACHE_MIDDLEWARE, settings.MIDDLEWARE)
+
+    def test_refuses_real_data_without_force(self):
+        with self.assertRaisesMessage(CommandError, '--force'):
+            self.bench(force=False)
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_compare_flags_regression(self):
+        report, out = self.bench(views='redis', endpoints='list')
+        for row in report['results']:
+            row['p95'] /= 100
+        with open(self.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file)
+        with self.assertRaisesMessage(CommandError, 'Ухудшение'):
+            call_command('benchmark_views', views='redis', endpoints='list', modes='client', requests=3,
+                         warmup=0, compare=self.output, force=True, stdout=StringIO())
+
+    def test_unknown_endpoint(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_views', endpoints='nope', stdout=StringIO())
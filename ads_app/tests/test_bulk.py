@@ -0,0 +1,130 @@
+from datetime import datetime, timezone
+from io import StringIO
+from unittest import mock, skipIf
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+from ads_app import bulk, cache, pagination, repository
+from ads_app.local_cache import local_cache
+from ads_app.models import Category
+from ads_app.tests.base import CacheTestCase, MongoMixin, mongomock
+import json
+import os
+import tempfile
+
+
+class ReadTests(SimpleTestCase):
+
+    def test_clean(self):
+        record = bulk.clean({'content': 'Текст', 'tags': 'Bike  red bike', 'created': '2020-05-01T12:00:00',
+                             'comments': [{'content': 'Первый', 'author': 'Гость' * 20}]})
+        self.assertEqual(record['tags'], ['bike', 'red'])
+        self.assertIsNotNone(record['created'].tzinfo)
+        self.assertEqual(len(record['comments'][0]['author']), 50)
+        self.assertIsNone(record['id'])
+
+    def test_invalid_records(self):
+        for value in ([], {'title': 'Без текста'}, {'content': ' '}, {'content': 'x', 'id': 0},
+                      {'content': 'x', 'id': True}, {'content': 'x', 'created': 'вчера'},
+                      {'content': 'x', 'comments': [{}]}, {'content': 'x', 'tags': 5},
+                      {'content': 'x', 'category': ['a']}):
+            with self.subTest(value=value):
+                with self.assertRaises(bulk.RecordError):
+                    bulk.clean(value)
+
+    def test_batches_and_errors(self):
+        lines = ['{"content": "1"}', '', 'не json', '{"content": "2"}', '{"title": "3"}', '{"content": "4"}']
+        errors = []
+        batches = list(bulk.read_batches(lines, 2, errors))
+        self.assertEqual([[record['content'] for record in batch] for batch in batches], [['1', '2'], ['4']])
+        self.assertEqual([number for number, error in errors], [3, 5])
+
+
+class ExportTests(CacheTestCase):
+
+    def test_records_in_id_order(self):
+        user = self.make_user()
+        category = self.make_category()
+        adverts = [self.make_advert(title=f'Объявление {index}', tags=['bike'], comments=index,
+                                    category=category, author=user) for index in range(3)]
+        records = list(bulk.export_records(batch_size=2))
+        self.assertEqual([record['id'] for record in records], [advert.pk for advert in adverts])
+        record = records[2]
+        self.assertEqual((record['category'], record['author'], record['tags']), ('Транспорт', 'user', ['bike']))
+        self.assertEqual([comment['content'] for comment in record['comments']], ['Комментарий 0', 'Комментарий 1'])
+
+    def test_command_output_reimportable(self):
+        self.make_advert(comments=1)
+        handle, path = tempfile.mkstemp(suffix='.ndjson')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        call_command('export_adverts', output=path, stderr=StringIO())
+        with open(path, encoding='utf-8') as file:
+            errors = []
+            batches = list(bulk.read_batches(file, 10, errors))
+        self.assertEqual(errors, [])
+        self.assertEqual(batches[0][0]['title'], 'Велосипед')
+        self.assertEqual(batches[0][0]['comments'][0]['content'], 'Комментарий 0')
+
+    def test_import_requires_repository(self):
+        with self.assertRaises(CommandError):
+            call_command('import_adverts', '-', stdout=StringIO())
+
+
+@skipIf(mongomock is None, 'mongomock не установлен')
+@mock.patch.object(repository, 'ENABLED', True)
+class ImportTests(MongoMixin, CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db[repository.SCHEMA].insert_many([{'name': name, 'auto': {'seq': 0}} for name in (
+            repository.ADVERTS, repository.COMMENTS, repository.TAGS)])
+        self.db[repository.USERS].insert_one({'id': 1, 'username': 'admin'})
+
+    def run_import(self, *records, batch_size=bulk.BATCH_SIZE):
+        lines = [json.dumps(record, ensure_ascii=False) if isinstance(record, dict) else record
+                 for record in records]
+        return bulk.import_stream(lines, batch_size)
+
+    def test_import(self):
+        totals = self.run_import(
+            {'id': 10, 'title': 'С id', 'content': 'Текст', 'author': 'admin', 'category': 'Авто',
+             'tags': ['bike'], 'comments': [{'author': 'Гость', 'content': 'Первый'}]},
+            {'title': 'Без id', 'content': 'Текст', 'author': 'nobody', 'created': '2020-05-01T12:00:00Z'},
+            'мусор',
+        )
+        self.assertEqual((totals['created'], totals['updated']), (2, 0))
+        self.assertEqual(totals['errors'][0][0], 3)
+        self.assertEqual(totals['warnings'], ["11: нет пользователя 'nobody'"])
+        self.assertTrue(Category.objects.filter(name='Авто').exists())
+        advert = cache.get_advert(10)
+        self.assertEqual((advert.title, advert.tags, advert.author_name), ('С id', ['bike'], 'admin'))
+        self.assertEqual(advert.comment_count, 1)
+        self.assertEqual(cache.get_advert(11).created, datetime(2020, 5, 1, 12, tzinfo=timezone.utc))
+        self.assertEqual(self.db[repository.COMMENTS].find_one({'advert_id': 10})['content'], 'Первый')
+
+    def test_reimport_updates(self):
+        self.run_import({'id': 10, 'content': 'Текст', 'tags': ['bike', 'red'],
+                         'comments': [{'content': 'Первый'}]})
+        cache.get_advert(10)
+        totals = self.run_import({'id': 10, 'title': 'Новое', 'content': 'Текст', 'tags': ['red', 'blue'],
+                                  'comments': [{'content': 'Второй'}]})
+        self.assertEqual((totals['created'], totals['updated']), (0, 1))
+        local_cache.clear()
+        advert = cache.get_advert(10)
+        self.assertEqual((advert.title, sorted(advert.tags)), ('Новое', ['blue', 'red']))
+        # Комментарии обновлённого объявления не трогаются.
+        self.assertEqual(self.db[repository.COMMENTS].count_documents({'advert_id': 10}), 1)
+        self.assertEqual(self.db[repository.TAGS].count_documents({'advert_id': 10}), 2)
+
+    def test_duplicate_ids_in_batch(self):
+        totals = self.run_import({'id': 5, 'title': 'Первое', 'content': 'x'},
+                                 {'id': 5, 'title': 'Второе', 'content': 'x'}, batch_size=10)
+        self.assertEqual(totals['created'], 1)
+        self.assertEqual(self.db[repository.ADVERTS].find_one({'id': 5})['title'], 'Второе')
+
+    def test_feed_sees_imported(self):
+        pagination.get_page()
+        self.run_import({'content': 'Первое'}, {'content': 'Второе'}, batch_size=1)
+        self.assertEqual(pagination.get_page()['ids'], [2, 1])
+        self.assertEqual(self.db[repository.SCHEMA].find_one({'name': repository.ADVERTS})['auto']['seq'], 2)
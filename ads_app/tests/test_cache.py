@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+from django.db import connections
+from django.utils import timezone
+from ads_app import cache
+from ads_app.local_cache import local_cache
+from ads_app.models import Advert
+from ads_app.redis_client import redis_cache
+from ads_app.tests.base import CacheTestCase
+import threading
+import time
+
+
+class AdvertCacheTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.adverts = [self.make_advert(title=f'Объявление {index}', tags=['tag'], comments=index)
+                        for index in range(3)]
+        for age, advert in enumerate(reversed(self.adverts)):
+            Advert.objects.filter(pk=advert.pk).update(created=now - timedelta(hours=age))
+        self.ids = [advert.pk for advert in self.adverts]
+
+    def test_rows_cached_per_object(self):
+        rows = cache.get_adverts(self.ids)
+        self.assertEqual([row.title for row in rows], ['Объявление 0', 'Объявление 1', 'Объявление 2'])
+        self.assertEqual([row.comment_count for row in rows], [0, 1, 2])
+        self.assertEqual(rows[0].tags, ['tag'])
+        for pk in self.ids:
+            self.assertTrue(redis_cache.exists(cache.advert_key(pk)))
+        local_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_adverts(list(reversed(self.ids))), list(reversed(rows)))
+
+    def test_only_missing_rows_loaded(self):
+        cache.get_adverts(self.ids[:1])
+        local_cache.clear()
+        # Строки с тегами и счётчики двух недостающих объявлений, одним
+        # запросом на каждое, а не на объявление.
+        with self.assertNumQueries(5):
+            cache.get_adverts(self.ids)
+
+    def test_unknown_ids(self):
+        self.assertEqual([row.id for row in cache.get_adverts([self.ids[0], 999999])], [self.ids[0]])
+        with self.assertRaises(Advert.DoesNotExist):
+            cache.get_adverts([999999], strict=True)
+        with self.assertRaises(Advert.DoesNotExist):
+            cache.get_advert(999999)
+        self.assertEqual(cache.get_adverts([]), [])
+
+    def test_index_newest_first(self):
+        self.assertEqual(cache.get_advert_ids(), list(reversed(self.ids)))
+        self.assertEqual(redis_cache.zcard(cache.index_key()), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_advert_ids(), list(reversed(self.ids)))
+
+    def test_refresh_and_drop(self):
+        cache.get_advert_ids()
+        cache.get_adverts(self.ids)
+        Advert.objects.filter(pk=self.ids[0]).update(title='Новое название')
+        cache.refresh_advert(self.ids[0])
+        self.assertEqual(cache.get_advert(self.ids[0]).title, 'Новое название')
+        cache.drop_advert(self.ids[1])
+        self.assertFalse(redis_cache.exists(cache.advert_key(self.ids[1])))
+        self.assertNotIn(self.ids[1], cache.get_advert_ids())
+
+    def test_deleted_advert_refresh_drops_key(self):
+        cache.get_adverts(self.ids)
+        Advert.objects.filter(pk=self.ids[2]).delete()
+        self.assertIsNone(cache.refresh_advert(self.ids[2]))
+        self.assertFalse(redis_cache.exists(cache.advert_key(self.ids[2])))
+
+    def test_rows_are_plain(self):
+        row = cache.get_advert(self.ids[0])
+        self.assertIsInstance(row, cache.Row)
+        self.assertEqual(row.created, Advert.objects.get(pk=self.ids[0]).created)
+        with self.assertRaises(AttributeError):
+            row.missing
+
+
+class StampedeTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.key = cache.make_key('test')
+
+    def test_lock_is_exclusive(self):
+        with cache.lock(self.key) as first:
+            with cache.lock(self.key) as second:
+                self.assertEqual((first, second), (True, False))
+            self.assertTrue(redis_cache.exists(cache.lock_key(self.key)))
+        self.assertFalse(redis_cache.exists(cache.lock_key(self.key)))
+
+    def test_expired_lock_not_released_by_old_holder(self):
+        with cache.lock(self.key, ttl=0.05) as acquired:
+            self.assertTrue(acquired)
+            time.sleep(0.1)
+            redis_cache.set(cache.lock_key(self.key), 'other')
+        self.assertEqual(redis_cache.get(cache.lock_key(self.key)), b'other')
+
+    def test_single_flight_waits_for_holder(self):
+        build = mock.Mock(return_value='своё')
+        redis_cache.set(cache.lock_key(self.key), 'other')
+        threading.Timer(0.1, lambda: redis_cache.set(self.key, 'ready')).start()
+        value = cache.single_flight(self.key, build, lambda: redis_cache.get(self.key))
+        self.assertEqual(value, b'ready')
+        build.assert_not_called()
+
+    def test_single_flight_gives_up_after_wait(self):
+        redis_cache.set(cache.lock_key(self.key), 'other')
+        started = time.monotonic()
+        value = cache.single_flight(self.key, lambda: 'своё', lambda: None, wait=0.1)
+        self.assertEqual(value, 'своё')
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_cold_key_built_once(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'значение'
+
+        def fetch(index):
+            try:
+                return cache.fetch(self.key, build)
+            finally:
+                connections.close_all()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            values = list(executor.map(fetch, range(8)))
+        self.assertEqual(values, ['значение'] * 8)
+        self.assertEqual(len(calls), 1)
+
+    def test_envelope_records_build_time(self):
+        cache.fetch(self.key, lambda: time.sleep(0.05) or 'значение', ttl=60)
+        envelope = cache.loads(redis_cache.get(self.key))
+        self.assertEqual(envelope['v'], 'значение')
+        self.assertGreaterEqual(envelope['d'], 0.05)
+        self.assertAlmostEqual(envelope['x'], time.time() + 60, delta=1)
+
+    def test_xfetch(self):
+        now = time.time()
+        self.assertFalse(cache.should_refresh({'d': 0.1, 'x': now + 3600}))
+        self.assertTrue(cache.should_refresh({'d': 0.1, 'x': now - 1}))
+        self.assertFalse(cache.should_refresh({'d': 1, 'x': now + 1}, beta=0))
+        # Долгая сборка у истечения почти наверняка обновляется заранее.
+        with mock.patch('random.random', return_value=0.99):
+            self.assertTrue(cache.should_refresh({'d': 10, 'x': now + 5}))
+
+    def test_early_refresh_keeps_serving(self):
+        cache.store(self.key, 'старое', ttl=60)
+        with mock.patch.object(cache, 'should_refresh', return_value=True):
+            self.assertEqual(cache.fetch(self.key, lambda: 'новое'), 'новое')
+            # Пока другой процесс пересобирает ключ, отдаётся старое значение.
+            with cache.lock(self.key):
+                self.assertEqual(cache.fetch(self.key, lambda: 'третье'), 'новое')
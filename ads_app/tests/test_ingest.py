@@ -0,0 +1,203 @@
+from unittest import mock
+from django.urls import reverse
+from ads_app import cache, ingest, pagecache, ratelimit, signals, stats, tasks
+from ads_app.models import Comment
+from ads_app.redis_client import breaker, redis_cache
+from ads_app.tests.base import CacheTestCase, SignalTestCase
+import json
+import redis
+import time
+
+
+@mock.patch.object(ingest, 'RATE_LIMITS', {})
+@mock.patch.object(tasks, 'EAGER', False)
+class CommentBufferTests(SignalTestCase):
+    # Задачи копятся в очереди, буфер записывается вызовом flush().
+
+    def setUp(self):
+        super().setUp()
+        self.advert = self.make_advert(comments=1)
+
+    def post_api(self, **data):
+        return self.client.post(reverse('ads_app:api-advert-comments', args=[self.advert.pk]),
+                                json.dumps(data), content_type='application/json')
+
+    def test_api_comment_goes_to_buffer(self):
+        response = self.post_api(author='Гость', content='Через API')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(redis_cache.llen(ingest.buffer_key(self.advert.pk)), 1)
+        self.assertEqual(Comment.objects.filter(advert=self.advert).count(), 1)
+        self.assertIn(tasks.dump_job('flush_comments', [self.advert.pk]).encode(),
+                      redis_cache.zrange(tasks.PENDING, 0, -1))
+        ingest.flush(self.advert.pk)
+        self.assertEqual(Comment.objects.filter(advert=self.advert).count(), 2)
+        self.assertFalse(redis_cache.exists(ingest.buffer_key(self.advert.pk)))
+
+    def test_api_validates_comment(self):
+        response = self.post_api(author='', content='')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(redis_cache.exists(ingest.buffer_key(self.advert.pk)))
+
+    def test_form_comment_goes_to_buffer(self):
+        response = self.client.post(reverse('ads_app:comment-create', args=[self.advert.pk]),
+                                    {'author': 'Гость', 'content': 'С сайта'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(pagecache.PENDING_COOKIE, response.cookies)
+        # Автор видит свой комментарий до записи в базу.
+        page = self.client.get(reverse('ads_app:advert-detail', args=[self.advert.pk]))
+        self.assertContains(page, 'С сайта')
+        self.assertNotIn('X-Page-Cache', page)
+
+    def test_flush_updates_caches_like_signals(self):
+        self.assertEqual(len(cache.get_comments(self.advert.pk)), 1)
+        self.assertEqual(stats.get(self.advert.pk)['comments'], 1)
+        ingest.add(self.advert.pk, 'Гость', 'Первый')
+        ingest.add(self.advert.pk, 'Гость', 'Второй')
+        with mock.patch.object(signals, 'changed_comments', wraps=signals.changed_comments) as changed, \
+                mock.patch.object(tasks, 'EAGER', True):
+            ingest.flush(self.advert.pk)
+        changed.assert_called_once_with(self.advert.pk)
+        self.assertEqual([row.content for row in cache.get_comments(self.advert.pk)],
+                         ['Комментарий 0', 'Первый', 'Второй'])
+        self.assertEqual(stats.get(self.advert.pk)['comments'], 3)
+
+    def test_flush_purges_pages(self):
+        url = reverse('ads_app:advert-detail', args=[self.advert.pk])
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+        ingest.add(self.advert.pk, 'Гость', 'Новый')
+        ingest.flush(self.advert.pk)
+        page = self.client.get(url)
+        self.assertNotEqual(page.get('X-Page-Cache'), 'hit')
+        self.assertContains(page, 'Новый')
+
+    def test_full_buffer_is_written_by_request(self):
+        with mock.patch.object(ingest, 'FLUSH_SIZE', 3):
+            for index in range(3):
+                ingest.add(self.advert.pk, 'Гость', f'Комментарий {index + 1}')
+        self.assertEqual(Comment.objects.filter(advert=self.advert).count(), 4)
+
+    def test_failed_write_is_retried(self):
+        ingest.add(self.advert.pk, 'Гость', 'Повтор')
+        with mock.patch.object(ingest, 'write', side_effect=RuntimeError('база недоступна')):
+            with self.assertRaises(RuntimeError):
+                ingest.flush(self.advert.pk)
+        self.assertEqual(redis_cache.llen(ingest.flushing_key(self.advert.pk)), 1)
+        ingest.add(self.advert.pk, 'Гость', 'Следующий')
+        ingest.flush(self.advert.pk)
+        self.assertEqual([comment.content for comment in Comment.objects.filter(advert=self.advert).order_by('id')],
+                         ['Комментарий 0', 'Повтор', 'Следующий'])
+
+    def test_retry_after_partial_write(self):
+        # Запись прошла, а упал следующий шаг: повтор не дублирует комментарии.
+        ingest.add(self.advert.pk, 'Гость', 'Один раз')
+        with mock.patch.object(cache, 'comments_key', side_effect=RuntimeError('Redis недоступен')):
+            with self.assertRaises(RuntimeError):
+                ingest.flush(self.advert.pk)
+        self.assertEqual(redis_cache.llen(ingest.flushing_key(self.advert.pk)), 1)
+        ingest.flush(self.advert.pk)
+        self.assertEqual(Comment.objects.filter(advert=self.advert, content='Один раз').count(), 1)
+        self.assertEqual(stats.get(self.advert.pk)['comments'], 2)
+
+    def test_deleted_advert_drops_buffer(self):
+        ingest.add(self.advert.pk, 'Гость', 'Поздно')
+        pk = self.advert.pk
+        self.advert.delete()
+        with self.assertLogs('ads_app.ingest', 'INFO'):
+            ingest.flush(pk)
+        self.assertFalse(redis_cache.exists(ingest.flushing_key(pk)))
+
+    def test_saved_directly_without_buffer(self):
+        with mock.patch.object(ingest, 'BUFFERED', False):
+            token, comment = ingest.add(self.advert.pk, 'Гость', 'Сразу')
+            self.assertIsNone(token)
+            self.assertEqual(comment.content, 'Сразу')
+            response = self.post_api(author='Гость', content='Через API')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Comment.objects.filter(pk=response.json()['id']).exists())
+
+
+class TokenBucketTests(CacheTestCase):
+    # Корзина на 3 токена, наполняется за 30 с: токен раз в 10 с.
+
+    def setUp(self):
+        super().setUp()
+        self.now = time.time()
+        patcher = mock.patch.object(ratelimit.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def hit(self, *buckets):
+        return ratelimit.hit(list(buckets) or [('test', 3, 30)])
+
+    def test_capacity_then_wait(self):
+        self.assertEqual([self.hit() for index in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(self.hit(), 10)
+        self.now += 4
+        self.assertAlmostEqual(self.hit(), 6)
+
+    def test_refill(self):
+        for index in range(3):
+            self.hit()
+        self.now += 10
+        self.assertEqual(self.hit(), 0)
+        self.assertGreater(self.hit(), 0)
+        # Долгий простой наполняет корзину не больше чем до capacity.
+        self.now += 3600
+        self.assertEqual([self.hit() for index in range(3)], [0, 0, 0])
+        self.assertGreater(self.hit(), 0)
+
+    def test_denied_request_costs_nothing(self):
+        for index in range(3):
+            self.hit()
+        self.hit()
+        self.hit()
+        self.now += 10
+        self.assertEqual(self.hit(), 0)
+
+    def test_all_buckets_must_allow(self):
+        self.hit(('small', 1, 10))
+        self.assertGreater(self.hit(('small', 1, 10), ('large', 5, 10)), 0)
+        # Отказ в одной корзине не списал токен из другой.
+        self.assertEqual([self.hit(('large', 5, 10)) for index in range(5)], [0] * 5)
+
+    def test_bucket_expires_when_full(self):
+        self.hit()
+        self.assertEqual(redis_cache.ttl(ratelimit.bucket_key('test')), 31)
+
+    def test_open_without_redis(self):
+        for index in range(3):
+            self.hit()
+        with mock.patch.object(ratelimit, 'HIT_SCRIPT', side_effect=redis.ConnectionError('down')):
+            self.assertEqual(self.hit(), 0)
+        breaker.failures = 0
+
+    def test_no_buckets(self):
+        self.assertEqual(ratelimit.hit([]), 0)
+
+
+@mock.patch.object(ingest, 'RATE_LIMITS', {'ip': (2, 60)})
+@mock.patch.object(tasks, 'EAGER', False)
+class CommentRateLimitTests(SignalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.advert = self.make_advert()
+
+    def test_form_throttled(self):
+        url = reverse('ads_app:comment-create', args=[self.advert.pk])
+        for index in range(2):
+            self.assertEqual(self.client.post(url, {'author': 'Гость', 'content': 'Текст'}).status_code, 302)
+        response = self.client.post(url, {'author': 'Гость', 'content': 'Текст'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(redis_cache.llen(ingest.buffer_key(self.advert.pk)), 2)
+
+    def test_api_throttled_per_address(self):
+        url = reverse('ads_app:api-advert-comments', args=[self.advert.pk])
+        data = json.dumps({'author': 'Гость', 'content': 'Текст'})
+        for index in range(2):
+            self.client.post(url, data, content_type='application/json')
+        self.assertEqual(self.client.post(url, data, content_type='application/json').status_code, 429)
+        response = self.client.post(url, data, content_type='application/json', REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 202)
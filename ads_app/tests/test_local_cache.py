@@ -0,0 +1,107 @@
+from unittest import mock
+from django.test import SimpleTestCase
+from ads_app import cache, local_cache as l1
+from ads_app.local_cache import FLUSH, Listener, LRUCache, key_to_message, message_to_key
+from ads_app.redis_client import redis_cache
+from ads_app.tests.base import CacheTestCase
+import time
+
+
+class LRUCacheTests(SimpleTestCase):
+
+    def test_evicts_least_recently_read(self):
+        lru = LRUCache(maxsize=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        self.assertEqual(lru.info(), {'size': 2, 'maxsize': 2, 'hits': 3, 'misses': 1})
+
+    def test_ttl(self):
+        lru = LRUCache(maxsize=10, ttl=30)
+        with mock.patch.object(l1.time, 'monotonic', return_value=1000):
+            lru.set('a', 1)
+        with mock.patch.object(l1.time, 'monotonic', return_value=1029):
+            self.assertEqual(lru.get('a'), 1)
+        with mock.patch.object(l1.time, 'monotonic', return_value=1031):
+            self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.info()['size'], 0)
+
+    def test_stale_version_not_stored(self):
+        # Значение прочитано из Redis до сброса и могло устареть.
+        lru = LRUCache(maxsize=10, ttl=60)
+        version = lru.version
+        lru.delete('other')
+        lru.set('a', 1, version)
+        self.assertIsNone(lru.get('a'))
+        lru.set('a', 1, lru.version)
+        self.assertEqual(lru.get('a'), 1)
+
+    def test_disabled(self):
+        lru = LRUCache(maxsize=0)
+        lru.set('a', 1)
+        self.assertIsNone(lru.get('a'))
+
+    def test_messages(self):
+        for key in (('advert', 5), ('categories',)):
+            self.assertEqual(message_to_key(key_to_message(key)), key)
+
+    def test_handle(self):
+        lru = LRUCache(maxsize=10, ttl=60)
+        for key in (('advert', 1), ('advert', 2), ('categories',)):
+            lru.set(key, 'x')
+        listener = Listener('channel', lru)
+        listener.handle('advert:1,categories')
+        self.assertEqual(list(lru.data), [('advert', 2)])
+        listener.handle(FLUSH)
+        self.assertEqual(lru.info()['size'], 0)
+
+
+class InvalidationTests(CacheTestCase):
+
+    def wait_for(self, condition, timeout=3):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('Сообщение сброса не дошло')
+            time.sleep(0.02)
+
+    def test_other_process_invalidated(self):
+        # Кеш «другого процесса» со своим подписчиком на тот же канал.
+        other = LRUCache(maxsize=10, ttl=60)
+        listener = Listener(cache.invalidation_channel(), other)
+        with mock.patch.object(l1.os, 'getpid', return_value=-1):
+            listener.ensure_started(redis_cache)
+        # Подписавшись, поток очищает кеш (version растёт второй раз).
+        self.wait_for(lambda: other.version >= 2)
+        other.set(('advert', 1), 'x')
+        other.set(('advert', 2), 'y')
+        cache.publish(('advert', 1))
+        self.wait_for(lambda: other.get(('advert', 1)) is None)
+        self.assertEqual(other.get(('advert', 2)), 'y')
+        cache.publish(FLUSH)
+        self.wait_for(lambda: other.info()['size'] == 0)
+
+    def test_rows_served_from_memory(self):
+        advert = self.make_advert()
+        cache.get_adverts([advert.pk])
+        with mock.patch.object(redis_cache, 'pipeline') as pipeline:
+            self.assertEqual(cache.get_advert(advert.pk).title, 'Велосипед')
+        pipeline.assert_not_called()
+        cache.publish(('advert', advert.pk))
+        self.assertIsNone(cache.local_peek(('advert', advert.pk)))
+
+    def test_categories_served_from_memory(self):
+        self.make_category()
+        cache.get_categories()
+        with self.assertNumQueries(0), mock.patch.object(redis_cache, 'get') as get:
+            self.assertEqual([row.name for row in cache.get_categories()], ['Транспорт'])
+        get.assert_not_called()
+
+    def test_listener_started_once_per_process(self):
+        with mock.patch.object(l1.threading, 'Thread') as thread:
+            listener = Listener('channel', LRUCache())
+            listener.ensure_started(redis_cache)
+            listener.ensure_started(redis_cache)
+        thread.assert_called_once()
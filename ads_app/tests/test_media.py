@@ -0,0 +1,107 @@
+from unittest import mock
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from ads_app import media
+from ads_app.tests.base import CacheTestCase
+import os
+import shutil
+import tempfile
+
+CONTENT = bytes(range(256)) * 4
+
+
+class ParseRangeTests(SimpleTestCase):
+
+    def test_ranges(self):
+        cases = {
+            'bytes=0-99': (0, 99),
+            'bytes=100-': (100, 1023),
+            'bytes=-100': (924, 1023),
+            'bytes=-5000': (0, 1023),
+            'bytes=1000-5000': (1000, 1023),
+            'bytes = 0 - 0': (0, 0),
+            'bytes=1023-1023': (1023, 1023),
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(media.parse_range(header, 1024), expected)
+
+    def test_ignored(self):
+        # Не понятый заголовок — файл целиком.
+        for header in ('bytes=-', 'bytes=0-1,5-9', 'items=0-1', 'bytes=a-b'):
+            with self.subTest(header=header):
+                self.assertIsNone(media.parse_range(header, 1024))
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=1024-', 'bytes=5-1', 'bytes=2000-3000'):
+            with self.subTest(header=header):
+                with self.assertRaises(ValueError):
+                    media.parse_range(header, 1024)
+
+
+class ServeTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(MEDIA_ROOT=root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        os.makedirs(os.path.join(root, 'photos'))
+        for name in ('photos/0123456789abcdef0123.png', 'photos/old.png'):
+            with open(os.path.join(root, name), 'wb') as file:
+                file.write(CONTENT)
+
+    def get(self, name='photos/old.png', **headers):
+        return self.client.get('/media/' + name, **headers)
+
+    def test_full_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        self.assertEqual(response['Content-Length'], '1024')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn(f'max-age={media.MEDIA_MAX_AGE}', response['Cache-Control'])
+
+    def test_range(self):
+        response = self.get(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT[100:200])
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/1024')
+        self.assertEqual(response['Content-Length'], '100')
+        response = self.get(HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), CONTENT[-10:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_conditional(self):
+        response = self.get()
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_immutable(self):
+        response = self.get('photos/0123456789abcdef0123.png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(media.is_immutable('thumbs/abc-card-150.jpg'))
+        self.assertFalse(media.is_immutable('photos/old.png'))
+
+    def test_not_found(self):
+        for name in ('photos/missing.png', 'photos', '../settings.py'):
+            with self.subTest(name=name):
+                with self.assertRaises(Http404):
+                    media.serve(RequestFactory().get('/media/' + name), name)
+        self.assertEqual(self.client.post('/media/photos/old.png').status_code, 405)
+
+    def test_offload(self):
+        with mock.patch.object(media, 'MEDIA_OFFLOAD', 'x-accel-redirect'):
+            response = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/photos/old.png')
+        self.assertEqual(response.content, b'')
+        with mock.patch.object(media, 'MEDIA_OFFLOAD', 'x-sendfile'):
+            response = self.get()
+        self.assertTrue(response['X-Sendfile'].endswith('photos/old.png'))
@@ -0,0 +1,121 @@
+from ads_app import metrics
+from ads_app.redis_client import redis_cache
+from ads_app.tests.base import CacheTestCase
+from ads_app.tests.test_aio import AsyncApplicationTestCase
+from unittest import mock
+import asyncio
+import re
+import redis
+
+
+def timing(header, name):
+    # desc из Server-Timing, например число команд Redis.
+    match = re.search(rf'(?:^|, ){name};dur=[\d.]+(?:;desc="([^"]*)")?', header)
+    return None if match is None else (match.group(1) or '')
+
+
+def counter(name, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    return metrics.registry.counters.get(key, 0)
+
+
+class RequestMetricsTests(CacheTestCase):
+
+    def test_server_timing_header(self):
+        self.make_advert()
+        header = self.client.get('/')['Server-Timing']
+        self.assertIsNotNone(timing(header, 'total'))
+        self.assertNotEqual(timing(header, 'db'), '0')
+        self.assertNotEqual(timing(header, 'redis'), '0')
+        self.assertIn('l2-pagecache;desc="hit 0 miss 1"', header)
+
+    def test_server_timing_names_are_tokens(self):
+        request = metrics.RequestMetrics(False)
+        with metrics.measure(request):
+            metrics.record_cache('l2', 'advert:comments', misses=1)
+        header = metrics.server_timing(request, 0.01)
+        self.assertIn('l2-advert-comments;desc="hit 0 miss 1"', header)
+        self.assertNotIn(':', header)
+
+    def test_counters_exported(self):
+        before = counter('ads_requests_total', view='advert-list', method='GET', status=200)
+        self.client.get('/')
+        self.assertEqual(counter('ads_requests_total', view='advert-list', method='GET', status=200), before + 1)
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('ads_requests_total{method="GET",status="200",view="advert-list"}', body)
+        self.assertIn('ads_request_duration_seconds_bucket{view="advert-list",le="+Inf"}', body)
+
+    def test_export_allowed_ips(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    def test_no_metrics_outside_request(self):
+        self.assertIsNone(metrics.current())
+        metrics.record_cache('l1', 'advert', hits=1)
+
+    def test_only_app_clients_measured(self):
+        other = redis.Redis(connection_pool=redis_cache.connection_pool)
+        with metrics.measure(metrics.RequestMetrics(False)):
+            other.set('metrics:other', 1)
+            redis_cache.get('metrics:other')
+            with redis_cache.pipeline() as pipe:
+                pipe.get('metrics:other').get('metrics:other')
+                pipe.execute()
+            counts = metrics.current().counts
+        self.assertEqual(counts['redis'], 3)
+        self.assertFalse(hasattr(redis.Redis.execute_command, '__wrapped__'))
+
+    def test_template_timed(self):
+        self.make_advert()
+        header = self.client.get('/')['Server-Timing']
+        self.assertIsNotNone(timing(header, 'template'))
+
+    def test_context_per_task(self):
+        async def request(sampled):
+            with metrics.measure(metrics.RequestMetrics(sampled)):
+                await asyncio.sleep(0)
+                metrics.current().add('db', 1.0)
+                await asyncio.sleep(0)
+                return metrics.current()
+
+        async def both():
+            return await asyncio.gather(request(True), request(False))
+        first, second = asyncio.run(both())
+        self.assertEqual((first.sampled, first.counts['db']), (True, 1))
+        self.assertEqual((second.sampled, second.counts['db']), (False, 1))
+        self.assertIsNone(metrics.current())
+
+
+class AsyncMetricsTests(AsyncApplicationTestCase):
+
+    def test_server_timing_on_async_routes(self):
+        for path in ('/', f'/id{self.advert.pk}', f'/id{self.advert.pk}/stats', '/stats'):
+            with self.subTest(path=path):
+                status, headers, body = self.get(path, f'ids={self.advert.pk}')
+                self.assertEqual(status, 200)
+                self.assertIsNotNone(timing(headers['server-timing'], 'total'))
+
+    def test_pool_queries_counted(self):
+        # Холодный кеш: объявления читаются из базы в потоке пула.
+        header = self.get('/')[1]['server-timing']
+        self.assertNotIn(timing(header, 'db'), (None, '0'))
+        self.assertNotIn(timing(header, 'redis'), (None, '0'))
+        self.assertIn('l2-pagecache;desc="hit 0 miss 1"', header)
+
+    def test_async_redis_counted(self):
+        self.get('/')
+        header = self.get('/')[1]['server-timing']
+        self.assertIsNone(timing(header, 'db'))
+        self.assertEqual(timing(header, 'redis'), '1')
+        self.assertIn('l2-pagecache;desc="hit 1 miss 0"', header)
+
+    def test_counters_published(self):
+        labels = dict(view='advert-stats', method='GET', status=200)
+        before = counter('ads_requests_total', **labels)
+        self.get(f'/id{self.advert.pk}/stats')
+        self.assertEqual(counter('ads_requests_total', **labels), before + 1)
+
+    def test_metrics_disabled(self):
+        with mock.patch.object(metrics, 'ENABLED', False):
+            headers = self.get('/')[1]
+        self.assertNotIn('server-timing', headers)
+        self.assertIsNone(metrics.current())
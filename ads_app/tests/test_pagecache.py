@@ -0,0 +1,103 @@
+from unittest import mock
+from django.test import RequestFactory
+from django.http import HttpResponse
+from ads_app import cache, pagecache, stats
+from ads_app.models import Comment
+from ads_app.redis_client import redis_cache
+from ads_app.tests.base import CacheTestCase, SignalTestCase
+
+
+class PageCacheTests(SignalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.advert = self.make_advert(tags=['bike'], comments=1)
+
+    def get(self, path, **extra):
+        return self.client.get(path, **extra)
+
+    def test_anonymous_pages_cached(self):
+        for path in ('/', f'/id{self.advert.pk}', '/?tags=bike'):
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path)['X-Page-Cache'], 'miss')
+                with self.assertNumQueries(0):
+                    response = self.get(path)
+                self.assertEqual(response['X-Page-Cache'], 'hit')
+                self.assertContains(response, 'Велосипед')
+
+    def test_bypassed_requests(self):
+        self.get('/')
+        self.client.force_login(self.make_user())
+        self.assertNotIn('X-Page-Cache', self.get('/'))
+        self.client.logout()
+        self.client.cookies[pagecache.PENDING_COOKIE] = 'x'
+        self.assertNotIn('X-Page-Cache', self.get('/'))
+
+    def test_csrf_fragments_rendered_per_request(self):
+        self.get(f'/id{self.advert.pk}')
+        stored = cache.loads(redis_cache.get(pagecache.page_key(RequestFactory().get(f'/id{self.advert.pk}'))))
+        self.assertNotIn('csrfmiddlewaretoken', stored['content'])
+        self.assertIn('<!--nocache:', stored['content'])
+        response = self.get(f'/id{self.advert.pk}')
+        self.assertEqual(response['X-Page-Cache'], 'hit')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_writes_purge_pages(self):
+        detail = f'/id{self.advert.pk}'
+        for path in ('/', detail):
+            self.get(path)
+        Comment.objects.create(advert=self.advert, author='Гость', content='Свежий комментарий')
+        response = self.get(detail)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Свежий комментарий')
+        self.assertEqual(self.get('/')['X-Page-Cache'], 'miss')
+        self.make_advert(title='Самокат')
+        self.assertContains(self.get('/'), 'Самокат')
+
+    def test_cached_detail_counts_views(self):
+        detail = f'/id{self.advert.pk}'
+        self.get(detail)
+        self.get(detail)
+        stats.flush_views()
+        self.assertEqual(redis_cache.zscore(stats.VIEWS_KEY, self.advert.pk), 2)
+
+
+class StoreTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.key = pagecache.make_key('pagecache', 'page', 'test')
+        self.response = HttpResponse('<p>страница</p>', content_type='text/html; charset=utf-8')
+
+    def test_purge_during_render_skips_store(self):
+        # Страница начала собираться до сброса тега и устарела.
+        epoch = pagecache._lookup(self.key)[1]
+        pagecache.purge('head')
+        self.assertFalse(pagecache._store(self.key, epoch, self.response, ['head']))
+        self.assertIsNone(redis_cache.get(self.key))
+
+    def test_purge_by_tag(self):
+        epoch = pagecache._lookup(self.key)[1]
+        self.assertTrue(pagecache._store(self.key, epoch, self.response, ['advert:1', 'head']))
+        pagecache.purge_adverts([2])
+        self.assertIsNotNone(redis_cache.get(self.key))
+        pagecache.purge_adverts([1])
+        self.assertIsNone(redis_cache.get(self.key))
+        self.assertFalse(redis_cache.exists(pagecache.tag_key('advert:1')))
+
+
+class CardCacheTests(CacheTestCase):
+
+    def test_cards_cached_by_content(self):
+        advert = self.make_advert()
+        row = cache.get_advert(advert.pk)
+        html = pagecache.render_cards([row])
+        self.assertIn('Велосипед', html)
+        self.assertTrue(redis_cache.exists(pagecache.card_key(row)))
+        with mock.patch.object(pagecache, 'render_to_string') as render:
+            self.assertEqual(pagecache.render_cards([row]), html)
+        render.assert_not_called()
+        changed = cache.make_row(dict(row, title='Самокат'))
+        self.assertNotEqual(pagecache.card_key(changed), pagecache.card_key(row))
+        self.assertIn('Самокат', pagecache.render_cards([changed]))
+        self.assertEqual(pagecache.render_cards([]), '')
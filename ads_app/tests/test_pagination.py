@@ -0,0 +1,122 @@
+from datetime import timedelta
+from django.utils import timezone
+from ads_app import pagination
+from ads_app.models import Advert
+from ads_app.redis_client import redis_cache
+from ads_app.tests.base import CacheTestCase
+
+
+class CursorPaginationTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.ids = []
+        for index in range(7):
+            advert = self.make_advert(title=f'Объявление {index}')
+            Advert.objects.filter(pk=advert.pk).update(created=now - timedelta(minutes=index))
+            self.ids.append(advert.pk)
+
+    def walk(self, size):
+        pages, token = [], None
+        while True:
+            page = pagination.get_page(token, size)
+            pages.append(page)
+            token = page['next']
+            if token is None:
+                return pages
+
+    def test_forward_walk(self):
+        pages = self.walk(3)
+        self.assertEqual([page['ids'] for page in pages], [self.ids[0:3], self.ids[3:6], self.ids[6:]])
+        self.assertIsNone(pages[0]['prev'])
+        self.assertIsNotNone(pages[-1]['prev'])
+
+    def test_backward_walk(self):
+        pages = self.walk(3)
+        page = pages[-1]
+        back = []
+        while page['prev']:
+            page = pagination.get_page(page['prev'], 3)
+            back.append(page['ids'])
+        self.assertEqual(back, [self.ids[3:6], self.ids[0:3]])
+        self.assertIsNone(page['prev'])
+        self.assertIsNotNone(page['next'])
+
+    def test_exact_multiple_has_no_empty_page(self):
+        Advert.objects.filter(pk=self.ids[-1]).delete()
+        pages = self.walk(3)
+        self.assertEqual([page['ids'] for page in pages], [self.ids[0:3], self.ids[3:6]])
+
+    def test_equal_timestamps_ordered_by_id(self):
+        Advert.objects.update(created=timezone.now())
+        ids = sorted(self.ids, reverse=True)
+        pages = self.walk(2)
+        self.assertEqual(sum((page['ids'] for page in pages), []), ids)
+        self.assertEqual(pagination.get_page(pages[2]['prev'], 2)['ids'], ids[2:4])
+
+    def test_new_advert_does_not_shift_pages(self):
+        first = pagination.get_page(None, 3)
+        self.make_advert(title='Новое')
+        pagination.invalidate_head()
+        self.assertEqual(pagination.get_page(first['next'], 3)['ids'], self.ids[3:6])
+        self.assertEqual(len(pagination.get_page(None, 3)['ids']), 3)
+
+    def test_bad_cursor_gives_first_page(self):
+        for token in ('мусор', 'eDox', pagination.Cursor('x', timezone.now(), 1).encode(), ''):
+            with self.subTest(token=token):
+                self.assertEqual(pagination.get_page(token or None, 3)['ids'], self.ids[0:3])
+        self.assertIsNone(pagination.Cursor.decode('eDox'))
+
+    def test_cursor_roundtrip(self):
+        cursor = pagination.Cursor(pagination.NEXT, timezone.now(), 42)
+        decoded = pagination.Cursor.decode(cursor.encode())
+        self.assertEqual((decoded.direction, decoded.pk), (pagination.NEXT, 42))
+        self.assertEqual(decoded.key_part(), cursor.key_part())
+
+    def test_page_size_clamped(self):
+        self.assertEqual(pagination.page_size('0'), 1)
+        self.assertEqual(pagination.page_size('1000'), pagination.MAX_PAGE_SIZE)
+        self.assertEqual(pagination.page_size('x'), pagination.PAGE_SIZE)
+        self.assertEqual(pagination.page_size(None), pagination.PAGE_SIZE)
+
+    def test_empty_feed(self):
+        Advert.objects.all().delete()
+        self.assertEqual(pagination.get_page(None, 3), {'ids': [], 'next': None, 'prev': None})
+
+    def test_pages_cached_and_invalidated(self):
+        pages = self.walk(3)
+        with self.assertNumQueries(0):
+            self.assertEqual(pagination.get_page(pages[0]['next'], 3), pages[1])
+        pagination.invalidate_head()
+        self.assertFalse(redis_cache.exists(pagination.page_key(None, 3)))
+        cursor = pagination.Cursor.decode(pages[0]['next'])
+        self.assertTrue(redis_cache.exists(pagination.page_key(cursor, 3)))
+        pagination.invalidate_all()
+        self.assertFalse(redis_cache.exists(pagination.page_key(cursor, 3)))
+
+    def test_list_view_links(self):
+        response = self.client.get('/', {'size': 3})
+        self.assertEqual([advert.id for advert in response.context['advert_list']], self.ids[0:3])
+        self.assertIsNone(response.context['prev_url'])
+        response = self.client.get(response.context['next_url'])
+        self.assertEqual([advert.id for advert in response.context['advert_list']], self.ids[3:6])
+        self.assertIn('size=3', response.context['prev_url'])
+
+
+class PaginateIdsTests(CacheTestCase):
+
+    def test_slices_ordered_ids(self):
+        ids = [9, 7, 5, 3, 1]
+        first = pagination.paginate_ids(ids, None, 2)
+        self.assertEqual((first['ids'], first['prev']), ([9, 7], None))
+        second = pagination.paginate_ids(ids, first['next'], 2)
+        self.assertEqual(second['ids'], [5, 3])
+        last = pagination.paginate_ids(ids, second['next'], 2)
+        self.assertEqual((last['ids'], last['next']), ([1], None))
+        self.assertEqual(pagination.paginate_ids(ids, last['prev'], 2)['ids'], [5, 3])
+
+    def test_vanished_cursor_restarts(self):
+        page = pagination.paginate_ids([9, 7, 5], None, 2)
+        self.assertEqual(pagination.paginate_ids([9, 5], page['next'], 2)['ids'], [9, 5])
+        self.assertEqual(pagination.paginate_ids([], None, 2), {'ids': [], 'next': None, 'prev': None})
@@ -0,0 +1,36 @@
+from ads_app.querycount import QUERY_BUDGETS, QueryBudgetExceeded, budget_urls, query_budget
+from ads_app.tests.base import CacheTestCase
+
+
+class QueryBudgetTests(CacheTestCase):
+    # Те же бюджеты, что проверяет manage.py check_query_budgets.
+
+    def setUp(self):
+        super().setUp()
+        category = self.make_category()
+        for index in range(15):
+            self.make_advert(title=f'Велосипед {index}', tags=['bike', 'sport'], comments=3, category=category)
+        self.advert = self.make_advert(title='Велосипед горный', tags=['bike'], comments=5, category=category)
+
+    def test_pages_fit_budget(self):
+        for name, url in budget_urls(self.advert).items():
+            for attempt, limit in zip(('first', 'repeat'), QUERY_BUDGETS[name]):
+                with self.subTest(page=name, attempt=attempt):
+                    with query_budget(limit, f'{name} ({attempt}) {url}'):
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+
+    def test_budget_does_not_grow_with_page(self):
+        # Страница с вдвое большим числом объявлений и комментариев.
+        for index in range(15):
+            self.make_advert(title=f'Самокат {index}', tags=['bike'], comments=6)
+        url = budget_urls(self.advert)['advert-list']
+        with query_budget(QUERY_BUDGETS['advert-list'][0]):
+            self.client.get(url + '?size=30')
+
+    def test_exceeded_budget_lists_queries(self):
+        with self.assertRaises(QueryBudgetExceeded) as error:
+            with query_budget(0, 'list'):
+                self.client.get(budget_urls(self.advert)['advert-list'])
+        self.assertIn('list:', str(error.exception))
+        self.assertIn('1. ', str(error.exception))
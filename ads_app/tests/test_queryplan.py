@@ -0,0 +1,111 @@
+from datetime import datetime, timezone
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from ads_app import queryplan, repository
+from ads_app.tests.base import MongoTestCase
+
+NOW = datetime(2020, 5, 1, 12, tzinfo=timezone.utc)
+
+
+class SyncIndexesTests(MongoTestCase):
+
+    def indexes(self, collection):
+        return set(self.db[collection].index_information())
+
+    def test_creates_missing_and_is_idempotent(self):
+        actions = repository.sync_indexes()
+        self.assertTrue(all(action == 'создан' for collection, name, action in actions))
+        self.assertIn('ads_created', self.indexes(repository.ADVERTS))
+        self.assertTrue(all(action == 'есть' for collection, name, action in repository.sync_indexes()))
+
+    def test_same_keys_under_other_name(self):
+        # Индекс djongo по тем же полям второй раз не создаётся.
+        self.db[repository.COMMENTS].create_index([('advert_id', 1), ('id', 1)], name='djongo_advert')
+        actions = {(collection, name): action for collection, name, action in repository.sync_indexes()}
+        self.assertEqual(actions[repository.COMMENTS, 'djongo_advert'], 'есть')
+        self.assertNotIn('ads_advert', self.indexes(repository.COMMENTS))
+
+    def test_changed_keys_recreated(self):
+        self.db[repository.TAGS].create_index([('name', 1)], name='ads_name')
+        actions = {(collection, name): action for collection, name, action in repository.sync_indexes()}
+        self.assertEqual(actions[repository.TAGS, 'ads_name'], 'пересоздан')
+        info = self.db[repository.TAGS].index_information()['ads_name']
+        self.assertEqual(repository.index_keys(info), [('name', 1), ('advert_id', 1)])
+
+    def test_prune_only_own(self):
+        self.db[repository.ADVERTS].create_index([('title', 1)], name='ads_title')
+        self.db[repository.ADVERTS].create_index([('content', 1)], name='djongo_content')
+        repository.sync_indexes()
+        self.assertIn('ads_title', self.indexes(repository.ADVERTS))
+        actions = repository.sync_indexes(prune=True)
+        self.assertIn((repository.ADVERTS, 'ads_title', 'удалён'), actions)
+        self.assertNotIn('ads_title', self.indexes(repository.ADVERTS))
+        self.assertIn('djongo_content', self.indexes(repository.ADVERTS))
+
+    def test_dry_run(self):
+        actions = repository.sync_indexes(dry_run=True)
+        self.assertIn((repository.ADVERTS, 'ads_created', 'создан'), actions)
+        self.assertNotIn('ads_created', self.indexes(repository.ADVERTS))
+
+
+class QueryPlanTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.insert_advert(1, NOW, category_id=1, author_id=1)
+
+    def test_hot_queries_use_indexes(self):
+        repository.sync_indexes()
+        results = queryplan.check(self.db)
+        self.assertEqual([name for name, indexes, error in results if error], [])
+        plans = {name: indexes for name, indexes, error in results}
+        self.assertEqual(plans['все id'], ['ads_created'])
+        self.assertIn('ads_advert', plans['ранние комментарии'])
+
+    def test_missing_index_reported(self):
+        repository.sync_indexes()
+        self.db[repository.USERS].drop_index('ads_id')
+        failed = [name for name, indexes, error in queryplan.check(self.db) if error]
+        self.assertEqual(failed, ['автор'])
+
+    def test_every_or_branch_needs_index(self):
+        self.db[repository.ADVERTS].create_index([('created', -1)], name='created')
+        query, sort = repository.page_query(before=(NOW, 1))
+        self.assertEqual(queryplan.match_indexes(self.db[repository.ADVERTS], query, sort), ['created'])
+        with self.assertRaises(queryplan.CollectionScan):
+            queryplan.match_indexes(self.db[repository.ADVERTS], {'$or': [{'created': NOW}, {'title': 'x'}]}, None)
+
+    def test_sort_served_in_reverse(self):
+        keys = [('created', -1), ('id', -1)]
+        self.assertTrue(queryplan.serves_sort(keys, [('created', 1), ('id', 1)]))
+        self.assertFalse(queryplan.serves_sort(keys, [('created', 1), ('id', -1)]))
+        self.assertFalse(queryplan.serves_sort(keys, [('id', -1)]))
+        self.assertFalse(queryplan.serves_sort(keys, None))
+
+    def test_explain_plan(self):
+        # Настоящий mongod отдаёт план в explain().
+        cursor = mock.Mock()
+        cursor.sort.return_value = cursor
+        collection = mock.Mock()
+        collection.find.return_value = cursor
+        cursor.explain.return_value = {'queryPlanner': {'winningPlan': {
+            'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'ads_created'}}}}
+        self.assertEqual(queryplan.explain(collection, {}, [('created', -1)]), ['ads_created'])
+        cursor.explain.return_value = {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}}}
+        with self.assertRaises(queryplan.CollectionScan):
+            queryplan.explain(collection, {}, None)
+
+    def test_command(self):
+        with self.assertRaises(CommandError):
+            call_command('check_query_plans', stdout=StringIO())
+        call_command('sync_indexes', stdout=StringIO())
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('ads_created', out.getvalue())
+
+    def test_command_without_adverts(self):
+        self.db[repository.ADVERTS].delete_many({})
+        with self.assertRaisesMessage(CommandError, 'нет объявлений'):
+            call_command('check_query_plans', stdout=StringIO())
@@ -0,0 +1,110 @@
+from contextlib import contextmanager
+from unittest import mock
+from ads_app import cache, redis_client
+from ads_app.redis_client import CircuitBreaker, breaker, fallback, guarded, redis_cache
+from ads_app.tests import server
+from ads_app.tests.base import CacheTestCase
+
+
+@contextmanager
+def redis_down():
+    server.connected = False
+    try:
+        yield
+    finally:
+        server.connected = True
+
+
+class BreakerTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.read = fallback(lambda key: 'база')(lambda key: redis_cache.get(key) or 'кеш')
+        self.write = guarded(lambda key: redis_cache.set(key, 1))
+
+    def tearDown(self):
+        # Ошибки здесь ожидаемы; проверка RedisMixin не для этих тестов.
+        breaker.failures = 0
+        breaker.opened_at = None
+        super().tearDown()
+
+    def test_read_falls_back_to_database(self):
+        with redis_down():
+            self.assertEqual(self.read('key'), 'база')
+        self.assertEqual(breaker.failures, 1)
+        self.assertFalse(breaker.is_open())
+        self.assertEqual(self.read('key'), 'кеш')
+        self.assertEqual(breaker.failures, 0)
+
+    def test_circuit_opens_after_threshold(self):
+        with redis_down():
+            for attempt in range(breaker.threshold):
+                self.read('key')
+        self.assertTrue(breaker.is_open())
+        with mock.patch.object(redis_cache, 'get') as get:
+            self.assertEqual(self.read('key'), 'база')
+        get.assert_not_called()
+
+    def test_retry_after_cooldown(self):
+        with redis_down():
+            for attempt in range(breaker.threshold):
+                self.read('key')
+        breaker.opened_at -= breaker.cooldown
+        self.assertEqual(self.read('key'), 'кеш')
+        self.assertIsNone(breaker.opened_at)
+
+    def test_lost_write_flushes_namespace_on_recovery(self):
+        # Пропущенная запись могла оставить устаревший ключ.
+        redis_cache.set(cache.make_key('stale'), 1)
+        redis_cache.set('ads:views', 1)
+        with redis_down():
+            self.assertIsNone(self.write(cache.make_key('fresh')))
+        self.assertTrue(breaker.dirty)
+        self.assertEqual(self.read('key'), 'кеш')
+        self.assertFalse(breaker.dirty)
+        self.assertFalse(redis_cache.exists(cache.make_key('stale')))
+        self.assertTrue(redis_cache.exists('ads:views'))
+
+    def test_write_skipped_while_open(self):
+        breaker.opened_at = redis_client.time.monotonic()
+        breaker.failures = breaker.threshold
+        self.assertIsNone(self.write('key'))
+        self.assertFalse(redis_cache.exists('key'))
+        self.assertTrue(breaker.dirty)
+        breaker.dirty = False
+
+    def test_pages_served_without_redis(self):
+        advert = self.make_advert(tags=['bike'], comments=2)
+        with redis_down():
+            for path in ('/', f'/id{advert.pk}', '/?tags=bike', '/?q=велосипед', f'/id{advert.pk}/stats'):
+                with self.subTest(path=path):
+                    self.assertEqual(self.client.get(path).status_code, 200)
+        self.assertTrue(breaker.is_open())
+
+
+class CircuitBreakerTests(CacheTestCase):
+
+    def test_threshold_and_cooldown(self):
+        circuit = CircuitBreaker(threshold=2, cooldown=10)
+        circuit.failure(Exception())
+        self.assertFalse(circuit.is_open())
+        with self.assertLogs('ads_app.redis_client', 'WARNING'):
+            circuit.failure(Exception())
+        self.assertTrue(circuit.is_open())
+        circuit.opened_at -= 10
+        self.assertFalse(circuit.is_open())
+
+    def test_recover_only_when_dirty(self):
+        circuit = CircuitBreaker()
+        circuit.on_recover = mock.Mock()
+        circuit.failure(Exception())
+        self.assertFalse(circuit.success())
+        circuit.failure(Exception(), lost_write=True)
+        with self.assertLogs('ads_app.redis_client', 'WARNING'):
+            self.assertTrue(circuit.success())
+        circuit.on_recover.assert_called_once_with()
+
+    def test_pool_is_bounded(self):
+        self.assertEqual(redis_client.pool.max_connections, 50)
+        self.assertEqual(redis_client.pool.connection_kwargs['socket_timeout'], 0.5)
+        self.assertEqual(redis_client.pool.timeout, 1)
@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from ads_app import repository
+from ads_app.tests.base import MongoTestCase
+
+NOW = datetime(2020, 5, 1, 12, tzinfo=timezone.utc)
+
+
+class RepositoryTests(MongoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db[repository.CATEGORIES].insert_one({'id': 1, 'name': 'Транспорт'})
+        self.db[repository.USERS].insert_one({'id': 7, 'username': 'user', 'password': 'x'})
+        self.insert_advert(1, NOW - timedelta(hours=2), category_id=1, author_id=7)
+        self.insert_advert(2, NOW - timedelta(hours=1))
+        self.insert_advert(3, NOW - timedelta(hours=1))
+        self.insert_advert(4, NOW)
+        self.db[repository.TAGS].insert_many([
+            {'id': 11, 'name': 'red', 'advert_id': 1},
+            {'id': 10, 'name': 'bike', 'advert_id': 1},
+            {'id': 12, 'name': 'bike', 'advert_id': 2},
+        ])
+        self.insert_comments(1, [21, 22, 23], NOW)
+        self.insert_comments(2, [24], NOW)
+
+    def test_adverts_joined(self):
+        rows = {row['id']: row for row in repository.adverts([1, 2, 999])}
+        self.assertEqual(sorted(rows), [1, 2])
+        self.assertEqual(rows[1]['tags'], ['bike', 'red'])
+        self.assertEqual((rows[1]['category_name'], rows[1]['author_name']), ('Транспорт', 'user'))
+        self.assertEqual((rows[2]['category_name'], rows[2]['author_name']), (None, None))
+        self.assertEqual(rows[1]['photo_url'], '')
+        self.assertNotIn('_id', rows[1])
+        self.assertNotIn('comment_count', rows[1])
+        self.assertEqual(repository.adverts([]), [])
+
+    def test_adverts_with_counts(self):
+        rows = {row['id']: row['comment_count'] for row in repository.adverts([1, 2, 3], counts=True)}
+        self.assertEqual(rows, {1: 3, 2: 1, 3: 0})
+
+    def test_feed_order(self):
+        # Одинаковое время — по убыванию id, как в ORM.
+        self.assertEqual(repository.advert_ids(), [4, 3, 2, 1])
+        self.assertEqual([pk for pk, created in repository.page(2)], [4, 3])
+        self.assertEqual([pk for pk, created in repository.page(2, before=(NOW - timedelta(hours=1), 3))], [2, 1])
+        self.assertEqual([pk for pk, created in repository.page(2, after=(NOW - timedelta(hours=1), 2))], [3, 4])
+
+    def test_comments(self):
+        self.assertEqual([row['id'] for row in repository.comments(1)], [21, 22, 23])
+        self.assertEqual([row['id'] for row in repository.comments_many([2, 1])], [21, 22, 23, 24])
+        self.assertEqual([row['id'] for row in repository.older_comments(1, 23, 1)], [22])
+        self.assertEqual([row['id'] for row in repository.older_comments(1, 23, 5)], [21, 22])
+        self.assertEqual(set(repository.comments(2)[0]), set(repository.COMMENT_FIELDS))
+
+    def test_counts(self):
+        self.assertEqual(repository.counts([1, 2, 999]), {1: {'tags': 2, 'comments': 3},
+                                                          2: {'tags': 1, 'comments': 1}})
+        self.assertEqual(len(repository.counts()), 4)
+        self.assertEqual(repository.counts([999]), {})
+        self.assertEqual(repository.comment_counts([]), {})
+
+    def test_reserve_ids(self):
+        schema = self.db[repository.SCHEMA]
+        schema.insert_one({'name': repository.COMMENTS, 'auto': {'seq': 24}})
+        self.assertEqual(list(repository.reserve_ids(repository.COMMENTS, 3)), [25, 26, 27])
+        # Явно занятый id счётчик не повторит.
+        self.assertEqual(list(repository.reserve_ids(repository.COMMENTS, 1, at_least=40)), [41])
+        self.assertEqual(list(repository.reserve_ids(repository.COMMENTS, 1, at_least=10)), [42])
+        with self.assertRaises(LookupError):
+            repository.reserve_ids('missing', 1)
+
+
+@mock.patch.object(repository, 'EMBEDDED_COMMENTS', 2)
+class EmbeddedCommentsTests(MongoTestCase):
+    # В документе объявления — копии двух последних комментариев.
+
+    def setUp(self):
+        super().setUp()
+        self.insert_advert(1, NOW)
+        self.insert_comments(1, [21, 22, 23], NOW)
+
+    def document(self):
+        return self.db[repository.ADVERTS].find_one({'id': 1})
+
+    def recent_ids(self):
+        return [comment['id'] for comment in self.document()['recent_comments']]
+
+    def comment(self, pk):
+        return {'id': pk, 'author': 'Гость', 'content': f'Комментарий {pk}', 'created': NOW,
+                'updated': NOW, 'advert_id': 1}
+
+    def test_embed(self):
+        recent, count = repository.embed_comments(1)
+        self.assertEqual(([comment['id'] for comment in recent], count), ([22, 23], 3))
+        self.assertEqual((self.recent_ids(), self.document()['comment_count']), ([22, 23], 3))
+
+    def test_recent_comments_embeds_lazily(self):
+        self.assertEqual([comment['id'] for comment in repository.recent_comments(1)], [22, 23])
+        self.assertEqual(self.document()['comment_count'], 3)
+        self.assertEqual(repository.recent_comments(999), [])
+
+    def test_push_keeps_last(self):
+        repository.embed_comments(1)
+        self.db[repository.COMMENTS].insert_one(self.comment(24))
+        repository.push_comment(self.comment(24))
+        self.assertEqual((self.recent_ids(), self.document()['comment_count']), ([23, 24], 4))
+
+    def test_push_to_document_without_copies_embeds_all(self):
+        self.db[repository.COMMENTS].insert_one(self.comment(24))
+        repository.push_comment(self.comment(24))
+        self.assertEqual((self.recent_ids(), self.document()['comment_count']), ([23, 24], 4))
+
+    def test_pull_refills_from_older(self):
+        repository.embed_comments(1)
+        self.db[repository.COMMENTS].delete_one({'id': 23})
+        repository.pull_comment(1, 23)
+        self.assertEqual((self.recent_ids(), self.document()['comment_count']), ([21, 22], 2))
+
+    def test_update_only_recent(self):
+        repository.embed_comments(1)
+        repository.update_comment(dict(self.comment(23), content='Исправлено'))
+        repository.update_comment(dict(self.comment(21), content='Не в копиях'))
+        contents = [comment['content'] for comment in self.document()['recent_comments']]
+        self.assertEqual(contents, ['Комментарий 22', 'Исправлено'])
+
+    def test_insert_comments_batch(self):
+        repository.embed_comments(1)
+        self.db[repository.SCHEMA].insert_one({'name': repository.COMMENTS, 'auto': {'seq': 23}})
+        rows = [self.comment(None), self.comment(None)]
+        repository.insert_comments(1, rows, ['a', 'b'])
+        self.assertEqual([row['id'] for row in rows], [24, 25])
+        self.assertEqual(self.db[repository.COMMENTS].count_documents({'advert_id': 1}), 5)
+        self.assertEqual(repository.comment_tokens(1, ['b', 'c']), {'b'})
+        self.assertEqual((self.recent_ids(), self.document()['comment_count']), ([24, 25], 5))
+
+    def test_detail_in_one_read(self):
+        repository.embed_comments(1)
+        row, = repository.adverts([1], comments=True)
+        self.assertEqual(([comment['id'] for comment in row['recent_comments']], row['comment_count']), ([22, 23], 3))
+        with mock.patch.object(repository, 'embed_comments') as embed, \
+                mock.patch.object(repository, 'comment_counts') as counts:
+            repository.adverts([1], counts=True, comments=True)
+        embed.assert_not_called()
+        counts.assert_called_once_with([])
@@ -0,0 +1,75 @@
+from datetime import timedelta
+from unittest import mock
+from django.utils import timezone
+from ads_app import cache, search
+from ads_app.models import Advert
+from ads_app.tests.base import CacheTestCase
+
+
+class StemTests(CacheTestCase):
+
+    def test_word_forms_share_stem(self):
+        self.assertEqual(search.stem('велосипеды'), search.stem('велосипед'))
+        self.assertEqual(search.stem('машины'), search.stem('машина'))
+
+    def test_tokenize_normalizes_case_and_yo(self):
+        self.assertEqual(search.tokenize('ЁЛКА Ёлки'), search.tokenize('елка елки'))
+
+
+class SearchTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.transport = self.make_category('Транспорт')
+        self.home = self.make_category('Дом')
+        self.bike = self.make_advert(title='Горный велосипед', content='Рама алюминий', category=self.transport)
+        self.car = self.make_advert(title='Машина', content='Велосипед в подарок', category=self.transport)
+        self.sofa = self.make_advert(title='Диван', content='Раскладной', category=self.home, tags=['мебель'])
+        for age, advert in enumerate((self.sofa, self.car, self.bike)):
+            Advert.objects.filter(pk=advert.pk).update(created=now - timedelta(hours=age))
+
+    def test_title_ranks_above_content(self):
+        self.assertEqual(search.search('велосипеды'), [self.bike.pk, self.car.pk])
+
+    def test_all_words_required(self):
+        self.assertEqual(search.search('велосипед рама'), [self.bike.pk])
+        self.assertEqual(search.search('велосипед диван'), [])
+
+    def test_prefix(self):
+        self.assertEqual(search.search('раскл*'), [self.sofa.pk])
+        self.assertEqual(search.search('нет*'), [])
+
+    def test_tags_are_searched(self):
+        self.assertEqual(search.search('мебель'), [self.sofa.pk])
+
+    def test_category_filter(self):
+        self.assertEqual(search.search('велосипед', self.home.pk), [])
+        self.assertEqual(search.search('велосипед', str(self.transport.pk)), [self.bike.pk, self.car.pk])
+
+    def test_category_only_in_feed_order(self):
+        self.assertEqual(search.search('', self.transport.pk), [self.car.pk, self.bike.pk])
+        self.assertEqual(search.search('', '0'), [self.sofa.pk, self.car.pk, self.bike.pk])
+
+    def test_category_only_does_not_read_whole_index(self):
+        cache.get_advert_ids()
+        search.ensure_index()
+        with mock.patch.object(search, 'get_advert_ids', side_effect=AssertionError('полный индекс')), \
+                mock.patch.object(cache, 'get_advert_ids', side_effect=AssertionError('полный индекс')):
+            self.assertEqual(search.search('', self.home.pk), [self.sofa.pk])
+
+    def test_database_fallback_matches(self):
+        for query, category in (('велосипед', None), ('велосипед', self.home.pk), ('', self.transport.pk)):
+            with self.subTest(query=query, category=category):
+                self.assertEqual(set(search.search_db(query, category)), set(search.search(query, category)))
+
+    def test_reindex_after_change(self):
+        search.ensure_index()
+        self.sofa.title = 'Велосипед детский'
+        self.sofa.category = self.transport
+        self.sofa.save()
+        search.index_advert(self.sofa)
+        self.assertEqual(search.search('велосипед')[0], self.sofa.pk)
+        self.assertEqual(search.search('', self.home.pk), [])
+        search.remove_advert(self.sofa.pk)
+        self.assertNotIn(self.sofa.pk, search.search('велосипед'))
@@ -0,0 +1,83 @@
+from unittest import mock, skipIf
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase
+from ads_app import cache, serialization
+from ads_app.redis_client import redis_cache
+from ads_app.serialization import Serializer
+from ads_app.tests.base import CacheTestCase
+
+VALUE = {'id': 1, 'title': 'Велосипед', 'tags': ['bike'], 'price': 1.5, 'photo': None}
+
+
+class SerializerTests(SimpleTestCase):
+
+    def test_roundtrip(self):
+        for codec in serialization.CODECS:
+            with self.subTest(codec=codec):
+                serializer = Serializer(codec)
+                self.assertEqual(serializer.loads(serializer.dumps(VALUE)), VALUE)
+
+    def test_header(self):
+        data = Serializer('json', version=3).dumps(VALUE)
+        self.assertEqual(serialization.HEADER.unpack_from(data), (b'j', 3, 0))
+
+    def test_version_mismatch_is_miss(self):
+        data = Serializer('json', version=1).dumps(VALUE)
+        self.assertIsNone(Serializer('json', version=2).loads(data))
+        # Версия хранится в байте: 257 и 1 совпадают.
+        self.assertEqual(Serializer('json', version=257).loads(data), VALUE)
+
+    def test_other_codec_readable(self):
+        data = Serializer('json').dumps(VALUE)
+        self.assertEqual(Serializer(next(iter(reversed(serialization.CODECS)))).loads(data), VALUE)
+
+    def test_garbage_is_miss(self):
+        serializer = Serializer('json')
+        for data in (None, b'', b'j', b'x\x01\x00{}', b'j\x01\x09{}'):
+            with self.subTest(data=data):
+                self.assertIsNone(serializer.loads(data))
+
+    def test_compression_threshold(self):
+        serializer = Serializer('json', compression='zlib', threshold=100)
+        small = serializer.dumps(VALUE)
+        self.assertEqual(small[2], 0)
+        large = {'rows': [VALUE] * 50}
+        data = serializer.dumps(large)
+        self.assertEqual(data[2], serialization.ZLIB)
+        self.assertLess(len(data), len(serializer.codec.encode(large)))
+        self.assertEqual(serializer.loads(data), large)
+        self.assertEqual(Serializer('json', compression=None, threshold=100).dumps(large)[2], 0)
+
+    @skipIf(serialization.lz4 is None, 'lz4 не установлен')
+    def test_lz4(self):
+        serializer = Serializer('json', compression='lz4', threshold=0)
+        data = serializer.dumps({'rows': [VALUE] * 50})
+        self.assertEqual(data[2], serialization.LZ4)
+        self.assertEqual(serializer.loads(data), {'rows': [VALUE] * 50})
+
+    def test_unknown_settings(self):
+        with self.assertRaises(ImproperlyConfigured):
+            Serializer('pickle')
+        with self.assertRaises(ImproperlyConfigured):
+            Serializer('json', compression='bz2')
+
+
+class CacheFormatTests(CacheTestCase):
+
+    def test_old_format_rebuilt(self):
+        # Ключ, записанный другой версией схемы, читается как промах.
+        advert = self.make_advert()
+        old = Serializer('json', version=cache.serializer.version + 1)
+        redis_cache.set(cache.advert_key(advert.pk), old.dumps({'title': 'Чужой формат'}))
+        with mock.patch.object(cache, 'load_rows', wraps=cache.load_rows) as load:
+            self.assertEqual(cache.get_advert(advert.pk).title, 'Велосипед')
+        load.assert_called_once_with([advert.pk])
+
+    def test_fetch_ignores_old_format(self):
+        key = cache.make_key('test')
+        old = Serializer('json', version=cache.serializer.version + 1)
+        redis_cache.set(key, old.dumps({'v': 'старое', 'd': 0, 'x': 0}))
+        self.assertEqual(cache.fetch(key, lambda: 'новое'), 'новое')
+
+    def test_pickle_is_miss(self):
+        self.assertIsNone(cache.loads(b'\x80\x04\x95\x05\x00\x00\x00\x00\x00\x00\x00}\x94.'))
@@ -0,0 +1,130 @@
+from unittest import mock
+from django.db import transaction
+from pymongo.errors import ServerSelectionTimeoutError
+from ads_app import cache, pagination, repository, stats
+from ads_app.local_cache import local_cache
+from ads_app.models import Advert, Comment, Tag
+from ads_app.redis_client import redis_cache
+from ads_app.tests.base import SignalTestCase
+
+
+class CacheInvalidationTests(SignalTestCase):
+    # TASKS_EAGER: задачи сборки выполняются сразу после фиксации.
+
+    def setUp(self):
+        super().setUp()
+        self.category = self.make_category()
+        self.advert = self.make_advert(tags=['bike'], comments=1, category=self.category)
+        # Прогретый кеш, который сигналы должны поддерживать в актуальном виде.
+        self.warm()
+
+    def warm(self):
+        cache.get_advert_ids()
+        cache.get_detail(self.advert.pk)
+        cache.get_categories()
+        pagination.get_page()
+        local_cache.clear()
+
+    def test_created_advert_enters_feed(self):
+        advert = self.make_advert(title='Самокат')
+        self.assertEqual(cache.get_advert_ids(), [advert.pk, self.advert.pk])
+        self.assertEqual(pagination.get_page()['ids'], [advert.pk, self.advert.pk])
+        self.assertEqual(cache.get_advert(advert.pk).title, 'Самокат')
+
+    def test_updated_advert_refreshed(self):
+        self.advert.title = 'Горный велосипед'
+        self.advert.save()
+        self.assertEqual(cache.get_advert(self.advert.pk).title, 'Горный велосипед')
+        # Ключ пересобран задачей, а не оставлен пустым до первого чтения.
+        local_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_advert(self.advert.pk).title, 'Горный велосипед')
+
+    def test_deleted_advert_dropped(self):
+        pk = self.advert.pk
+        self.advert.delete()
+        self.assertFalse(redis_cache.exists(cache.advert_key(pk)))
+        self.assertEqual(cache.get_advert_ids(), [])
+        self.assertEqual(pagination.get_page()['ids'], [])
+        self.assertFalse(redis_cache.exists(cache.stats_key(pk)))
+        with self.assertRaises(Advert.DoesNotExist):
+            cache.get_advert(pk)
+
+    def test_comments_refreshed(self):
+        Comment.objects.create(advert=self.advert, author='Гость', content='Новый')
+        self.assertEqual(cache.get_advert(self.advert.pk).comment_count, 2)
+        self.assertEqual([row.content for row in cache.get_comments(self.advert.pk)][-1:], ['Новый'])
+        Comment.objects.filter(advert=self.advert).first().delete()
+        self.assertEqual(cache.get_advert(self.advert.pk).comment_count, 1)
+        self.assertEqual(len(cache.get_comments(self.advert.pk)), 1)
+
+    def test_tags_refreshed(self):
+        self.advert.set_tags(['bike', 'red'])
+        self.assertEqual(sorted(cache.get_advert(self.advert.pk).tags), ['bike', 'red'])
+        self.assertEqual(stats.get(self.advert.pk)['tags'], 2)
+        Tag.objects.filter(advert=self.advert, name='bike').delete()
+        self.assertEqual(cache.get_advert(self.advert.pk).tags, ['red'])
+
+    def test_category_rename_refreshes_adverts(self):
+        self.category.name = 'Спорт'
+        self.category.save()
+        self.assertEqual([row.name for row in cache.get_categories()], ['Спорт'])
+        self.assertEqual(cache.get_advert(self.advert.pk).category_name, 'Спорт')
+
+    def test_category_delete_refreshes_adverts(self):
+        self.category.delete()
+        self.assertEqual(cache.get_categories(), [])
+        self.assertIsNone(cache.get_advert(self.advert.pk).category_id)
+
+    def test_rollback_keeps_cache(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Advert.objects.filter(pk=self.advert.pk).update(title='Откат')
+                Advert.objects.get(pk=self.advert.pk).save()
+                raise RuntimeError
+        self.assertEqual(cache.get_advert(self.advert.pk).title, 'Велосипед')
+        self.assertTrue(redis_cache.exists(cache.advert_key(self.advert.pk)))
+
+    def test_one_refresh_per_transaction(self):
+        with mock.patch.object(cache, 'invalidate_adverts', wraps=cache.invalidate_adverts) as invalidate:
+            with transaction.atomic():
+                self.advert.save()
+                self.advert.set_tags(['bike', 'red', 'blue'])
+        invalidate.assert_called_once_with([self.advert.pk])
+
+
+# Кеш комментариев при этом читает копии; здесь их нет.
+@mock.patch.object(repository, 'recent_comments', lambda advert_pk: [])
+@mock.patch.object(repository, 'EMBEDDED_COMMENTS', 20)
+class EmbeddedCommentsTests(SignalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with mock.patch.object(repository, 'EMBEDDED_COMMENTS', 0):
+            self.advert = self.make_advert()
+
+    @mock.patch.object(repository, 'embed_comments')
+    @mock.patch.object(repository, 'push_comment')
+    def test_created_comment_is_pushed(self, push_comment, embed_comments):
+        comment = Comment.objects.create(advert=self.advert, author='Гость', content='Текст')
+        push_comment.assert_called_once()
+        self.assertEqual(push_comment.call_args[0][0]['id'], comment.pk)
+        embed_comments.assert_not_called()
+
+    @mock.patch.object(repository, 'embed_comments')
+    @mock.patch.object(repository, 'push_comment', side_effect=ServerSelectionTimeoutError('down'))
+    def test_mongo_error_queues_rebuild(self, push_comment, embed_comments):
+        with self.assertLogs('ads_app.signals', 'ERROR'):
+            Comment.objects.create(advert=self.advert, author='Гость', content='Текст')
+        embed_comments.assert_called_once_with(self.advert.pk)
+
+    @mock.patch.object(repository, 'embed_comments')
+    @mock.patch.object(repository, 'pull_comment', side_effect=ServerSelectionTimeoutError('down'))
+    @mock.patch.object(repository, 'push_comment')
+    def test_deleted_comment_error_does_not_fail_request(self, push_comment, pull_comment, embed_comments):
+        comment = Comment.objects.create(advert=self.advert, author='Гость', content='Текст')
+        pk = comment.pk
+        with self.assertLogs('ads_app.signals', 'ERROR'):
+            comment.delete()
+        pull_comment.assert_called_once_with(self.advert.pk, pk)
+        embed_comments.assert_called_once_with(self.advert.pk)
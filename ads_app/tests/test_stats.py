@@ -0,0 +1,93 @@
+from unittest import mock
+from ads_app import stats
+from ads_app.cache import stats_key
+from ads_app.redis_client import redis_cache
+from ads_app.tests.base import CacheTestCase
+
+
+class CounterTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.advert = self.make_advert(tags=['bike', 'red'], comments=3)
+        self.other = self.make_advert(comments=1)
+
+    def test_counters_collected_once(self):
+        self.assertEqual(stats.get(self.advert.pk), {'tags': 2, 'comments': 3})
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.get(self.advert.pk), {'tags': 2, 'comments': 3})
+
+    def test_incr_needs_collected_hash(self):
+        # Без собранного хеша счётчик не появляется с неполным значением.
+        stats.incr(self.advert.pk, 'comments')
+        self.assertFalse(redis_cache.exists(stats_key(self.advert.pk)))
+        stats.get(self.advert.pk)
+        stats.incr(self.advert.pk, 'comments')
+        stats.incr(self.advert.pk, 'tags', -1)
+        self.assertEqual(stats.get(self.advert.pk), {'tags': 1, 'comments': 4})
+
+    def test_get_many_collects_missing_only(self):
+        stats.get(self.advert.pk)
+        with mock.patch.object(stats, 'collect', wraps=stats.collect) as collect:
+            found = stats.get_many([self.other.pk, self.advert.pk, 999999])
+        collect.assert_called_once_with([self.other.pk, 999999])
+        self.assertEqual(list(found), [self.other.pk, self.advert.pk])
+        self.assertEqual(found[self.other.pk], {'tags': 0, 'comments': 1})
+
+    def test_unknown_advert(self):
+        self.assertIsNone(stats.get(999999))
+        self.assertEqual(stats.get_many([]), {})
+
+    def test_fill_and_drop(self):
+        self.assertEqual(stats.fill([self.advert.pk, self.other.pk]), 2)
+        self.assertEqual(stats.fill([self.advert.pk, self.other.pk]), 0)
+        stats.drop(self.advert.pk)
+        self.assertFalse(redis_cache.exists(stats_key(self.advert.pk)))
+
+    def test_rebuild_replaces_drift(self):
+        stats.get(self.advert.pk)
+        redis_cache.hset(stats_key(self.advert.pk), 'comments', 100)
+        stats.rebuild([self.advert.pk])
+        self.assertEqual(stats.get(self.advert.pk)['comments'], 3)
+
+    def test_endpoints(self):
+        response = self.client.get(f'/id{self.advert.pk}/stats')
+        self.assertEqual(response.json(), {'id': self.advert.pk, 'tags': 2, 'comments': 3})
+        self.assertEqual(self.client.get('/id999999/stats').status_code, 404)
+        response = self.client.get(f'/stats?ids={self.other.pk},{self.advert.pk}')
+        self.assertEqual([item['id'] for item in response.json()['stats']], [self.other.pk, self.advert.pk])
+        self.assertEqual(self.client.get('/stats?ids=1,x').status_code, 400)
+
+
+class ViewCounterTests(CacheTestCase):
+
+    def test_views_flushed_in_one_batch(self):
+        for pk in (1, 2, 2, 3, 3, 3):
+            stats.count_view(pk)
+        self.assertEqual(stats.most_viewed(10), [])
+        stats.flush_views()
+        self.assertEqual(stats.most_viewed(10), [3, 2, 1])
+        self.assertEqual(stats.most_viewed(1), [3])
+        stats.flush_views()
+        self.assertEqual(redis_cache.zscore(stats.VIEWS_KEY, 3), 3)
+
+    def test_flush_due_after_interval(self):
+        with mock.patch.object(stats, 'VIEWS_FLUSH_INTERVAL', 0):
+            self.assertTrue(stats.count_view(1))
+            stats.record_view(1)
+        self.assertEqual(stats.most_viewed(10), [1])
+        with mock.patch.object(stats, 'VIEWS_FLUSH_INTERVAL', 3600):
+            self.assertFalse(stats.count_view(1))
+
+    def test_only_top_views_kept(self):
+        with mock.patch.object(stats, 'VIEWS_KEEP', 2):
+            for pk in (1, 2, 2, 3, 3, 3):
+                stats.count_view(pk)
+            stats.flush_views()
+        self.assertEqual(stats.most_viewed(10), [3, 2])
+
+    def test_drop_forgets_views(self):
+        stats.count_view(1)
+        stats.flush_views()
+        stats.drop(1)
+        self.assertEqual(stats.most_viewed(10), [])
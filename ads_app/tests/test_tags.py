@@ -0,0 +1,53 @@
+from datetime import timedelta
+from unittest import mock
+from django.utils import timezone
+from ads_app import cache, tags
+from ads_app.models import Advert
+from ads_app.tests.base import CacheTestCase
+
+
+class TagLookupTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.old = self.make_advert(title='Старый', tags=['car', 'red'])
+        self.cars = self.make_advert(title='Много машин', tags=['cars'])
+        self.new = self.make_advert(title='Новый', tags=['car'])
+        for age, advert in enumerate((self.new, self.cars, self.old)):
+            Advert.objects.filter(pk=advert.pk).update(created=now - timedelta(hours=age))
+
+    def test_exact_match(self):
+        self.assertEqual(tags.find_adverts(['car']), [self.new.pk, self.old.pk])
+        self.assertEqual(tags.find_adverts(['cars']), [self.cars.pk])
+        self.assertEqual(tags.find_adverts(['ca']), [])
+
+    def test_all_tags_required(self):
+        self.assertEqual(tags.find_adverts(['car', 'red']), [self.old.pk])
+        self.assertEqual(tags.find_adverts(['cars', 'red']), [])
+
+    def test_names_are_normalized(self):
+        self.assertEqual(tags.find_adverts(['#CAR', ' red ']), [self.old.pk])
+        self.assertEqual(tags.find_adverts(['', '#']), [])
+
+    def test_index_is_not_read_whole(self):
+        cache.get_advert_ids()
+        with mock.patch.object(cache, 'get_advert_ids', side_effect=AssertionError('полный индекс')):
+            self.assertEqual(tags.find_adverts(['car']), [self.new.pk, self.old.pk])
+
+    def test_builds_missing_feed_index(self):
+        self.assertFalse(cache.redis_cache.exists(cache.index_key()))
+        self.assertEqual(tags.find_adverts(['car']), [self.new.pk, self.old.pk])
+        self.assertTrue(cache.redis_cache.exists(cache.index_key()))
+
+    def test_database_fallback_keeps_order(self):
+        self.assertEqual(tags.find_adverts_db(['car']), [self.new.pk, self.old.pk])
+        self.assertEqual(tags.find_adverts_db(['car', 'red']), [self.old.pk])
+        self.assertEqual(tags.find_adverts_db(['cars']), [self.cars.pk])
+
+    def test_index_follows_tag_changes(self):
+        tags.ensure_index()
+        tags.add(self.cars.pk, 'car')
+        tags.remove(self.old.pk, 'car')
+        self.assertEqual(tags.find_adverts(['car']), [self.new.pk, self.cars.pk])
+        self.assertEqual(dict(tags.list_tags())['car'], 2)
@@ -0,0 +1,133 @@
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from ads_app import tasks
+from ads_app.redis_client import breaker, redis_cache
+from ads_app.tests.base import CacheTestCase
+import json
+import redis
+import time
+
+
+@mock.patch.object(tasks, 'EAGER', False)
+@mock.patch.object(tasks, 'BATCH_DELAY', 0)
+class TaskQueueTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        self.failures = 0
+        self.register('test_single', lambda *args: self.call(args))
+        self.register('test_batch', lambda calls: self.call(calls), batch=True)
+
+    def register(self, name, func, batch=False):
+        tasks.task(name, batch)(func)
+        self.addCleanup(tasks.registry.pop, name)
+
+    def call(self, args):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('сбой')
+        self.calls.append(args)
+
+    def pending(self):
+        return [job.decode() for job in redis_cache.zrange(tasks.PENDING, 0, -1)]
+
+    def later(self, seconds):
+        return mock.patch.object(tasks.time, 'time', return_value=time.time() + seconds)
+
+    def test_identical_jobs_collapse(self):
+        tasks.enqueue('test_single', 1)
+        tasks.enqueue('test_single', 1)
+        tasks.enqueue('test_single', 2)
+        self.assertEqual(len(self.pending()), 2)
+        with self.assertRaises(KeyError):
+            tasks.enqueue('missing')
+
+    def test_batch_delay(self):
+        with mock.patch.object(tasks, 'BATCH_DELAY', 5):
+            tasks.enqueue('test_single', 1)
+        self.assertEqual(tasks.claim(), [])
+        with self.later(6):
+            self.assertEqual(tasks.claim(), [tasks.dump_job('test_single', [1])])
+
+    def test_batch_task_gets_all_args(self):
+        for pk in (3, 1, 2):
+            tasks.enqueue('test_batch', pk)
+        tasks.enqueue('test_single', 9)
+        self.assertEqual(tasks.process(tasks.claim()), 4)
+        self.assertEqual(sorted(self.calls[0]), [(1,), (2,), (3,)])
+        self.assertEqual(self.calls[1], (9,))
+        self.assertEqual(tasks.stats(), {'pending': 0, 'processing': 0, 'failed': 0})
+
+    def test_retry_with_backoff(self):
+        self.failures = 2
+        tasks.enqueue('test_single', 1)
+        job = tasks.dump_job('test_single', [1])
+        with self.assertLogs('ads_app.tasks', 'ERROR'):
+            self.assertEqual(tasks.process(tasks.claim()), 0)
+        self.assertEqual(int(redis_cache.hget(tasks.ATTEMPTS, job)), 1)
+        self.assertAlmostEqual(redis_cache.zscore(tasks.PENDING, job), time.time() + tasks.RETRY_DELAY, delta=1)
+        self.assertEqual(tasks.claim(), [])
+        with self.later(tasks.RETRY_DELAY + 1), self.assertLogs('ads_app.tasks', 'ERROR'):
+            tasks.process(tasks.claim())
+        self.assertAlmostEqual(redis_cache.zscore(tasks.PENDING, job), time.time() + tasks.RETRY_DELAY ** 2, delta=3)
+        with self.later(tasks.RETRY_DELAY ** 2 + 3):
+            self.assertEqual(tasks.process(tasks.claim()), 1)
+        self.assertEqual(self.calls, [(1,)])
+        self.assertIsNone(redis_cache.hget(tasks.ATTEMPTS, job))
+
+    def test_gives_up_after_max_attempts(self):
+        self.failures = 100
+        tasks.enqueue('test_single', 1)
+        with mock.patch.object(tasks, 'MAX_ATTEMPTS', 2), self.assertLogs('ads_app.tasks', 'ERROR') as logs:
+            tasks.process(tasks.claim())
+            with self.later(tasks.RETRY_DELAY + 1):
+                tasks.process(tasks.claim())
+        self.assertIn('не выполнена за 2 попыток', '\n'.join(logs.output))
+        failed = json.loads(redis_cache.lindex(tasks.FAILED, 0))
+        self.assertEqual((failed['job'], failed['error']), (tasks.dump_job('test_single', [1]), "RuntimeError('сбой')"))
+        self.assertEqual(tasks.stats(), {'pending': 0, 'processing': 0, 'failed': 1})
+
+    def test_expired_lease_requeued(self):
+        # Воркер забрал задачу и умер, не подтвердив её.
+        tasks.enqueue('test_single', 1)
+        self.assertEqual(len(tasks.claim()), 1)
+        self.assertEqual(tasks.claim(), [])
+        self.assertEqual(tasks.stats()['processing'], 1)
+        with self.later(tasks.LEASE + 1):
+            jobs = tasks.claim()
+        self.assertEqual(jobs, [tasks.dump_job('test_single', [1])])
+        self.assertEqual(tasks.process(jobs), 1)
+        self.assertEqual(tasks.stats()['processing'], 0)
+
+    def test_bad_jobs_dropped(self):
+        redis_cache.zadd(tasks.PENDING, {'не json': 0, tasks.dump_job('gone', []): 0})
+        with self.assertLogs('ads_app.tasks', 'ERROR'):
+            self.assertEqual(tasks.process(tasks.claim()), 0)
+        self.assertEqual(tasks.stats(), {'pending': 0, 'processing': 0, 'failed': 0})
+
+    def test_runs_inline_without_redis(self):
+        with mock.patch.object(redis_cache, 'zadd', side_effect=redis.ConnectionError('down')):
+            tasks.enqueue('test_single', 1)
+        self.assertEqual(self.calls, [(1,)])
+        breaker.failures = 0
+
+    def test_eager(self):
+        with mock.patch.object(tasks, 'EAGER', True):
+            tasks.enqueue('test_batch', 1)
+        self.assertEqual(self.calls, [[(1,)]])
+        self.assertEqual(self.pending(), [])
+
+    def test_command(self):
+        tasks.enqueue('test_single', 1)
+        tasks.enqueue('test_single', 2)
+        out = StringIO()
+        call_command('run_tasks', stats=True, stdout=out)
+        self.assertRegex(out.getvalue(), r'pending\s+2')
+        out = StringIO()
+        # Обработчики SIGTERM и SIGINT остаются у процесса тестов.
+        with mock.patch('signal.signal'):
+            call_command('run_tasks', once=True, stdout=out)
+        self.assertIn('Выполнено задач: 2', out.getvalue())
+        self.assertEqual(sorted(self.calls), [(1,), (2,)])
@@ -0,0 +1,96 @@
+from unittest import mock
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from ads_app import tasks, thumbnails
+from ads_app.tests.base import SignalTestCase
+from PIL import Image
+import io
+import shutil
+import tempfile
+
+
+def image_file(size=(1200, 800), mode='RGB', format='PNG'):
+    buffer = io.BytesIO()
+    Image.new(mode, size, 'red').save(buffer, format=format)
+    return buffer.getvalue()
+
+
+class ThumbnailTests(SignalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def save(self, content, name='photo.png'):
+        return default_storage.save(name, ContentFile(content))
+
+    def test_hashed_name(self):
+        content = image_file()
+        first = thumbnails.hashed(SimpleUploadedFile('Фото.PNG', content))
+        second = thumbnails.hashed(SimpleUploadedFile('other.png', content))
+        self.assertRegex(first.name, r'^[0-9a-f]{20}\.png$')
+        self.assertEqual(first.name, second.name)
+        self.assertEqual(first.read(), content)
+
+    def test_variant_names(self):
+        names = thumbnails.variant_names('2020/abc.png')
+        self.assertEqual(len(names), 8)
+        self.assertIn('thumbs/abc-card-150.jpg', names)
+        self.assertEqual(names[-1], 'thumbs/abc-detail-1000.webp')
+
+    def test_build(self):
+        name = self.save(image_file(mode='RGBA'))
+        self.assertIsNone(thumbnails.srcsets(name))
+        thumbnails.build(name)
+        for variant, widths in thumbnails.VARIANTS.items():
+            for width in widths:
+                for kind in thumbnails.FORMATS:
+                    with default_storage.open(thumbnails.variant_name(name, variant, width, kind)) as file:
+                        image = Image.open(file)
+                        self.assertEqual((image.format, image.width), (kind.upper(), width))
+                        self.assertEqual(image.height, round(width * 2 / 3))
+
+    def test_small_photo_not_enlarged(self):
+        name = self.save(image_file(size=(200, 100)))
+        thumbnails.build(name)
+        with default_storage.open(thumbnails.variant_name(name, 'detail', 1000, 'jpeg')) as file:
+            self.assertEqual(Image.open(file).size, (200, 100))
+
+    def test_srcsets(self):
+        name = self.save(image_file())
+        thumbnails.build(name)
+        card = thumbnails.srcsets(name)['card']
+        self.assertTrue(card['src'].endswith('-card-150.jpg'))
+        self.assertRegex(card['webp'], r'-card-150\.webp 150w, .*-card-300\.webp 300w$')
+        self.assertIsNone(thumbnails.srcsets(''))
+
+    def test_delete_photo(self):
+        name = self.save(image_file())
+        thumbnails.build(name)
+        advert = self.make_advert()
+        advert.photo.name = name
+        thumbnails.delete_photo(advert.photo)
+        self.assertFalse(any(default_storage.exists(path) for path in [name, *thumbnails.variant_names(name)]))
+
+    def test_task(self):
+        name = self.save(image_file())
+        with mock.patch.object(tasks, 'enqueue') as enqueue:
+            thumbnails.run(1, name)
+            enqueue.assert_called_once_with('sync_adverts', 1)
+            enqueue.reset_mock()
+            with self.assertLogs('ads_app.thumbnails', 'INFO'):
+                thumbnails.run(1, 'missing.png')
+            enqueue.assert_not_called()
+
+    def test_scheduled_after_commit(self):
+        advert = self.make_advert()
+        advert.photo.name = self.save(image_file())
+        advert.save()
+        thumbnails.schedule(advert)
+        self.assertIsNotNone(thumbnails.srcsets(advert.photo.name))
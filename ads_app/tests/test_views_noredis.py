@@ -0,0 +1,36 @@
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from ads_app import cache
+from ads_app.management.commands.benchmark_views import load_views
+from ads_app.redis_client import redis_cache
+from ads_app.tests.base import CacheTestCase
+
+
+class NoRedisViewsTests(CacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.views = load_views('noredis')
+
+    def get(self, view, *args):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        return view(request, *args)
+
+    def test_detail_shows_comment_count(self):
+        advert = self.make_advert(comments=3)
+        response = self.get(self.views.advert_detail, advert.pk)
+        self.assertContains(response, 'Количество комментариев: 3')
+
+    def test_detail_without_comments(self):
+        advert = self.make_advert()
+        response = self.get(self.views.advert_detail, advert.pk)
+        self.assertContains(response, 'Количество комментариев: 0')
+
+    def test_list_with_redis_up(self):
+        self.make_advert(comments=2)
+        self.make_advert(title='Самокат')
+        response = self.get(self.views.AdvertList.as_view())
+        self.assertContains(response, 'Самокат')
+        self.assertContains(response, 'Комментариев: 2')
+        self.assertEqual(redis_cache.keys(cache.make_key('card', '*')), [])
@@ -0,0 +1,96 @@
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from ads_app import cache, pagination, stats, warmup
+from ads_app.local_cache import local_cache
+from ads_app.redis_client import redis_cache
+from ads_app.tests.base import SignalTestCase, reset_redis
+
+
+class WarmupTests(SignalTestCase):
+    # Пачки читаются в потоках со своими соединениями, поэтому данные
+    # должны быть зафиксированы.
+
+    def setUp(self):
+        super().setUp()
+        self.category = self.make_category()
+        self.adverts = [self.make_advert(title=f'Объявление {index}', tags=['bike'], comments=1,
+                                         category=self.category) for index in range(5)]
+        # Кеш, собранный сигналами при создании, не нужен.
+        reset_redis()
+
+    def test_warm(self):
+        oldest = self.adverts[0].pk
+        for pk in (oldest, oldest, self.adverts[-1].pk):
+            stats.count_view(pk)
+        stats.flush_views()
+        report = warmup.warm(pages=1, top=10, batch_size=2, concurrency=2)
+        self.assertEqual((report['categories'], report['pages']), (1, 1))
+        local_cache.clear()
+        with self.assertNumQueries(0):
+            page = pagination.get_page(None, pagination.PAGE_SIZE)
+            rows = cache.get_adverts(page['ids'] + [oldest])
+            cache.get_categories()
+            cache.get_comments(oldest)
+            stats.get(oldest)
+        self.assertEqual({row.comment_count for row in rows}, {1})
+
+    def test_pages_chained(self):
+        written, ids = warmup.warm_pages(10, 2)
+        self.assertEqual(written, 3)
+        self.assertEqual(ids, [advert.pk for advert in reversed(self.adverts)])
+        token = None
+        with self.assertNumQueries(0):
+            for number in range(3):
+                token = pagination.get_page(token, 2)['next']
+        self.assertIsNone(token)
+
+    def test_comments_only_for_viewed(self):
+        stats.count_view(self.adverts[0].pk)
+        stats.flush_views()
+        warmup.warm(pages=1, top=1)
+        self.assertTrue(redis_cache.exists(cache.comments_key(self.adverts[0].pk)))
+        self.assertFalse(redis_cache.exists(cache.comments_key(self.adverts[1].pk)))
+
+    def test_existing_keys_kept(self):
+        warmup.warm(pages=1, top=0)
+        redis_cache.delete(cache.advert_key(self.adverts[0].pk))
+        report = warmup.warm(pages=1, top=0)
+        self.assertEqual((report['categories'], report['pages'], report['adverts']), (0, 0, 1))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('warm_cache', pages=1, top=0, stdout=out)
+        self.assertIn('Записано ключей', out.getvalue())
+        self.assertTrue(redis_cache.exists(cache.categories_key()))
+
+
+class StartupTests(SignalTestCase):
+
+    def test_off_by_default(self):
+        with mock.patch.object(warmup.threading, 'Thread') as thread:
+            warmup.on_startup()
+        thread.assert_not_called()
+
+    def test_only_runserver(self):
+        with mock.patch.object(warmup, 'ON_STARTUP', True), \
+                mock.patch.object(warmup.threading, 'Thread') as thread:
+            with mock.patch.object(warmup.sys, 'argv', ['manage.py', 'migrate']):
+                warmup.on_startup()
+            thread.assert_not_called()
+            with mock.patch.object(warmup.sys, 'argv', ['manage.py', 'runserver']):
+                warmup.on_startup()
+            thread.assert_called_once()
+
+    def test_one_process_warms(self):
+        with mock.patch.object(warmup, 'warm', return_value={'elapsed': 0, 'keys': 0}) as warm:
+            with self.assertLogs('ads_app.warmup', 'INFO'):
+                warmup._warm_on_startup()
+            warmup._warm_on_startup()
+        warm.assert_called_once_with()
+        self.assertLessEqual(redis_cache.ttl(cache.make_key('warmup')), warmup.STARTUP_INTERVAL)
+
+    def test_errors_logged(self):
+        with mock.patch.object(warmup, 'warm', side_effect=RuntimeError('сбой')), \
+                self.assertLogs('ads_app.warmup', 'ERROR'):
+            warmup._warm_on_startup()
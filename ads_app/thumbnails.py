@@ -0,0 +1,113 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from ads_app import tasks
+from PIL import Image, ImageOps
+import hashlib
+import io
+import logging
+import os
+import posixpath
+
+logger = logging.getLogger(__name__)
+
+# Уменьшенные копии фото объявлений: для карточки в ленте и для страницы
+# объявления, каждая в двух ширинах (1x и 2x) и в двух форматах (JPEG и
+# WebP). Загруженный файл называется по хешу содержимого, а копии — по
+# имени оригинала, поэтому их адреса не меняются, пока не сменится фото.
+#
+# Копии собирает фоновая задача (ads_app/tasks.py), поставленная после
+# фиксации транзакции; пока их нет, шаблоны показывают оригинал.
+
+VARIANTS = {
+    'card': (150, 300),
+    'detail': (500, 1000),
+}
+FORMATS = {
+    'jpeg': ('jpg', {'quality': 80, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'quality': 75, 'method': 4}),
+}
+THUMBNAIL_DIR = 'thumbs'
+
+
+def hashed(upload):
+    # Имя загруженного файла — sha1 содержимого с исходным расширением.
+    digest = hashlib.sha1()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+    upload.seek(0)
+    extension = os.path.splitext(upload.name)[1].lower()
+    upload.name = digest.hexdigest()[:20] + extension
+    return upload
+
+def variant_name(name, variant, width, kind):
+    stem = os.path.splitext(posixpath.basename(name))[0]
+    return posixpath.join(THUMBNAIL_DIR, f'{stem}-{variant}-{width}.{FORMATS[kind][0]}')
+
+def variant_names(name):
+    return [variant_name(name, variant, width, kind)
+            for variant, widths in VARIANTS.items() for width in widths for kind in FORMATS]
+
+
+def srcsets(name):
+    # Для строки кеша: по варианту — src и srcset для JPEG и WebP. Копии
+    # пишутся по порядку, последняя служит признаком готовности.
+    if not name or not default_storage.exists(variant_names(name)[-1]):
+        return None
+    result = {}
+    for variant, widths in VARIANTS.items():
+        result[variant] = {'src': default_storage.url(variant_name(name, variant, widths[0], 'jpeg'))}
+        for kind in FORMATS:
+            result[variant][kind] = ', '.join(
+                f'{default_storage.url(variant_name(name, variant, width, kind))} {width}w' for width in widths)
+    return result
+
+
+def render(image, width, kind):
+    copy = image.copy()
+    copy.thumbnail((width, copy.height), Image.LANCZOS)
+    if kind == 'jpeg' and copy.mode != 'RGB':
+        copy = copy.convert('RGB')
+    buffer = io.BytesIO()
+    copy.save(buffer, format=kind.upper(), **FORMATS[kind][1])
+    return buffer.getvalue()
+
+def build(name):
+    with default_storage.open(name) as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    for variant, widths in VARIANTS.items():
+        for width in widths:
+            for kind in FORMATS:
+                path = variant_name(name, variant, width, kind)
+                if default_storage.exists(path):
+                    default_storage.delete(path)
+                default_storage.save(path, ContentFile(render(image, width, kind)))
+
+def delete(name):
+    for path in variant_names(name):
+        default_storage.delete(path)
+
+def delete_photo(photo):
+    # Вместо photo.delete(False): вместе с файлом удаляются его копии.
+    if photo:
+        delete(photo.name)
+        photo.delete(False)
+
+
+@tasks.task('thumbnails')
+def run(pk, name):
+    if not default_storage.exists(name):
+        # Фото успели заменить или удалить: собирать нечего.
+        logger.info('Нет файла %s, копии не собраны', name)
+        return
+    build(name)
+    # Строка объявления в кеше хранит адреса копий: перечитываем её.
+    tasks.enqueue('sync_adverts', pk)
+
+def schedule(advert):
+    if advert.photo:
+        pk, name = advert.pk, advert.photo.name
+        transaction.on_commit(lambda: tasks.enqueue('thumbnails', pk, name))
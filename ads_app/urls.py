@@ -1,4 +1,4 @@
-from ads_app import views
+from ads_app import views, api
 from django.urls import path
 from django.conf.urls import handler404
 
@@ -6,6 +6,10 @@ app_name = 'ads_app'
 urlpatterns = [
     path('', views.AdvertList.as_view(), name='advert-list'),
     path('id<int:pk>', views.advert_detail, name='advert-detail'),
+    path('id<int:pk>/stats', views.advert_stats, name='advert-stats'),
+    path('stats', views.advert_stats_batch, name='advert-stats-batch'),
+    path('tags', views.tag_list, name='tag-list'),
+    path('cachestats', views.cache_stats, name='cache-stats'),
     path('create', views.AdvertCreate.as_view(), name="advert-create"),
     path("update/<int:pk>", views.AdvertUpdate.as_view(), name="advert-update"),
     path("delete/<int:pk>", views.AdvertDelete.as_view(), name="advert-delete"),
@@ -14,6 +18,13 @@ urlpatterns = [
     path("comment/update/<int:pk>-<int:id>", views.update_comment, name="comment-update"),
     path("comment/delete/<int:pk>-<int:id>", views.delete_comment, name="comment-delete"),
     path("comment/cancel/<int:pk>", views.cancel_comment, name="comment-cancel"),
+    path('api/adverts', api.adverts, name='api-adverts'),
+    path('api/adverts/bulk', api.adverts_bulk, name='api-adverts-bulk'),
+    path('api/adverts/<int:pk>', api.advert, name='api-advert'),
+    path('api/adverts/<int:pk>/tags', api.advert_tags, name='api-advert-tags'),
+    path('api/adverts/<int:pk>/comments', api.advert_comments, name='api-advert-comments'),
+    path('api/adverts/<int:pk>/stats', api.advert_stats, name='api-advert-stats'),
+    path('api/comments', api.comments_bulk, name='api-comments'),
 ]
 
 handler404 = 'ads_app.views.error_404_view'
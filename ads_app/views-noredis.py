@@ -1,6 +1,6 @@
 from django.shortcuts import redirect, render
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
-from django.db.models import Q
+from django.db.models import Q, Count
 from django.template import loader, RequestContext
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth import login, logout
@@ -8,26 +8,23 @@ from django.http import HttpResponse
 from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
-from ads_app.models import Comment, Category, Advert
+from ads_app.models import Comment, Category, Advert, parse_tags
 from ads_app.forms import CommentForm, AdvertForm
 from datetime import datetime
 
+def advert_cards():
+    return Advert.objects.select_related('author', 'category').annotate(comment_count=Count('comments', distinct=True))
+
 def error_404_view(request, exception):
     return render(request, '404.html')
 
 def advert_detail(request, pk):
-    advert = Advert.objects.get(pk=pk)
+    advert = advert_cards().get(pk=pk)
     if 'btnAddTag' in request.POST:
-        req_tag = request.POST.get('tag').replace(' ', '')
-        if advert.tags:
-            if not req_tag in advert.tags:
-                advert.tags += f' {req_tag}'
-        else:
-            advert.tags = req_tag
-        advert.save()
+        advert.add_tag(request.POST.get('tag'))
         return redirect('/id' + str(pk))
     comments = Comment.objects.filter(advert__pk=pk)
-    tags = advert.tags.split(' ') if advert.tags else advert.tags
+    tags = advert.tag_names
     context = {'advert': advert,
                'tag_list': tags,
                'comment_list': comments}
@@ -94,6 +91,11 @@ class AdvertUpdate(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('ads_app:advert-list')
     template_name = 'advert_edit.html'
 
+    def get_initial(self):
+        initial = super().get_initial()
+        initial['tags'] = ' '.join(self.object.tag_names)
+        return initial
+
     def post(self, request, *args, **kwargs):
         advert = Advert.objects.get(id=kwargs['pk'])
         form = AdvertForm(request.POST, request.FILES)
@@ -107,10 +109,10 @@ class AdvertUpdate(LoginRequiredMixin, UpdateView):
                 advert.photo = form.cleaned_data['photo']
             advert.title = form.cleaned_data['title']
             advert.content = form.cleaned_data['content']
-            advert.tags = form.cleaned_data['tags']
             advert.category = Category.objects.get(pk=request.POST.get('category'))
             advert.updated = datetime.now()
             advert.save()
+            advert.set_tags(parse_tags(form.cleaned_data['tags']))
         return redirect('/id' + str(kwargs['pk']))
 
 class AdvertCreate(LoginRequiredMixin, CreateView):
@@ -129,9 +131,9 @@ class AdvertCreate(LoginRequiredMixin, CreateView):
             advert.author = request.user
             advert.title = form.cleaned_data['title']
             advert.content = form.cleaned_data['content']
-            advert.tags = form.cleaned_data['tags']
             advert.category = Category.objects.get(pk=request.POST.get('category'))
             advert.save()
+            advert.set_tags(parse_tags(form.cleaned_data['tags']))
         return redirect('/')
 
 class AdvertList(ListView):
@@ -141,7 +143,7 @@ class AdvertList(ListView):
     def dispatch(self, request, *args, **kwargs):
         if 'btnLogIn' in request.POST:
             context = {}
-            context['advert_list'] = Advert.objects.all()
+            context['advert_list'] = advert_cards()
             context['category_list'] = Category.objects.all()
             form = AuthenticationForm(request=request, data=request.POST)
             if form.is_valid():
@@ -155,39 +157,47 @@ class AdvertList(ListView):
             return redirect('/')
         elif 'btnAddAdvert' in request.POST:
             return redirect('/create')
+        elif 'tag' in request.GET:
+            advert_list = advert_cards()
+            for name in parse_tags(' '.join(request.GET.getlist('tag'))):
+                advert_list = advert_list.filter(tag_set__name=name)
+            categories = Category.objects.all()
+            context = {'category_list': categories,
+                       'advert_list': advert_list}
+            return render(self.request, 'advert_list.html', context)
         elif 'btnSearch' in request.GET:
             combo_val = request.GET.get('cmbCategoty')
             query = request.GET.get('search', '')
             if not combo_val or combo_val == '0':
-                advert_list = Advert.objects.filter(
+                advert_list = advert_cards().filter(
                     Q(title__icontains=query.lower())|
                     Q(content__icontains=query.lower())|
-                    Q(tags__icontains=query.lower())|
+                    Q(tag_set__name__icontains=query.lower())|
                     Q(title__icontains=query.upper())|
                     Q(content__icontains=query.upper())|
-                    Q(tags__icontains=query.upper())|
+                    Q(tag_set__name__icontains=query.upper())|
                     Q(title__icontains=query.capitalize())|
                     Q(content__icontains=query.capitalize())|
-                    Q(tags__icontains=query.capitalize()))
+                    Q(tag_set__name__icontains=query.capitalize())).distinct()
             else:
-                advert_list = Advert.objects.filter(
+                advert_list = advert_cards().filter(
                     Q(category__id=int(combo_val))&
                    (Q(title__icontains=query.lower())|
                     Q(content__icontains=query.lower())|
-                    Q(tags__icontains=query.lower())|
+                    Q(tag_set__name__icontains=query.lower())|
                     Q(title__icontains=query.upper())|
                     Q(content__icontains=query.upper())|
-                    Q(tags__icontains=query.upper())|
+                    Q(tag_set__name__icontains=query.upper())|
                     Q(title__icontains=query.capitalize())|
                     Q(content__icontains=query.capitalize())|
-                    Q(tags__icontains=query.capitalize())))
+                    Q(tag_set__name__icontains=query.capitalize()))).distinct()
             categories = Category.objects.all()
             context = {'category_list': categories,
                        'advert_list': advert_list}
             return render(self.request, 'advert_list.html', context)
         else:
             categories = Category.objects.all()
-            adverts = Advert.objects.all()
+            adverts = advert_cards()
             context = {'category_list': categories,
                        'advert_list': adverts}
             return render(self.request, 'advert_list.html', context)
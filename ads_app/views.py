@@ -1,77 +1,145 @@
 from django.shortcuts import redirect, render
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
-from django.db.models import Q
 from django.template import loader, RequestContext
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth import login, logout
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
-from ads_app.models import Comment, Category, Advert
+from django.contrib.admin.views.decorators import staff_member_required
+from ads_app.models import Comment, Category, Advert, parse_tags
 from ads_app.forms import CommentForm, AdvertForm
+from ads_app import cache, ingest, pagecache, pagination, search, stats, tags, thumbnails
+from ads_app.local_cache import counters
 from datetime import datetime
-import pickle
-import redis
+import math
 
-redis_cache = redis.Redis(host='127.0.0.1', port=6379)
-
-def get_advert_context():
-    adverts = redis_cache.get('advert_list')
-    if adverts:
-        adverts = pickle.loads(adverts)
+def get_page_ids(request):
+    size = pagination.page_size(request.GET.get('size'))
+    cursor = request.GET.get('cursor')
+    if 'tag' in request.GET:
+        ids = tags.find_adverts(request.GET.getlist('tag'))
+        page = pagination.paginate_ids(ids, cursor, size)
+        pagecache.tag(request, 'search')
+    elif 'btnSearch' in request.GET:
+        ids = search.search(request.GET.get('search', ''), request.GET.get('cmbCategoty'))
+        page = pagination.paginate_ids(ids, cursor, size)
+        pagecache.tag(request, 'search')
     else:
-        adverts = Advert.objects.all()
-        redis_cache.set('advert_list', pickle.dumps(adverts))
-    return adverts
+        page = pagination.get_page(cursor, size)
+        parsed = pagination.Cursor.decode(cursor) if cursor else None
+        if parsed is None or parsed.direction == pagination.PREV:
+            pagecache.tag(request, 'head')
+    pagecache.tag(request, *map(pagecache.advert_tag, page['ids']))
+    return page
+
+def get_advert_context(request):
+    page = get_page_ids(request)
+    page['adverts'] = cache.get_adverts(page['ids'])
+    return page
+
+def get_list_context(request, page, categories=None):
+    pagecache.tag(request, 'categories')
+    return {
+        'page': page,
+        'advert_list': page['adverts'],
+        'category_list': get_category_context() if categories is None else categories,
+        'next_url': get_page_url(request, page['next']),
+        'prev_url': get_page_url(request, page['prev']),
+    }
+
+def get_list_json(page):
+    return {
+        'adverts': page['adverts'],
+        'next': page['next'],
+        'prev': page['prev'],
+    }
+
+def get_page_url(request, cursor):
+    if not cursor:
+        return None
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return '?' + query.urlencode()
 
 def get_category_context():
-    categories = redis_cache.get('category_list')
-    if categories:
-        categories = pickle.loads(categories)
-    else:
-        categories = Category.objects.all()
-        redis_cache.set('category_list', pickle.dumps(categories))
-    return categories
-
-def get_comment_context():
-    comments = redis_cache.get('comment_list')
-    if comments:
-        comments = pickle.loads(comments)
-    else:
-        comments = Comment.objects.all()
-        redis_cache.set('comment_list', pickle.dumps(comments))
-    return comments
+    return cache.get_categories()
 
 def error_404_view(request, exception):
     return render(request, '404.html')
 
 def advert_detail(request, pk):
-    advert = get_advert_context().get(pk=pk)
     if 'btnAddTag' in request.POST:
-        req_tag = request.POST.get('tag').replace(' ', '')
-        if advert.tags:
-            if not req_tag in advert.tags:
-                advert.tags += f' {req_tag}'
-        else:
-            advert.tags = req_tag
-        advert.save()
-        redis_cache.set('adverts_list', pickle.dumps(Advert.objects.all()))
+        advert = Advert.objects.get(pk=pk)
+        advert.add_tag(request.POST.get('tag'))
         return redirect('/id' + str(pk))
+    before = request.GET.get('before', '')
+    if before.isdigit():
+        # Более ранние комментарии читаются из базы мимо кеша.
+        advert = cache.get_advert(pk)
+        comments, has_older = cache.load_older_comments(pk, int(before))
+    else:
+        advert, comments = cache.get_detail(pk)
+        has_older = advert.comment_count > len(comments)
+        count_view(request, advert.id)
+        own = ingest.pending(request, advert.id)
+        if own:
+            # Строка из кеша общая для всех запросов: меняем копию.
+            advert = cache.Row(advert, comment_count=advert.comment_count + len(own))
+            comments = comments + own
+    return render(request, 'advert_detail.html', get_detail_context(request, advert, comments, has_older))
+
+def count_view(request, pk):
+    # Просмотр из кеша страниц посчитает PageCacheMiddleware.
+    stats.record_view(pk)
+    request.advert_view = pk
+
+def get_detail_context(request, advert, comments, has_older=False):
+    pagecache.tag(request, pagecache.advert_tag(advert.id))
     context = {}
-    context['comment_list'] = get_comment_context().filter(advert__pk=pk)
-    context['tag_list'] = advert.tags.split(' ') if advert.tags else advert.tags
+    context['comment_list'] = comments
+    context['older_comments'] = comments[0].id if comments and has_older else None
+    context['tag_list'] = advert.tags
     context['advert'] = advert
-    return render(request, 'advert_detail.html', context)
+    return context
+
+def advert_stats(request, pk):
+    values = stats.get(pk)
+    if values is None:
+        return JsonResponse({'error': 'Объявление не найдено'}, status=404)
+    return JsonResponse({'id': pk, **values})
+
+def advert_stats_batch(request):
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk]
+    except ValueError:
+        return JsonResponse({'error': 'Параметр ids должен содержать числа через запятую'}, status=400)
+    return JsonResponse({'stats': [{'id': pk, **values} for pk, values in stats.get_many(ids).items()]})
+
+def tag_list(request):
+    return JsonResponse({'tags': [{'name': name, 'count': count} for name, count in tags.list_tags()]})
+
+@staff_member_required
+def cache_stats(request):
+    # Счётчики этого процесса: у каждого воркера gunicorn они свои.
+    return JsonResponse(counters())
 
 def create_comment(request, pk):
     form = CommentForm(request.POST)
+    response = redirect('/id' + str(pk))
     if form.is_valid():
-        comment = form.save(commit=False)
-        comment.advert = get_advert_context().get(pk=pk)
-        comment.save()
-        redis_cache.set('comments_list', pickle.dumps(Comment.objects.all()))
-    return redirect('/id' + str(pk))
+        advert_id = cache.get_advert(pk).id
+        wait = ingest.throttle(request, advert_id)
+        if wait:
+            response = HttpResponse(f'Слишком много комментариев, попробуйте через {math.ceil(wait)} с',
+                                    status=429, content_type='text/plain; charset=utf-8')
+            response['Retry-After'] = math.ceil(wait)
+            return response
+        token, comment = ingest.add(advert_id, form.cleaned_data['author'], form.cleaned_data['content'])
+        if token is not None:
+            ingest.remember(request, response, advert_id, token)
+    return response
 
 @login_required
 def comment_update_form(request, pk, id):
@@ -84,27 +152,23 @@ def comment_update_form(request, pk, id):
 def update_comment(request, pk, id):
     form = CommentForm(request.POST)
     if form.is_valid():
-        comments = Comment.objects.all()
-        comment = comments.get(pk=pk)
+        comment = Comment.objects.get(pk=pk)
         comment.author = form.cleaned_data['author']
         comment.content = form.cleaned_data['content']
         comment.update = datetime.now()
         comment.save()
-        redis_cache.set('comments_list', pickle.dumps(comments))
     return redirect('/id' + str(id))
 
 @login_required
 def cancel_comment(request, pk):
-    advert = get_advert_context().get(pk=pk)
+    advert = cache.get_advert(pk)
     context = {'advert': advert}
     return render(request, 'comment_default.html', context)
 
 @login_required
 def delete_comment(request, pk, id):
-    comments = Comment.objects.all()
-    comment = comments.get(pk=pk)
+    comment = Comment.objects.get(pk=pk)
     comment.delete()
-    redis_cache.set('comments_list', pickle.dumps(comments))
     return redirect('/id' + str(id))
 
 class AdvertDelete(LoginRequiredMixin, DeleteView):
@@ -115,12 +179,9 @@ class AdvertDelete(LoginRequiredMixin, DeleteView):
     template_name = 'advert_delete.html'
 
     def delete(self, request, *args, **kwargs):
-        adverts = Advert.objects.all()
-        advert = adverts.get(id=kwargs['pk'])
-        if advert.photo:
-            advert.photo.delete(False)
+        advert = Advert.objects.get(id=kwargs['pk'])
+        thumbnails.delete_photo(advert.photo)
         advert.delete()
-        redis_cache.set('advert_list', pickle.dumps(adverts))
         return redirect('/')
 
 class AdvertUpdate(LoginRequiredMixin, UpdateView):
@@ -131,25 +192,30 @@ class AdvertUpdate(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('ads_app:advert-list')
     template_name = 'advert_edit.html'
 
+    def get_initial(self):
+        initial = super().get_initial()
+        initial['tags'] = ' '.join(self.object.tag_names)
+        return initial
+
     def post(self, request, *args, **kwargs):
-        adverts = Advert.objects.all()
-        advert = adverts.get(id=kwargs['pk'])
+        advert = Advert.objects.get(id=kwargs['pk'])
         form = AdvertForm(request.POST, request.FILES)
         if form.is_valid():
             photo = form.cleaned_data['photo']
             if photo == False:
-                advert.photo.delete(False)
+                thumbnails.delete_photo(advert.photo)
                 advert.photo = None
             elif photo:
-                advert.photo.delete(False)
-                advert.photo = form.cleaned_data['photo']
+                thumbnails.delete_photo(advert.photo)
+                advert.photo = thumbnails.hashed(photo)
             advert.title = form.cleaned_data['title']
             advert.content = form.cleaned_data['content']
-            advert.tags = form.cleaned_data['tags']
             advert.category = Category.objects.get(pk=request.POST.get('category'))
             advert.updated = datetime.now()
             advert.save()
-            redis_cache.set('advert_list', pickle.dumps(adverts))
+            advert.set_tags(parse_tags(form.cleaned_data['tags']))
+            if photo:
+                thumbnails.schedule(advert)
         return redirect('/id' + str(kwargs['pk']))
 
 class AdvertCreate(LoginRequiredMixin, CreateView):
@@ -164,31 +230,38 @@ class AdvertCreate(LoginRequiredMixin, CreateView):
         form = AdvertForm(request.POST, request.FILES)
         if form.is_valid():
             advert = Advert()
-            advert.photo = form.cleaned_data['photo']
+            if form.cleaned_data['photo']:
+                advert.photo = thumbnails.hashed(form.cleaned_data['photo'])
             advert.author = request.user
             advert.title = form.cleaned_data['title']
             advert.content = form.cleaned_data['content']
-            advert.tags = form.cleaned_data['tags']
-            advert.category = get_category_context().get(pk=request.POST.get('category'))
+            advert.category_id = cache.get_category(request.POST.get('category')).id
             advert.save()
-            redis_cache.set('advert_list', pickle.dumps(Advert.objects.all()))
+            advert.set_tags(parse_tags(form.cleaned_data['tags']))
+            thumbnails.schedule(advert)
         return redirect('/')
 
 class AdvertList(ListView):
     model = Advert
     template_name = 'advert_list.html'
 
+    def get_page_context(self):
+        return get_list_context(self.request, get_advert_context(self.request))
+
     def get_context_data(self, **kwargs):
         context =super().get_context_data(**kwargs)
-        context['advert_list'] = get_advert_context()
-        context['category_list'] = get_category_context()
+        context.update(self.get_page_context())
         return context
 
+    def render_to_response(self, context, **response_kwargs):
+        if self.request.GET.get('format') == 'json':
+            return JsonResponse(get_list_json(context['page']))
+        return super().render_to_response(context, **response_kwargs)
+
     def dispatch(self, request, *args, **kwargs):
         if 'btnLogIn' in request.POST:
-            context = {}
-            context['advert_list'] = get_advert_context()
-            context['category_list'] = get_category_context()
+            self.request = request
+            context = self.get_page_context()
             form = AuthenticationForm(request=request, data=request.POST)
             if form.is_valid():
                 login(request, form.get_user())
@@ -201,34 +274,4 @@ class AdvertList(ListView):
             return redirect('/')
         elif 'btnAddAdvert' in request.POST:
             return redirect('/create')
-        elif 'btnSearch' in request.GET:
-            context = {}
-            adverts = get_advert_context()
-            context['category_list'] = get_category_context()
-            combo_val = request.GET.get('cmbCategoty')
-            query = request.GET.get('search', '')
-            if not combo_val or combo_val == '0':
-                context['advert_list'] = adverts.filter(
-                    Q(title__icontains=query.lower())|
-                    Q(content__icontains=query.lower())|
-                    Q(tags__icontains=query.lower())|
-                    Q(title__icontains=query.upper())|
-                    Q(content__icontains=query.upper())|
-                    Q(tags__icontains=query.upper())|
-                    Q(title__icontains=query.capitalize())|
-                    Q(content__icontains=query.capitalize())|
-                    Q(tags__icontains=query.capitalize()))
-            else:
-                context['advert_list']= adverts.filter(
-                    Q(category__id=int(combo_val))&
-                   (Q(title__icontains=query.lower())|
-                    Q(content__icontains=query.lower())|
-                    Q(tags__icontains=query.lower())|
-                    Q(title__icontains=query.upper())|
-                    Q(content__icontains=query.upper())|
-                    Q(tags__icontains=query.upper())|
-                    Q(title__icontains=query.capitalize())|
-                    Q(content__icontains=query.capitalize())|
-                    Q(tags__icontains=query.capitalize())))
-            return render(request, 'advert_list.html', context)
         return super(AdvertList, self).dispatch(request, *args, **kwargs)
@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.db import connections
+from concurrent.futures import ThreadPoolExecutor
+from ads_app import cache, pagination, stats
+from ads_app.cache import redis_cache, make_key
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Прогрев кеша после выкладки или перезапуска Redis, чтобы первые запросы
+# к ленте и объявлениям не шли в базу все разом: категории, первые
+# страницы ленты, самые просматриваемые объявления (stats.most_viewed) и
+# объявления этих страниц вместе со счётчиками и комментариями.
+#
+# Объявления читаются пачками по batch_size, не больше concurrency пачек
+# одновременно, и пишутся в Redis конвейером на пачку. Уже лежащие в
+# кеше ключи не перезаписываются: они не старее прочитанного.
+#
+# С WARM_CACHE_ON_STARTUP то же делает AppConfig.ready() в фоновом потоке;
+# из процессов, запущенных в течение WARM_CACHE_STARTUP_INTERVAL секунд,
+# прогревает только первый.
+
+PAGES = getattr(settings, 'WARM_CACHE_PAGES', 5)
+TOP = getattr(settings, 'WARM_CACHE_TOP', 500)
+BATCH_SIZE = 100
+CONCURRENCY = 4
+ON_STARTUP = getattr(settings, 'WARM_CACHE_ON_STARTUP', False)
+STARTUP_INTERVAL = getattr(settings, 'WARM_CACHE_STARTUP_INTERVAL', 60)
+
+
+def warm_categories():
+    return cache.store_many([(cache.categories_key(), cache.plain_rows(cache.load_categories()), None)], nx=True)
+
+def warm_pages(count, size=pagination.PAGE_SIZE):
+    # Страницы идут цепочкой: курсор следующей берётся из предыдущей.
+    items, ids = [], []
+    token = None
+    for number in range(count):
+        page = pagination.get_page_db(token, size)
+        cursor = pagination.Cursor.decode(token) if token else None
+        kind = 'first' if cursor is None else 'next'
+        items.append((pagination.page_key(cursor, size), page, pagination.pages_key(kind)))
+        ids.extend(page['ids'])
+        token = page['next']
+        if token is None:
+            break
+    return cache.store_many(items, nx=True), ids
+
+def warm_adverts(ids, comments):
+    # Одна пачка: строки, счётчики и (для comments) комментарии.
+    try:
+        rows = cache.load_rows(ids)
+        written = cache.store_rows(rows, index=False, replace=False)
+        written += stats.fill(ids)
+        if comments:
+            found = cache.load_comments_many(comments)
+            written += cache.store_many([(cache.comments_key(pk), cache.plain_rows(found[pk]), None)
+                                         for pk in comments], nx=True)
+        return written
+    finally:
+        connections.close_all()
+
+def warm(pages=PAGES, top=TOP, batch_size=BATCH_SIZE, concurrency=CONCURRENCY):
+    started = time.monotonic()
+    report = {'categories': warm_categories()}
+    report['pages'], page_ids = warm_pages(pages)
+    viewed = stats.most_viewed(top) if top else []
+    ids = list(dict.fromkeys(viewed + page_ids))
+    viewed = set(viewed)
+    batches = [ids[start:start + batch_size] for start in range(0, len(ids), batch_size)]
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='warm-cache') as executor:
+        written = executor.map(lambda batch: warm_adverts(batch, [pk for pk in batch if pk in viewed]), batches)
+        report['adverts'] = sum(written)
+    report['keys'] = report['categories'] + report['pages'] + report['adverts']
+    report['elapsed'] = time.monotonic() - started
+    return report
+
+
+def on_startup():
+    # Вызывается из AppConfig.ready(). Команды manage.py, кроме runserver,
+    # кеш не прогревают.
+    if not ON_STARTUP:
+        return
+    if os.path.basename(sys.argv[0]) == 'manage.py' and sys.argv[1:2] != ['runserver']:
+        return
+    threading.Thread(target=_warm_on_startup, name='warm-cache', daemon=True).start()
+
+def _warm_on_startup():
+    try:
+        if not redis_cache.set(make_key('warmup'), os.getpid(), nx=True, ex=STARTUP_INTERVAL):
+            return
+        report = warm()
+        logger.info('Кеш прогрет за %.1f с, записано ключей: %s', report['elapsed'], report['keys'])
+    except Exception:
+        logger.exception('Не удалось прогреть кеш')
+    finally:
+        connections.close_all()
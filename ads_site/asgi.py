@@ -0,0 +1,22 @@
+"""
+ASGI config for ads_site project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Guest GET requests for the advert list, advert pages and stats are served
+asynchronously (ads_app/aio.py); everything else goes to the WSGI
+application in a thread pool. Run with any ASGI server, e.g.
+
+    uvicorn ads_site.asgi:application
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ads_site.settings')
+
+wsgi_application = get_wsgi_application()
+
+from ads_app.aio import AsyncApplication  # noqa: E402  (нужен настроенный Django)
+
+application = AsyncApplication(wsgi_application)
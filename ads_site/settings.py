@@ -26,19 +26,22 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    'whitenoise.runserver_nostatic',
     'django.contrib.staticfiles',
     'ads_app.apps.AppConfig',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'ads_app.metrics.MetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'ads_app.pagecache.PageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
 ]
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
@@ -47,7 +50,8 @@ ROOT_URLCONF = 'ads_site.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Шаблонизатор Django с замером времени отрисовки (ads_app/metrics.py).
+        'BACKEND': 'ads_app.metrics.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -88,6 +92,14 @@ DATABASES = {
     }
 }
 
+# Горячие чтения (объявления, лента, комментарии, статистика) идут в
+# MongoDB напрямую через pymongo, минуя перевод запросов djongo.
+MONGO_REPOSITORY = True
+# Сколько последних комментариев хранить в документе объявления (0 — не
+# хранить). Существующие документы заполняет команда embed_comments.
+MONGO_EMBEDDED_COMMENTS = 20
+MONGO_TIMEOUT = 5
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -128,6 +140,13 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
 
+# Кто отдаёт тело файлов из MEDIA_ROOT (ads_app/media.py): None — само
+# приложение, 'x-accel-redirect' — nginx (internal location
+# MEDIA_ACCEL_PREFIX с alias на MEDIA_ROOT), 'x-sendfile' — Apache/lighttpd.
+MEDIA_OFFLOAD = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+MEDIA_MAX_AGE = 60 * 60 * 24
+
 STATIC_URL = '/static/'
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
@@ -135,3 +154,122 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static')
 ]
+
+# Redis cache
+# Ключи объявлений, комментариев и категорий обновляются сигналами моделей
+# (ads_app/signals.py), поэтому TTL ограничивает только объём памяти.
+
+REDIS_HOST = os.environ.get('REDIS_HOST', '127.0.0.1')
+
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+
+REDIS_DB = int(os.environ.get('REDIS_DB', 0))
+
+REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD')
+
+# Соединений в пуле одного процесса и сколько секунд ждать свободное.
+REDIS_MAX_CONNECTIONS = 50
+
+REDIS_POOL_TIMEOUT = 1
+
+# Таймауты в секундах: зависший Redis не должен держать запрос.
+REDIS_CONNECT_TIMEOUT = 0.5
+
+REDIS_SOCKET_TIMEOUT = 0.5
+
+# После стольких ошибок подряд кеш отключается на REDIS_COOLDOWN секунд,
+# а сайт работает напрямую с базой.
+REDIS_FAILURE_THRESHOLD = 3
+
+REDIS_COOLDOWN = 30
+
+CACHE_VERSION = 5
+
+# Формат значений в Redis (ads_app/serialization.py): msgpack или json,
+# сжатие zlib или lz4 для значений длиннее порога в байтах.
+CACHE_SERIALIZER = 'msgpack'
+
+CACHE_COMPRESSION = 'zlib'
+
+CACHE_COMPRESS_THRESHOLD = 1024
+
+CACHE_TTL = 60 * 60 * 24 * 7
+
+# Пустой ключ собирает один процесс под блокировкой на CACHE_LOCK_TTL
+# секунд; остальные ждут его до CACHE_LOCK_WAIT секунд.
+CACHE_LOCK_TTL = 10
+
+CACHE_LOCK_WAIT = 2
+
+# Кеш в памяти процесса перед Redis: число записей и время жизни в секундах.
+L1_CACHE_SIZE = 1000
+
+L1_CACHE_TTL = 30
+
+# Размер пула потоков ASGI-приложения (ads_site/asgi.py) для работы с базой
+# и запросов, которые обслуживает WSGI-приложение.
+ASYNC_THREADS = 20
+
+# Очередь фоновых задач (ads_app/tasks.py), её выполняет manage.py run_tasks.
+# TASKS_EAGER — выполнять задачи сразу, в запросе (без воркера).
+TASKS_EAGER = False
+
+# Сколько секунд новая задача ждёт попутных (всплеск записей собирается в
+# одну пачку) и сколько задач воркер берёт за раз.
+TASKS_BATCH_DELAY = 0.5
+
+TASKS_BATCH_SIZE = 100
+
+# Попыток до переноса задачи в список неудачных и срок аренды задачи
+# воркером в секундах: задача упавшего воркера вернётся в очередь.
+TASKS_MAX_ATTEMPTS = 5
+
+TASKS_LEASE = 60
+
+# Новые комментарии копятся в Redis и пишутся в базу пачкой (ads_app/ingest.py):
+# задачей через TASKS_BATCH_DELAY или сразу, когда их набралось COMMENTS_FLUSH_SIZE.
+COMMENTS_BUFFERED = True
+
+COMMENTS_FLUSH_SIZE = 50
+
+# Корзины токенов для комментариев: (сколько подряд, за сколько секунд
+# восстанавливаются) на адрес посетителя и на объявление.
+COMMENT_RATE_LIMITS = {
+    'ip': (5, 60),
+    'advert': (60, 60),
+}
+
+# Прогрев кеша (manage.py warm_cache, ads_app/warmup.py): первые страницы ленты
+# и самые просматриваемые объявления. WARM_CACHE_ON_STARTUP — прогревать и при
+# запуске сервера, в фоне; из процессов, запущенных в течение
+# WARM_CACHE_STARTUP_INTERVAL секунд, прогревает один.
+WARM_CACHE_ON_STARTUP = False
+
+WARM_CACHE_STARTUP_INTERVAL = 60
+
+WARM_CACHE_PAGES = 5
+
+WARM_CACHE_TOP = 500
+
+# Как часто процесс отправляет накопленные просмотры объявлений в Redis, с.
+VIEWS_FLUSH_INTERVAL = 10
+
+ADVERTS_PAGE_SIZE = 12
+
+# Готовые страницы для гостей сбрасываются сигналами при изменении
+# объявлений; TTL страхует от гонок записи.
+PAGE_CACHE_TTL = 60 * 5
+
+# Замеры запросов (ads_app/metrics.py): заголовок Server-Timing и счётчики
+# Prometheus на /metrics, доступные только с METRICS_ALLOWED_IPS. У доли
+# METRICS_SAMPLE_RATE запросов сохраняется список запросов к базе; если
+# такой запрос дольше METRICS_SLOW_REQUEST секунд, список пишется в лог.
+METRICS_ENABLED = True
+
+METRICS_SERVER_TIMING = True
+
+METRICS_SAMPLE_RATE = 0.05
+
+METRICS_SLOW_REQUEST = 0.5
+
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
@@ -0,0 +1,22 @@
+# Настройки для тестов: python manage.py test --settings=ads_site.test_settings
+# База — SQLite в памяти, Redis — fakeredis (ads_app/tests/__init__.py),
+# фоновые задачи выполняются сразу.
+
+from ads_site.settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.test.sqlite3'),
+    }
+}
+
+MONGO_REPOSITORY = False
+
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+TASKS_EAGER = True
+
+METRICS_SAMPLE_RATE = 0
@@ -1,13 +1,12 @@
 # urls.py
 from django.contrib import admin
 from django.urls import include, path, re_path
-from django.conf.urls.static import static
-from django.conf import settings
-from django.views.static import serve
+from ads_app import media, metrics
 
+# Статику отдаёт WhiteNoiseMiddleware, загруженные файлы — ads_app.media.
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('ads_app.urls', namespace="ads_app")),
-    re_path(r'^static/(?P<path>.*)$', serve,{'document_root': settings.STATIC_ROOT}),
-    re_path(r'^media/(?P<path>.*)$', serve,{'document_root': settings.MEDIA_ROOT}),
+    re_path(r'^media/(?P<path>.*)$', media.serve),
+    path('metrics', metrics.export),
 ]